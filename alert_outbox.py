@@ -0,0 +1,213 @@
+import os
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from telegram_delivery import TelegramDelivery
+from utils import RenderedMessage
+from config import ALERT_OUTBOX_MAX_ATTEMPTS, ALERT_OUTBOX_RETENTION_DAYS
+
+ALERT_OUTBOX_DB_FILE_PATH = "./saved_data/outbox/alert_outbox.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    source TEXT NOT NULL,
+    chat_id TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    delivered_at REAL
+);
+CREATE INDEX IF NOT EXISTS outbox_pending_idx ON outbox (source, delivered_at, id);
+"""
+
+
+def encode_messages(messages):
+    # Pre-rendered messages must not be rendered again when replayed
+    return [
+        encode_messages(message) if isinstance(message, list) else {
+            "rendered": message
+        } if isinstance(message, RenderedMessage) else message
+        for message in messages
+    ]
+
+
+def decode_messages(messages):
+    return [
+        decode_messages(message) if isinstance(message, list) else
+        RenderedMessage(message["rendered"])
+        if isinstance(message, dict) else message for message in messages
+    ]
+
+
+class OutboxEntry:
+
+    def __init__(self, key, source, chat_id, priority, msg_list):
+        self.key = key
+        self.source = source
+        self.chat_id = str(chat_id)
+        self.priority = priority
+        self.msg_list = list(msg_list)
+        self.created_at = time.time()
+        self.row_id = None
+        self.committed = False
+        self.error = None
+
+
+class AlertOutbox:
+
+    # Durable queue in front of TelegramDelivery. An alert is committed to
+    # SQLite (WAL, synchronous=FULL) before it is queued for sending and
+    # marked delivered once Telegram accepted it, so alerts that were not
+    # delivered are sent again on the next start (at-least-once). Alerts
+    # added concurrently share one transaction, and so one fsync: the first
+    # producer commits everything queued while it holds the write. A repeated
+    # idempotency key is ignored. Each entry point uses its own source, so
+    # one never replays alerts the other is still sending.
+
+    def __init__(self,
+                 delivery,
+                 source,
+                 db_file_path=ALERT_OUTBOX_DB_FILE_PATH,
+                 max_attempts=ALERT_OUTBOX_MAX_ATTEMPTS,
+                 retention_days=ALERT_OUTBOX_RETENTION_DAYS):
+        db_dir = os.path.dirname(db_file_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self.delivery = delivery
+        self.source = source
+        self.db_file_path = db_file_path
+        self.max_attempts = max_attempts
+        self.retention_days = retention_days
+        self.conn = sqlite3.connect(db_file_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.executescript(SCHEMA)
+        self.db_lock = threading.Lock()
+        self.pending = []
+        self.committing = False
+        self.condition = threading.Condition()
+        self.commits = 0
+        self.committed_entries = 0
+        delivery.on_delivered = self.mark_delivered
+
+    def close(self):
+        with self.db_lock:
+            self.conn.close()
+
+    def add(self, msg_list, chat_id, priority, key=None):
+        # Returns False when the key was already in the outbox
+        entry = OutboxEntry(key or uuid.uuid4().hex, self.source, chat_id,
+                            priority, msg_list)
+        with self.condition:
+            self.pending.append(entry)
+            while not entry.committed:
+                if self.committing:
+                    self.condition.wait()
+                    continue
+                self.committing = True
+                batch, self.pending = self.pending, []
+                self.condition.release()
+                try:
+                    self.write_batch(batch)
+                finally:
+                    self.condition.acquire()
+                    self.committing = False
+                    for committed_entry in batch:
+                        committed_entry.committed = True
+                    self.condition.notify_all()
+
+        if entry.error is not None:
+            # Not durable, but still worth sending
+            print(f"Could not store alert in the outbox: {entry.error}")
+            return self.delivery.put(entry.msg_list, chat_id, priority)
+        if entry.row_id is None:
+            return False
+        return self.delivery.put(entry.msg_list,
+                                 chat_id,
+                                 priority,
+                                 key=entry.row_id)
+
+    def write_batch(self, batch):
+        try:
+            with self.db_lock, self.conn:
+                for entry in batch:
+                    cursor = self.conn.execute(
+                        "INSERT OR IGNORE INTO outbox (idempotency_key, source, chat_id, priority, payload, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                        (entry.key, entry.source, entry.chat_id,
+                         entry.priority,
+                         json.dumps(encode_messages(entry.msg_list),
+                                    ensure_ascii=False), entry.created_at))
+                    if cursor.rowcount:
+                        entry.row_id = cursor.lastrowid
+            self.commits += 1
+            self.committed_entries += len(batch)
+        except sqlite3.Error as e:
+            for entry in batch:
+                entry.error = e
+
+    def mark_delivered(self, row_ids, delivered):
+        # Called by the delivery thread for every sent (or failed) batch
+        if not row_ids:
+            return
+        try:
+            with self.db_lock, self.conn:
+                if delivered:
+                    self.conn.executemany(
+                        "UPDATE outbox SET delivered_at = ?, attempts = attempts + 1 WHERE id = ?",
+                        ((time.time(), row_id) for row_id in row_ids))
+                else:
+                    self.conn.executemany(
+                        "UPDATE outbox SET attempts = attempts + 1 WHERE id = ?",
+                        ((row_id, ) for row_id in row_ids))
+        except sqlite3.Error as e:
+            print(f"Could not update the alert outbox: {e}")
+
+    def replay(self):
+        # Queues the alerts a previous run of this source did not deliver
+        with self.db_lock:
+            rows = self.conn.execute(
+                "SELECT id, chat_id, priority, payload FROM outbox WHERE source = ? AND delivered_at IS NULL AND attempts < ? ORDER BY id",
+                (self.source, self.max_attempts)).fetchall()
+        for row_id, chat_id, priority, payload in rows:
+            self.delivery.put(decode_messages(json.loads(payload)),
+                              chat_id,
+                              priority,
+                              key=row_id)
+        if rows:
+            print(f"Resending {len(rows)} undelivered alert(s).")
+        return len(rows)
+
+    def prune(self):
+        cutoff = time.time() - self.retention_days * 86400
+        with self.db_lock, self.conn:
+            self.conn.execute(
+                "DELETE FROM outbox WHERE created_at < ? AND (delivered_at IS NOT NULL OR attempts >= ?)",
+                (cutoff, self.max_attempts))
+
+    def pending_count(self):
+        with self.db_lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM outbox WHERE source = ? AND delivered_at IS NULL AND attempts < ?",
+                (self.source, self.max_attempts)).fetchone()[0]
+
+
+def open_outbox(bot, source):
+    # One-shot delivery for scripts that exit once the messages are out,
+    # alerts left over from a previous run are queued first
+    delivery = TelegramDelivery(bot).start()
+    outbox = AlertOutbox(delivery, source)
+    outbox.replay()
+    return outbox
+
+
+def drain_outbox(outbox):
+    # Waits for every queued alert to be sent, then closes the outbox
+    outbox.delivery.stop(drain=True)
+    outbox.prune()
+    outbox.close()
+    return outbox.delivery.stats()
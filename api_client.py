@@ -0,0 +1,219 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import requests
+from requests.adapters import HTTPAdapter
+from rate_limiter import backoff_delay, parse_retry_after
+from config import (HTTP_POOL_SIZE, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT,
+                    MAX_RETRIES, RETRY_AFTER, BACKOFF_BASE)
+
+INFO_URL = "https://api.hyperliquid.xyz/info"
+VAULTS_LISTING_URL = "https://stats-data.hyperliquid.xyz/Mainnet/vaults"
+
+
+class LatencyStats:
+
+    def __init__(self):
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def record(self, endpoint, elapsed):
+        with self.lock:
+            stats = self.stats.get(endpoint)
+            if stats is None:
+                stats = {
+                    "count": 0,
+                    "total": 0.0,
+                    "min": float('inf'),
+                    "max": 0.0
+                }
+                self.stats[endpoint] = stats
+            stats["count"] += 1
+            stats["total"] += elapsed
+            stats["min"] = min(stats["min"], elapsed)
+            stats["max"] = max(stats["max"], elapsed)
+
+    def summary(self):
+        with self.lock:
+            return {
+                endpoint: dict(stats, mean=stats["total"] / stats["count"])
+                for endpoint, stats in self.stats.items()
+            }
+
+
+class HyperliquidAPIClient:
+
+    def __init__(self,
+                 pool_size=HTTP_POOL_SIZE,
+                 connect_timeout=HTTP_CONNECT_TIMEOUT,
+                 read_timeout=HTTP_READ_TIMEOUT,
+                 verify=False):
+        self.timeout = (connect_timeout, read_timeout)
+        self.verify = verify
+        self.latency_stats = LatencyStats()
+        self.adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        self.session.headers.update({
+            "Content-Type": "application/json",
+            "Accept-Encoding": "gzip, deflate",
+            "Connection": "keep-alive",
+        })
+
+    def request(self, method, url, endpoint, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        kwargs.setdefault("verify", self.verify)
+        start_time = time.perf_counter()
+        try:
+            return self.session.request(method, url, **kwargs)
+        finally:
+            self.latency_stats.record(endpoint,
+                                      time.perf_counter() - start_time)
+
+    def get(self, url, endpoint=None, **kwargs):
+        return self.request("GET", url, endpoint or url, **kwargs)
+
+    def post_info(self, payload, **kwargs):
+        return self.request("POST",
+                            INFO_URL,
+                            "info:" + payload.get("type", ""),
+                            json=payload,
+                            **kwargs)
+
+    def connections_opened(self):
+        pools = self.adapter.poolmanager.pools
+        return sum(pools[key].num_connections for key in pools.keys())
+
+    def print_latency_stats(self):
+        summary = self.latency_stats.summary()
+        if not summary:
+            return
+
+        print("\nAPI latency per endpoint ({} connection(s) opened):".format(
+            self.connections_opened()))
+        for endpoint, stats in sorted(summary.items()):
+            print(
+                "  {}: {} request(s), mean {:.3f}s, min {:.3f}s, max {:.3f}s".
+                format(endpoint, stats["count"], stats["mean"], stats["min"],
+                       stats["max"]))
+
+    def close(self):
+        self.session.close()
+
+
+_api_client = None
+_api_client_lock = threading.Lock()
+
+
+def get_api_client():
+    global _api_client
+
+    with _api_client_lock:
+        if _api_client is None:
+            _api_client = HyperliquidAPIClient()
+        return _api_client
+
+
+def is_retryable_status(status):
+    return status is None or status == 429 or status >= 500
+
+
+def request_info(payload, rate_limiter=None):
+    if rate_limiter:
+        rate_limiter.acquire(payload.get("type", ""))
+
+    try:
+        response = get_api_client().post_info(payload)
+    except requests.exceptions.RequestException as e:
+        return None, None, None, str(e)
+
+    if response.status_code == 200:
+        try:
+            return 200, response.json(), None, None
+        except ValueError as e:
+            # Truncated or non-JSON body, retried like a network error
+            return None, None, None, f"Invalid JSON response: {e}"
+
+    return (response.status_code, None, parse_retry_after(response.headers),
+            response.text)
+
+
+def fetch_info_batch(payloads,
+                     concurrency,
+                     rate_limiter=None,
+                     max_retries=MAX_RETRIES,
+                     verbose=True,
+                     on_result=None):
+    # payloads maps an arbitrary key to an info payload. Failed requests are
+    # re-queued at the back of the batch with a backoff deadline, so a
+    # throttled key never keeps a worker busy sleeping. on_result(key, data)
+    # is called as soon as each key completes, with None when it failed.
+    concurrency = max(1, concurrency)
+    results = {}
+    pending = deque((key, 0, 0.0) for key in payloads)
+    in_flight = {}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while pending or in_flight:
+            now = time.monotonic()
+            next_ready_at = None
+
+            for _ in range(len(pending)):
+                if len(in_flight) >= concurrency:
+                    break
+                key, attempt, not_before = pending.popleft()
+                if not_before > now:
+                    pending.append((key, attempt, not_before))
+                    if next_ready_at is None or not_before < next_ready_at:
+                        next_ready_at = not_before
+                    continue
+                future = executor.submit(request_info, payloads[key],
+                                         rate_limiter)
+                in_flight[future] = (key, attempt)
+
+            if not in_flight:
+                time.sleep(max(0, next_ready_at - time.monotonic()))
+                continue
+
+            timeout = None
+            if next_ready_at is not None:
+                timeout = max(0, next_ready_at - time.monotonic())
+            done, _ = wait(in_flight, timeout=timeout,
+                           return_when=FIRST_COMPLETED)
+
+            for future in done:
+                key, attempt = in_flight.pop(future)
+                status, data, retry_after, error = future.result()
+
+                if status == 200:
+                    if rate_limiter:
+                        rate_limiter.on_success()
+                    results[key] = data
+                    if on_result:
+                        on_result(key, data)
+                    continue
+
+                if status == 429 and rate_limiter:
+                    rate_limiter.on_throttled(retry_after)
+
+                attempt += 1
+                if not is_retryable_status(status) or attempt >= max_retries:
+                    if verbose:
+                        print("Query {} failed with {}: {}. Giving up.".format(
+                            key, status, error))
+                    results[key] = None
+                    if on_result:
+                        on_result(key, None)
+                    continue
+
+                delay = retry_after
+                if delay is None:
+                    delay = backoff_delay(attempt, BACKOFF_BASE, RETRY_AFTER)
+                if verbose:
+                    print("Query {} failed with {}. Re-queued ({}) in {:.2f} seconds..."
+                          .format(key, status, attempt, delay))
+                pending.append((key, attempt, time.monotonic() + delay))
+
+    return results
@@ -0,0 +1,270 @@
+import asyncio
+import inspect
+import json
+import logging
+import time
+from collections import defaultdict
+
+from rate_limiter import backoff_delay
+from websocket_manager import (ActiveSubscription, json_loads,
+                               subscription_to_identifier,
+                               ws_msg_to_identifier)
+
+from hyperliquid.utils.types import Any, Callable, Dict, List, Optional, Subscription, Tuple, WsMsg
+
+# The asyncio client is optional, only AsyncWebsocketManager needs it
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+
+class AsyncWebsocketManager:
+
+    # asyncio counterpart of WebsocketManager with the same
+    # subscribe/unsubscribe API. The connection, its ping timer and the
+    # callbacks run as tasks of the caller's event loop, so any number of
+    # managers can share a single thread. Callbacks run on the loop in
+    # message order; coroutine callbacks are awaited before the next frame
+    # is read, so they should hand slow work off to their own tasks.
+    # Reconnection works like WebsocketManager's: in place, with backoff,
+    # replaying active subscriptions.
+
+    def __init__(self,
+                 base_url,
+                 ping_interval=50,
+                 reconnect=True,
+                 reconnect_base_delay=1,
+                 reconnect_max_delay=60,
+                 max_reconnect_attempts=None,
+                 on_disconnect: Optional[Callable[[Any], None]] = None,
+                 on_reconnect: Optional[Callable[[int], None]] = None):
+        if websockets is None:
+            raise ImportError(
+                "AsyncWebsocketManager requires the websockets package (pip install websockets)"
+            )
+        self.ws_url = "ws" + base_url[len("http"):] + "/ws"
+        self.ping_interval = ping_interval
+        self.subscription_id_counter = 0
+        self.ws_ready = False
+        self.queued_subscriptions: List[Tuple[Subscription,
+                                              ActiveSubscription]] = []
+        self.active_subscriptions: Dict[
+            str, List[ActiveSubscription]] = defaultdict(list)
+        # identifier -> subscription, to replay active subscriptions
+        self.subscriptions: Dict[str, Subscription] = {}
+        self.ws = None
+        self.outgoing: asyncio.Queue = asyncio.Queue()
+        self.task: Optional[asyncio.Task] = None
+        self.stop_event = asyncio.Event()
+        self.reconnect = reconnect
+        self.reconnect_base_delay = reconnect_base_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        self.max_reconnect_attempts = max_reconnect_attempts
+        self.on_disconnect = on_disconnect
+        self.on_reconnect = on_reconnect
+        self.connection_count = 0
+        self.reconnect_attempts = 0
+
+    def start(self) -> asyncio.Task:
+        self.task = asyncio.get_running_loop().create_task(self.run())
+        return self.task
+
+    def is_alive(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    async def run(self):
+        while not self.stop_event.is_set():
+            connected_at = time.monotonic()
+            error = None
+            try:
+                await self.run_connection()
+            except (OSError, asyncio.TimeoutError,
+                    websockets.WebSocketException) as e:
+                error = e
+            was_ready = self.ws_ready
+            self.ws_ready = False
+            if self.stop_event.is_set():
+                break
+            if was_ready:
+                if self.on_disconnect:
+                    self.on_disconnect(error)
+                # Only back off from scratch after a connection that held
+                if time.monotonic() - connected_at > self.reconnect_max_delay:
+                    self.reconnect_attempts = 0
+            if not self.reconnect or (
+                    self.max_reconnect_attempts is not None and
+                    self.reconnect_attempts >= self.max_reconnect_attempts):
+                if error is not None:
+                    raise error
+                break
+            delay = backoff_delay(self.reconnect_attempts,
+                                  self.reconnect_base_delay,
+                                  self.reconnect_max_delay)
+            self.reconnect_attempts += 1
+            print("Websocket disconnected, reconnect attempt {} in {:.1f}s".
+                  format(self.reconnect_attempts, delay))
+            try:
+                await asyncio.wait_for(self.stop_event.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run_connection(self):
+        async with websockets.connect(self.ws_url,
+                                      ping_interval=None,
+                                      compression=None,
+                                      max_size=None) as ws:
+            self.ws = ws
+            if self.stop_event.is_set():
+                return
+            # Requests queued for the previous connection are covered by
+            # the replay in on_open
+            self.outgoing = asyncio.Queue()
+            self.on_open()
+            sender = asyncio.create_task(self.send_outgoing())
+            ping_sender = asyncio.create_task(self.send_ping())
+            try:
+                async for message in ws:
+                    await self.on_message(message)
+            except websockets.ConnectionClosedOK as e:
+                logging.debug("Websocket connection closed: %s", e)
+            finally:
+                sender.cancel()
+                ping_sender.cancel()
+
+    async def send_outgoing(self):
+        # A single writer keeps subscribe/unsubscribe requests in call order
+        while True:
+            message = await self.outgoing.get()
+            await self.ws.send(message)
+
+    async def send_ping(self):
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            logging.debug("Websocket sending ping")
+            self.send_json({"method": "ping"})
+
+    async def stop(self):
+        self.stop_event.set()
+        if self.ws is not None:
+            await self.ws.close()
+        if self.task is not None and self.task is not asyncio.current_task():
+            try:
+                await self.task
+            except (OSError, asyncio.TimeoutError, asyncio.CancelledError,
+                    websockets.WebSocketException) as e:
+                logging.debug("Websocket task stopped: %s", e)
+
+    def send_json(self, data: Any):
+        self.outgoing.put_nowait(json.dumps(data))
+
+    async def on_message(self, message):
+        if message == "Websocket connection established.":
+            logging.debug(message)
+            return
+        logging.debug("on_message %s", message)
+        ws_msg: WsMsg = json_loads(message)
+        identifier = ws_msg_to_identifier(ws_msg)
+        if identifier == "pong":
+            logging.debug("Websocket received pong")
+            return
+        if identifier is None:
+            logging.debug("Websocket not handling empty message")
+            return
+        active_subscriptions = self.active_subscriptions[identifier]
+        if len(active_subscriptions) == 0:
+            print("Websocket message from an unexpected subscription:",
+                  message, identifier)
+            return
+        for active_subscription in active_subscriptions:
+            # A failing callback must not end the receive loop, which would
+            # drop the connection without a reconnect
+            try:
+                result = active_subscription.callback(ws_msg)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:
+                logging.exception("Websocket callback for %s failed",
+                                  identifier)
+
+    def on_open(self):
+        logging.debug("on_open")
+        self.ws_ready = True
+        self.connection_count += 1
+        # Replay what was active on the previous connection, then what was
+        # subscribed while disconnected
+        for identifier, active_subscriptions in self.active_subscriptions.items(
+        ):
+            if active_subscriptions:
+                self.send_json({
+                    "method": "subscribe",
+                    "subscription": self.subscriptions[identifier]
+                })
+        queued_subscriptions = self.queued_subscriptions
+        self.queued_subscriptions = []
+        for subscription, active_subscription in queued_subscriptions:
+            self.subscribe(subscription, active_subscription.callback,
+                           active_subscription.subscription_id)
+        if self.connection_count > 1:
+            print("Websocket reconnected after {} attempt(s)".format(
+                self.reconnect_attempts))
+            if self.on_reconnect:
+                self.on_reconnect(self.reconnect_attempts)
+
+    def subscribe(self,
+                  subscription: Subscription,
+                  callback: Callable[[Any], Any],
+                  subscription_id: Optional[int] = None,
+                  overflow_policy: Optional[str] = None) -> int:
+        # overflow_policy is accepted for WebsocketManager compatibility,
+        # callbacks are not queued here
+        if subscription_id is None:
+            self.subscription_id_counter += 1
+            subscription_id = self.subscription_id_counter
+        if not self.ws_ready:
+            logging.debug("enqueueing subscription")
+            self.queued_subscriptions.append(
+                (subscription, ActiveSubscription(callback, subscription_id)))
+        else:
+            logging.debug("subscribing")
+            identifier = subscription_to_identifier(subscription)
+            if identifier == "userEvents" or identifier == "orderUpdates":
+                if len(self.active_subscriptions[identifier]) != 0:
+                    raise NotImplementedError(
+                        f"Cannot subscribe to {identifier} multiple times")
+            self.subscriptions[identifier] = subscription
+            self.active_subscriptions[identifier].append(
+                ActiveSubscription(callback, subscription_id))
+            self.send_json({
+                "method": "subscribe",
+                "subscription": subscription
+            })
+        return subscription_id
+
+    def unsubscribe(self, subscription: Subscription,
+                    subscription_id: int) -> bool:
+        identifier = subscription_to_identifier(subscription)
+        active_subscriptions = self.active_subscriptions[identifier]
+        new_active_subscriptions = [
+            x for x in active_subscriptions
+            if x.subscription_id != subscription_id
+        ]
+        queued_subscriptions = [
+            x for x in self.queued_subscriptions
+            if x[1].subscription_id != subscription_id
+        ]
+        removed = (len(active_subscriptions) != len(new_active_subscriptions)
+                   or len(queued_subscriptions) != len(
+                       self.queued_subscriptions))
+        self.queued_subscriptions = queued_subscriptions
+        # Before the first connection or while disconnected, dropping it from
+        # the queued and active subscriptions is enough to keep it from being
+        # sent or replayed
+        if (active_subscriptions and len(new_active_subscriptions) == 0
+                and self.ws_ready):
+            self.send_json({
+                "method": "unsubscribe",
+                "subscription": subscription
+            })
+        self.active_subscriptions[identifier] = new_active_subscriptions
+        return removed
@@ -0,0 +1,714 @@
+import os
+import sys
+import json
+import time
+import threading
+import random
+import asyncio
+import argparse
+import subprocess
+from positions import compute_differences, aggregate_positions
+
+BENCHMARK_COINS = ["COIN{}".format(i) for i in range(200)]
+
+
+def time_it(func, *args, repeat=3):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start_time)
+    return best, result
+
+
+def make_snapshot(n_vaults, positions_per_vault, seed=0):
+    rng = random.Random(seed)
+    snapshot = {}
+    for i in range(n_vaults):
+        positions = {}
+        for coin in rng.sample(BENCHMARK_COINS, positions_per_vault):
+            size = rng.uniform(-100, 100)
+            positions[coin] = {
+                "leverage": float(rng.choice([1, 2, 3, 5, 10])),
+                "position_value": abs(size) * 10,
+                "size": size,
+                "unrealised_pnl": rng.uniform(-50, 50),
+                "direction": "LONG" if size >= 0 else "SHORT"
+            }
+        snapshot["0x{:040x}".format(i)] = {
+            "vault_name": "Vault {}".format(i),
+            "vault_tvl": rng.uniform(1e5, 1e7),
+            "vault_apr": rng.uniform(-50, 100),
+            "positions": positions,
+        }
+    return snapshot
+
+
+def mutate_snapshot(snapshot, change_ratio, seed=1):
+    rng = random.Random(seed)
+    updated = {}
+    for vault_address, vault in snapshot.items():
+        positions = dict(vault["positions"])
+        for coin in list(positions):
+            if rng.random() >= change_ratio:
+                continue
+            action = rng.choice(["close", "flip", "leverage", "open"])
+            if action == "close":
+                del positions[coin]
+            elif action == "flip":
+                size = -positions[coin]["size"]
+                positions[coin] = dict(
+                    positions[coin],
+                    size=size,
+                    direction="LONG" if size >= 0 else "SHORT")
+            elif action == "leverage":
+                positions[coin] = dict(positions[coin],
+                                       leverage=positions[coin]["leverage"] +
+                                       1)
+            else:
+                new_coin = rng.choice(BENCHMARK_COINS)
+                if new_coin not in positions:
+                    positions[new_coin] = dict(positions[coin])
+        updated[vault_address] = dict(vault, positions=positions)
+    return updated
+
+
+def compute_differences_loop(tracked_snapshot, updated_snapshot):
+    # Reference implementation, the original nested dict loops without size
+    # change alerts
+    differences = {}
+
+    for vault_address, updated_vault in updated_snapshot.items():
+        updated_positions = updated_vault.get("positions", {})
+        tracked_positions = tracked_snapshot.get(vault_address,
+                                                 {}).get("positions", {})
+
+        changed_positions = {}
+
+        for coin, updated_position in updated_positions.items():
+            tracked_position = tracked_positions.get(coin)
+
+            if tracked_position:
+                if (updated_position["leverage"]
+                        != tracked_position["leverage"]
+                        or updated_position["direction"]
+                        != tracked_position["direction"]):
+                    changed_positions[coin] = {
+                        "before": tracked_position,
+                        "after": updated_position
+                    }
+            else:
+                changed_positions[coin] = {
+                    "before": {},
+                    "after": updated_position
+                }
+
+        for coin, tracked_position in tracked_positions.items():
+            if coin not in updated_positions:
+                changed_positions[coin] = {
+                    "before": tracked_position,
+                    "after": {}
+                }
+
+        if changed_positions:
+            differences[vault_address] = {
+                "vault_name": updated_vault["vault_name"],
+                "vault_tvl": updated_vault["vault_tvl"],
+                "vault_apr": updated_vault["vault_apr"],
+                "positions": changed_positions
+            }
+
+    return differences
+
+
+def benchmark_diff(args):
+    print("\nPosition diff ({} positions per vault, {:.0%} changed):".format(
+        args.positions, args.change_ratio))
+    for n_vaults in args.vaults:
+        tracked = make_snapshot(n_vaults, args.positions)
+        updated = mutate_snapshot(tracked, args.change_ratio)
+
+        loop_time, loop_differences = time_it(compute_differences_loop,
+                                              tracked, updated)
+        diff_time, differences = time_it(compute_differences, tracked,
+                                         updated)
+        size_change_time, _ = time_it(compute_differences, tracked, updated,
+                                      args.size_change_pct)
+
+        # Per vault, as the daemon diffs each vault when its state arrives
+        vault_pairs = [({
+            vault_address: tracked[vault_address]
+        }, {
+            vault_address: vault
+        }) for vault_address, vault in updated.items()]
+        per_vault_time, _ = time_it(
+            lambda: [compute_differences(*pair) for pair in vault_pairs])
+
+        if (differences != loop_differences
+                or list(differences) != list(loop_differences)):
+            print("  {} vaults: results do not match!".format(n_vaults))
+            continue
+
+        print(
+            "  {:>6} vaults / {:>7} positions: reference loop {:8.2f} ms, compute_differences {:8.2f} ms ({:8.2f} ms with size changes, {:8.2f} ms one vault at a time)"
+            .format(n_vaults, n_vaults * args.positions, loop_time * 1000,
+                    diff_time * 1000, size_change_time * 1000,
+                    per_vault_time * 1000))
+
+
+def aggregate_positions_loop(snapshot, min_vault_apr):
+    # Reference implementation, the per-position counters that
+    # aggregate_positions extends with notional and weighted exposure
+    total_long_positions_value = 0
+    total_short_positions_value = 0
+    long_short_counter = {"LONG": {}, "SHORT": {}}
+
+    for vault in snapshot.values():
+        for coin, position in vault["positions"].items():
+            direction = position["direction"]
+            if direction == "LONG":
+                total_long_positions_value += position["position_value"]
+            else:
+                total_short_positions_value += position["position_value"]
+            if vault["vault_apr"] >= min_vault_apr:
+                counter = long_short_counter[direction]
+                counter[coin] = counter.get(coin, 0) + 1
+
+    return (total_long_positions_value, total_short_positions_value,
+            long_short_counter)
+
+
+def benchmark_aggregate(args):
+    print("\nLong/short aggregation ({} positions per vault):".format(
+        args.positions))
+    for n_vaults in args.vaults:
+        snapshot = make_snapshot(n_vaults, args.positions)
+
+        loop_time, (_, _, loop_counter) = time_it(aggregate_positions_loop,
+                                                  snapshot, 10)
+        aggregate_time, aggregation = time_it(aggregate_positions, snapshot,
+                                              10, args.top_k)
+
+        if aggregation["long_short_counter"] != loop_counter:
+            print("  {} vaults: results do not match!".format(n_vaults))
+            continue
+
+        print(
+            "  {:>6} vaults / {:>7} positions: counters only {:8.2f} ms, with notional and weighted exposure {:8.2f} ms"
+            .format(n_vaults, n_vaults * args.positions, loop_time * 1000,
+                    aggregate_time * 1000))
+
+
+def make_report_updates(n_vaults, changes_per_vault, seed=0):
+    rng = random.Random(seed)
+    updates = []
+    for i in range(n_vaults):
+        positions = {}
+        for coin in rng.sample(BENCHMARK_COINS, changes_per_vault):
+            before = rng.choice([{}, {
+                "leverage": rng.randint(1, 50),
+                "direction": rng.choice(["LONG", "SHORT"])
+            }])
+            after = rng.choice([{}, {
+                "leverage": rng.randint(1, 50),
+                "direction": rng.choice(["LONG", "SHORT"])
+            }])
+            positions[coin] = {"before": before, "after": after}
+        updates.append(("0x{:040x}".format(i), {
+            # Plain names, the legacy escaping mangles dots and parentheses
+            "vault_name": "Vault {}".format(i),
+            "vault_tvl": rng.uniform(1e5, 1e8),
+            "vault_apr": rng.uniform(-50, 200),
+            "positions": positions
+        }))
+    return updates
+
+
+def report_coin_values(updates):
+    before = updates.get('before', {})
+    after = updates.get('after', {})
+    return {
+        "dot": "🟢" if after.get("direction") == "LONG" else "🔴",
+        "before_leverage": before.get("leverage", "OPENED"),
+        "after_leverage": after.get("leverage", "CLOSED"),
+        "before_direction": before.get("direction", "OPENED"),
+        "after_direction": after.get("direction", "CLOSED"),
+    }
+
+
+def build_report_legacy(vault_updates):
+    # Reference implementation, markdown fragments converted on every send
+    # and chunks built by string concatenation
+    import re
+    import textwrap
+    import telegramify_markdown
+
+    tg_msg_list = []
+    for vault_address, vault in vault_updates:
+        escaped_vault_name = re.escape(vault["vault_name"]).replace(r'\ ', ' ')
+        tg_msg_list.append(f"*_**📌 Vault: {escaped_vault_name}**_*\n"
+                           f"_**🔗 Address: `{vault_address}`**_\n"
+                           f"💰 TVL: {vault['vault_tvl']:,.2f} USD\n"
+                           f"📈 APR: {vault['vault_apr']:,.2f}%")
+        for coin, updates in vault["positions"].items():
+            values = report_coin_values(updates)
+            escaped_coin = re.escape(coin).replace(r'\ ', ' ')
+            tg_msg_list.append(
+                f"\n{values['dot']} *Coin: {escaped_coin}*\n"
+                f"• Leverage: {values['before_leverage']} → {values['after_leverage']}\n"
+                f"• Direction: {values['before_direction']} → {values['after_direction']}"
+            )
+        tg_msg_list.append(f"{'_'*32}\n")
+
+    chunks = []
+    current_chunk = ""
+    for message in tg_msg_list:
+        can_be_sent = telegramify_markdown.markdownify(
+            textwrap.dedent(message))
+        if len(current_chunk) + len(can_be_sent) <= 4096:
+            current_chunk += can_be_sent + "\n"
+        else:
+            chunks.append(current_chunk.strip())
+            current_chunk = can_be_sent + "\n"
+    if current_chunk:
+        chunks.append(current_chunk.strip())
+    return chunks
+
+
+def build_report_templated(vault_updates):
+    from utils import chunk_message
+    from get_vaults_updates import VAULT_HEADER_TEMPLATE, COIN_UPDATE_TEMPLATE
+
+    tg_msg_list = []
+    for vault_address, vault in vault_updates:
+        vault_section = [
+            VAULT_HEADER_TEMPLATE.render(vault_name=vault["vault_name"],
+                                         vault_address=vault_address,
+                                         vault_tvl=vault["vault_tvl"],
+                                         vault_apr=vault["vault_apr"])
+        ]
+        for coin, updates in vault["positions"].items():
+            vault_section.append(
+                COIN_UPDATE_TEMPLATE.render(coin=coin,
+                                            **report_coin_values(updates)))
+        vault_section.append(f"{'_'*32}\n")
+        tg_msg_list.append(vault_section)
+    return chunk_message(tg_msg_list)
+
+
+def benchmark_report(args):
+    from utils import render_markdown, telegram_length
+    # Loads the templates, they are built once per process
+    build_report_templated([])
+
+    print("\nVault update report rendering ({} changed positions per vault):".
+          format(args.changes))
+    for n_vaults in args.vaults:
+        vault_updates = make_report_updates(n_vaults, args.changes)
+
+        legacy_time, legacy_chunks = time_it(build_report_legacy,
+                                             vault_updates)
+
+        def build_cold():
+            render_markdown.cache_clear()
+            return build_report_templated(vault_updates)
+
+        templated_time, templated_chunks = time_it(build_cold)
+        cached_time, _ = time_it(build_report_templated, vault_updates)
+
+        # Chunks are cut in different places, vault sections are kept
+        # together and lengths are counted in UTF-16 code units
+        if "".join("".join(templated_chunks).split()) != "".join(
+                "".join(legacy_chunks).split()):
+            print("  {} vaults: rendered reports do not match!".format(
+                n_vaults))
+            continue
+
+        print(
+            "  {:>6} vaults / {:>6} fragments: markdown per send {:8.2f} ms in {:>4} chunks (max {} UTF-16 units), templates {:8.2f} ms in {:>4} chunks (warm cache {:8.2f} ms)"
+            .format(n_vaults, n_vaults * (args.changes + 2),
+                    legacy_time * 1000, len(legacy_chunks),
+                    max(map(telegram_length, legacy_chunks)),
+                    templated_time * 1000, len(templated_chunks),
+                    cached_time * 1000))
+
+
+SAMPLE_WS_USER = "0x31ca8395cf837de08b24da3f660e77761dfb974b"
+
+
+def make_ws_frames():
+    # Frames shaped like the recorded userFills, l2Book and trades payloads
+    fill = {
+        "coin": "BTC",
+        "px": "67321.0",
+        "sz": "0.015",
+        "side": "B",
+        "time": 1718000000000,
+        "startPosition": "0.0",
+        "dir": "Open Long",
+        "closedPnl": "0.0",
+        "hash": "0x" + "ab" * 32,
+        "oid": 1234567890,
+        "crossed": True,
+        "fee": "0.35",
+        "tid": 987654321,
+        "feeToken": "USDC",
+    }
+    user_fills = {
+        "channel": "userFills",
+        "data": {
+            "user": SAMPLE_WS_USER,
+            "fills": [fill] * 5
+        }
+    }
+    l2_book = {
+        "channel": "l2Book",
+        "data": {
+            "coin": "ETH",
+            "time": 1718000000000,
+            "levels": [[{
+                "px": str(3500 - i * 0.1),
+                "sz": "1.5",
+                "n": 3
+            } for i in range(20)],
+                       [{
+                           "px": str(3500 + i * 0.1),
+                           "sz": "2.5",
+                           "n": 2
+                       } for i in range(20)]]
+        }
+    }
+    trades = {
+        "channel":
+        "trades",
+        "data": [{
+            "coin": "SOL",
+            "side": "A",
+            "px": "145.2",
+            "sz": "10",
+            "hash": "0x" + "cd" * 32,
+            "time": 1718000000000,
+            "tid": 1000 + i,
+            "users": [SAMPLE_WS_USER, SAMPLE_WS_USER]
+        } for i in range(10)]
+    }
+    return [
+        json.dumps(user_fills),
+        json.dumps(l2_book),
+        json.dumps(trades),
+    ]
+
+
+def benchmark_websocket(args):
+    import websocket_manager
+    from websocket_manager import WebsocketManager
+
+    frames = make_ws_frames() * (args.frames // 3)
+    decoders = [("default", websocket_manager.json_loads),
+                ("stdlib json", json.loads)]
+
+    print("\nWebsocketManager.on_message throughput ({} frames):".format(
+        len(frames)))
+    for decoder_name, decoder in decoders:
+        websocket_manager.json_loads = decoder
+        ws_manager = WebsocketManager("http://localhost")
+        for subscription in [{
+                "type": "userFills",
+                "user": SAMPLE_WS_USER
+        }, {
+                "type": "l2Book",
+                "coin": "ETH"
+        }, {
+                "type": "trades",
+                "coin": "SOL"
+        }]:
+            ws_manager.active_subscriptions[
+                websocket_manager.subscription_to_identifier(
+                    subscription)].append(
+                        websocket_manager.ActiveSubscription(
+                            lambda ws_msg: None, 0))
+
+        def dispatch():
+            for frame in frames:
+                ws_manager.on_message(None, frame)
+
+        elapsed, _ = time_it(dispatch)
+        print("  {:<12} ({}): {:>10,.0f} frames/s".format(
+            decoder_name, decoder.__module__, len(frames) / elapsed))
+
+    websocket_manager.json_loads = decoders[0][1]
+
+
+def benchmark_pool(args):
+    from ws_standin_server import StandinWebsocketServer
+    from websocket_pool import WebsocketPool
+
+    server = StandinWebsocketServer().start()
+    pool = WebsocketPool(server.base_url,
+                         shards=args.shards,
+                         check_interval=0.5,
+                         reconnect=not args.no_reconnect)
+    pool.start()
+
+    users = ["0x{:040x}".format(i) for i in range(args.addresses)]
+    received = {}
+    received_lock = threading.Lock()
+
+    def on_fill(ws_msg):
+        with received_lock:
+            user = ws_msg["data"]["user"]
+            received[user] = received.get(user, 0) + 1
+
+    for user in users:
+        pool.subscribe({"type": "userFills", "user": user}, on_fill)
+
+    def publish_round():
+        start_time = time.perf_counter()
+        for _ in range(args.fills):
+            for user in users:
+                server.publish_user_fill(user, {"coin": "BTC", "tid": 1})
+        expected = len(users) * args.fills
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            with received_lock:
+                total = sum(received.values())
+            if total >= expected:
+                break
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - start_time
+        with received_lock:
+            total = sum(received.values())
+            received.clear()
+        return total, expected, elapsed
+
+    def print_round(title):
+        total, expected, elapsed = publish_round()
+        print("\n{}: {}/{} fills in {:.2f}s ({:,.0f} fills/s)".format(
+            title, total, expected, elapsed, total / elapsed))
+        for shard_id, stats in pool.get_shard_stats().items():
+            print(
+                "  shard {}: alive={} subscriptions={} messages={} ({:,.0f} msg/s)"
+                .format(shard_id, stats["alive"], stats["subscriptions"],
+                        stats["messages"], stats["messages_per_second"]))
+
+    server.wait_for_subscriptions(len(users))
+    pool.get_shard_stats()
+    print_round("{} addresses over {} shards".format(len(users),
+                                                     args.shards))
+
+    # Kill the connection of one shard server-side. Its manager reconnects in
+    # place, or with --no-reconnect the pool moves its subscriptions to the
+    # other shards
+    connections = server.get_connections()
+    if connections:
+        connections[0].close()
+        time.sleep(2)
+        server.wait_for_subscriptions(len(users))
+        print_round("After killing one shard")
+
+    pool.stop()
+    server.stop()
+
+
+def read_rss_bytes():
+    # Resident set size from /proc (Linux only, 0 elsewhere)
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def wait_until(condition, timeout=60):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+async def wait_until_async(condition, timeout=60):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+
+
+def connections_client_threaded(args, users, on_fill, on_connected,
+                                all_received):
+    from websocket_manager import WebsocketManager
+
+    managers = []
+    for user in users:
+        manager = WebsocketManager(args.url)
+        manager.start()
+        manager.subscribe({"type": "userFills", "user": user}, on_fill)
+        managers.append(manager)
+    wait_until(lambda: all(manager.ws_ready for manager in managers))
+    on_connected()
+    cpu_start = time.process_time()
+    wait_until(all_received)
+    cpu_used = time.process_time() - cpu_start
+    for manager in managers:
+        manager.stop()
+    return cpu_used
+
+
+async def connections_client_asyncio(args, users, on_fill, on_connected,
+                                     all_received):
+    from async_websocket_manager import AsyncWebsocketManager
+
+    managers = []
+    for user in users:
+        manager = AsyncWebsocketManager(args.url)
+        manager.start()
+        manager.subscribe({"type": "userFills", "user": user}, on_fill)
+        managers.append(manager)
+    await wait_until_async(
+        lambda: all(manager.ws_ready for manager in managers))
+    on_connected()
+    cpu_start = time.process_time()
+    await wait_until_async(all_received)
+    cpu_used = time.process_time() - cpu_start
+    for manager in managers:
+        await manager.stop()
+    return cpu_used
+
+
+def benchmark_connections_client(args):
+    # Runs in its own process so that the stand-in server does not count
+    # towards the measured CPU time and memory. Both managers are imported
+    # up front so that module imports do not count as connection memory.
+    import websocket_manager
+    import async_websocket_manager
+
+    users = ["0x{:040x}".format(i) for i in range(args.connections)]
+    expected = args.connections * args.fills
+    received = [0]
+    result = {"expected": expected}
+    rss_before = read_rss_bytes()
+    threads_before = threading.active_count()
+
+    def on_fill(ws_msg):
+        received[0] += len(ws_msg["data"]["fills"])
+
+    def all_received():
+        return received[0] >= expected
+
+    def on_connected():
+        result["threads"] = threading.active_count() - threads_before
+        result["rss_per_connection"] = (read_rss_bytes() -
+                                        rss_before) / len(users)
+        print("ready", flush=True)
+
+    if args.mode == "threaded":
+        cpu_used = connections_client_threaded(args, users, on_fill,
+                                               on_connected, all_received)
+    else:
+        cpu_used = asyncio.run(
+            connections_client_asyncio(args, users, on_fill, on_connected,
+                                       all_received))
+    result["received"] = received[0]
+    result["cpu_per_message"] = cpu_used / max(1, received[0])
+    print(json.dumps(result), flush=True)
+
+
+def benchmark_connections(args):
+    from ws_standin_server import StandinWebsocketServer
+
+    server = StandinWebsocketServer().start()
+    users = ["0x{:040x}".format(i) for i in range(args.connections)]
+    print("{} connections, {} fills each".format(args.connections,
+                                                 args.fills))
+
+    for mode in ("threaded", "asyncio"):
+        client = subprocess.Popen([
+            sys.executable, __file__, "connections-client", "--mode", mode,
+            "--url", server.base_url, "--connections",
+            str(args.connections), "--fills",
+            str(args.fills)
+        ],
+                                  stdout=subprocess.PIPE,
+                                  text=True)
+        if client.stdout.readline().strip() != "ready":
+            print("{}: client failed to connect".format(mode))
+            client.wait()
+            continue
+        server.wait_for_subscriptions(args.connections)
+        for _ in range(args.fills):
+            for user in users:
+                server.publish_user_fill(user, {"coin": "BTC", "tid": 1})
+        output, _ = client.communicate()
+        result = json.loads(output.strip().splitlines()[-1])
+        print(
+            "  {:<9} {:>5} threads  {:>8.1f} KiB RSS/connection  {:>6.1f} us CPU/message  ({}/{} fills)"
+            .format(mode, result["threads"],
+                    result["rss_per_connection"] / 1024,
+                    result["cpu_per_message"] * 1e6, result["received"],
+                    result["expected"]))
+
+    server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run micro-benchmarks.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    diff_parser = subparsers.add_parser(
+        "diff", help="Position diff, whole snapshot and per vault")
+    diff_parser.add_argument('--vaults',
+                             type=int,
+                             nargs='+',
+                             default=[100, 1000, 10000])
+    diff_parser.add_argument('--positions', type=int, default=5)
+    diff_parser.add_argument('--change-ratio', type=float, default=0.1)
+    diff_parser.add_argument('--size-change-pct', type=float, default=10)
+    diff_parser.set_defaults(func=benchmark_diff)
+
+    aggregate_parser = subparsers.add_parser(
+        "aggregate", help="Long/short aggregation")
+    aggregate_parser.add_argument('--vaults',
+                                  type=int,
+                                  nargs='+',
+                                  default=[100, 1000, 10000])
+    aggregate_parser.add_argument('--positions', type=int, default=5)
+    aggregate_parser.add_argument('--top-k', type=int, default=5)
+    aggregate_parser.set_defaults(func=benchmark_aggregate)
+
+    report_parser = subparsers.add_parser(
+        "report", help="Templated vs per-send markdown vault report rendering")
+    report_parser.add_argument('--vaults',
+                               type=int,
+                               nargs='+',
+                               default=[100, 1000])
+    report_parser.add_argument('--changes', type=int, default=3)
+    report_parser.set_defaults(func=benchmark_report)
+
+    websocket_parser = subparsers.add_parser(
+        "websocket", help="WebsocketManager.on_message frames per second")
+    websocket_parser.add_argument('--frames', type=int, default=30000)
+    websocket_parser.set_defaults(func=benchmark_websocket)
+
+    pool_parser = subparsers.add_parser(
+        "pool", help="Sharded websocket pool against a local stand-in server")
+    pool_parser.add_argument('--shards', type=int, default=4)
+    pool_parser.add_argument('--addresses', type=int, default=500)
+    pool_parser.add_argument('--fills', type=int, default=10)
+    pool_parser.add_argument('--no-reconnect', action='store_true')
+    pool_parser.set_defaults(func=benchmark_pool)
+
+    connections_parser = subparsers.add_parser(
+        "connections",
+        help="Threaded vs asyncio WebsocketManager CPU and memory per connection")
+    connections_parser.add_argument('--connections', type=int, default=100)
+    connections_parser.add_argument('--fills', type=int, default=50)
+    connections_parser.set_defaults(func=benchmark_connections)
+
+    connections_client_parser = subparsers.add_parser("connections-client")
+    connections_client_parser.add_argument('--mode',
+                                           choices=["threaded", "asyncio"])
+    connections_client_parser.add_argument('--url')
+    connections_client_parser.add_argument('--connections', type=int)
+    connections_client_parser.add_argument('--fills', type=int)
+    connections_client_parser.set_defaults(func=benchmark_connections_client)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -41,16 +41,60 @@ else:
 
 TIMEZONE = 'Asia/Singapore'
 MIN_VAULT_TVL = 1e5
+MAX_TRACKED_VAULTS = None  # None tracks every vault above MIN_VAULT_TVL
 MIN_VAULT_APR = 10  # in %
+APR_PRUNE_MARGIN = 5  # in %, vaults estimated below MIN_VAULT_APR - margin are not fetched
+FULL_VAULT_COLLECTION = False
+VAULT_LISTING_CACHE_TTL = 300  # in seconds
+SNAPSHOT_RETENTION_RUNS = 1000  # snapshot runs kept in the history store, 0 keeps every run
+SNAPSHOT_RETENTION_DAYS = 30  # 0 keeps runs of any age
 MAX_RETRIES = 10
 RETRY_AFTER = 10
+FETCH_CONCURRENCY = 8
+MAX_REQUESTS_PER_SECOND = 10
+INFO_WEIGHT_PER_MINUTE = 1200
+BACKOFF_BASE = 0.5
+HTTP_POOL_SIZE = 16
+HTTP_CONNECT_TIMEOUT = 5
+HTTP_READ_TIMEOUT = 30
 MIN_POSITION_COUNTS = 3
+TOP_K_COINS = 5
+SIZE_CHANGE_ALERT_PCT = None  # in %, None only reports leverage and direction changes
+VAULT_POLL_MIN_INTERVAL = 15  # in seconds, --daemon only
+VAULT_POLL_MAX_INTERVAL = 300  # in seconds
+VAULT_POLL_TVL_BOOST = 4  # the largest vault is polled up to 1 + VAULT_POLL_TVL_BOOST times as often
+VAULT_POLL_CHURN_DECAY = 0.5  # applied to a vault's churn on every poll without a change
+VAULT_DAEMON_SAVE_INTERVAL = 300  # in seconds, between snapshots when positions changed
+VAULT_DAEMON_SUMMARY_INTERVAL = 3600  # in seconds, 0 disables the periodic summary
+VAULT_RECONCILE_INTERVAL = 1800  # in seconds, --websocket only
+VAULT_WS_SHARDS = 4
 EXCLUDED_VAULT_ADDRESSES = [
     "0xdfc24b077bc1425ad1dea75bcb6f8158e10df303",  # Hyperliquidity Provider (HLP)
     "0x010461c14e146ac35fe42271bdc1134ee31c703a",  # HLP Strategy A
     "0x2e3d94f0562703b25c83308a05046ddaf9a8dd14",  # HLP Liquidator
     "0x31ca8395cf837de08b24da3f660e77761dfb974b",  # HLP Strategy B
 ]
-SUBSCRIPTION_TYPE = 'userFills'
+SUBSCRIPTION_TYPE = 'userFills'  # comma-separated: userFills, orderUpdates, userFundings
+WS_DISPATCH_MODE = 'queued'  # 'inline' runs callbacks on the websocket thread
+WS_DISPATCH_WORKERS = 2
+WS_DISPATCH_QUEUE_SIZE = 1000
+WS_DISPATCH_OVERFLOW_POLICY = 'block'  # 'block', 'drop_oldest' or 'coalesce'
+WS_MID_PRICES_OVERFLOW_POLICY = 'coalesce'  # only the latest allMids matter
+WS_STATS_INTERVAL = 300  # in seconds
+WS_USE_ASYNCIO = False  # requires the websockets package
+SEEN_FILLS_PER_ADDRESS = 1000
+SEEN_FILLS_SAVE_INTERVAL = 10  # in seconds
+SEEN_FILLS_RESUME_WINDOW = 3600  # in seconds
+FILL_AGGREGATION_WINDOW = 5  # in seconds, 0 alerts every message right away
+FILL_AGGREGATION_MAX_WINDOW = 60  # in seconds
+TELEGRAM_QUEUE_SIZE = 1000
+TELEGRAM_CHAT_MESSAGES_PER_SECOND = 1
+TELEGRAM_GROUP_MESSAGES_PER_MINUTE = 20
+TELEGRAM_GLOBAL_MESSAGES_PER_SECOND = 30
+TELEGRAM_DRAIN_TIMEOUT = 30  # in seconds, on shutdown
+TELEGRAM_RENDER_CACHE_SIZE = 4096  # rendered message fragments kept in memory
+ALERT_OUTBOX_MAX_ATTEMPTS = 5  # runs that try to deliver an alert before it is given up
+ALERT_OUTBOX_RETENTION_DAYS = 7
+MID_PRICE_MAX_AGE = 60  # in seconds, older allMids prices are not used to mark to market
 
 # ADDRESSES_TO_TRACK = 0x31ca8395cf837de08b24da3f660e77761dfb974b
@@ -0,0 +1,144 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class FillAggregate:
+
+    def __init__(self, user, coin, direction, oid):
+        self.user = user
+        self.coin = coin
+        self.direction = direction
+        self.oid = oid
+        self.size = 0.0
+        self.notional = 0.0
+        self.closed_pnl = 0.0
+        self.fee = 0.0
+        self.fill_count = 0
+        self.first_time = None
+        self.last_time = None
+        self.last_hash = None
+        # Kept to record them as alerted once the aggregate is emitted
+        self.fills = []
+        self.opened_at = time.monotonic()
+        self.updated_at = self.opened_at
+
+    def add(self, fill):
+        px = float(fill.get("px", 0))
+        sz = float(fill.get("sz", 0))
+        self.size += sz
+        self.notional += px * sz
+        self.closed_pnl += float(fill.get("closedPnl", 0) or 0)
+        self.fee += float(fill.get("fee", 0) or 0)
+        self.fill_count += 1
+        self.fills.append(fill)
+        fill_time = fill.get("time", 0)
+        if self.first_time is None or fill_time < self.first_time:
+            self.first_time = fill_time
+        if self.last_time is None or fill_time >= self.last_time:
+            self.last_time = fill_time
+            self.last_hash = fill.get("hash")
+        self.updated_at = time.monotonic()
+
+    @property
+    def vwap(self):
+        return self.notional / self.size if self.size else 0.0
+
+
+def get_fill_aggregate_key(user, fill):
+    return (user, fill.get("coin"), fill.get("dir"), fill.get("oid"))
+
+
+def aggregate_fills(user, fills):
+    # Merges the partial fills of each order, in order of first fill
+    aggregates = OrderedDict()
+    for fill in fills:
+        key = get_fill_aggregate_key(user, fill)
+        if key not in aggregates:
+            aggregates[key] = FillAggregate(*key)
+        aggregates[key].add(fill)
+    return list(aggregates.values())
+
+
+class FillAggregator:
+
+    # Accumulates fills per (user, coin, dir, oid) and hands the aggregates to
+    # emit(aggregates) in one batch once their window closes: window seconds
+    # without a new fill, max_window seconds after the first one, or as soon
+    # as the order is reported complete. A window of 0 emits the fills of
+    # each message right away, still merged per order.
+
+    def __init__(self, emit, window=5, max_window=60):
+        self.emit = emit
+        self.window = window
+        self.max_window = max(window, max_window)
+        self.aggregates = OrderedDict()
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.flusher = threading.Thread(target=self.flush_periodically,
+                                        daemon=True)
+
+    def start(self):
+        if self.window > 0:
+            self.flusher.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.flusher.is_alive():
+            self.flusher.join()
+        self.flush_all()
+
+    def add(self, user, fills):
+        if self.window <= 0:
+            aggregates = aggregate_fills(user, fills)
+            if aggregates:
+                self.emit(aggregates)
+            return
+        with self.lock:
+            for fill in fills:
+                key = get_fill_aggregate_key(user, fill)
+                aggregate = self.aggregates.get(key)
+                if aggregate is None:
+                    aggregate = self.aggregates[key] = FillAggregate(*key)
+                aggregate.add(fill)
+
+    def complete_order(self, user, oid):
+        with self.lock:
+            completed_keys = [
+                key for key in self.aggregates
+                if key[0] == user and key[3] == oid
+            ]
+            aggregates = [self.aggregates.pop(key) for key in completed_keys]
+        if aggregates:
+            self.emit(aggregates)
+
+    def flush_expired(self):
+        now = time.monotonic()
+        with self.lock:
+            expired_keys = [
+                key for key, aggregate in self.aggregates.items()
+                if now - aggregate.updated_at >= self.window
+                or now - aggregate.opened_at >= self.max_window
+            ]
+            aggregates = [self.aggregates.pop(key) for key in expired_keys]
+        if aggregates:
+            self.emit(aggregates)
+
+    def flush_all(self):
+        with self.lock:
+            aggregates = list(self.aggregates.values())
+            self.aggregates.clear()
+        if aggregates:
+            self.emit(aggregates)
+
+    def flush_periodically(self):
+        interval = min(1.0, self.window / 2)
+        while not self.stop_event.wait(interval):
+            try:
+                self.flush_expired()
+            except Exception as e:
+                print(f"Error flushing aggregated fills: {e}")
+
+    def pending_count(self):
+        with self.lock:
+            return len(self.aggregates)
@@ -1,88 +1,497 @@
 import requests
 import time
-import re
+import heapq
 import argparse
 import telebot
 from utils import *
+from rate_limiter import InfoRateLimiter
+from snapshot_store import SnapshotStore
+from positions import (compute_differences, aggregate_positions,
+                       get_differences_hash)
+from alert_outbox import open_outbox, drain_outbox
+from telegram_delivery import PRIORITY_SUMMARY
+from api_client import VAULTS_LISTING_URL, get_api_client, fetch_info_batch
 from config import (MIN_VAULT_TVL, MIN_VAULT_APR, EXCLUDED_VAULT_ADDRESSES,
-                    MAX_RETRIES, RETRY_AFTER, MIN_POSITION_COUNTS, USER_ID,
-                    TEST_TG_CHAT_ID, TELEGRAM_BOT_TOKEN)
+                    MIN_POSITION_COUNTS, USER_ID,
+                    TEST_TG_CHAT_ID, TELEGRAM_BOT_TOKEN, FETCH_CONCURRENCY,
+                    MAX_REQUESTS_PER_SECOND, INFO_WEIGHT_PER_MINUTE,
+                    FULL_VAULT_COLLECTION, APR_PRUNE_MARGIN,
+                    VAULT_LISTING_CACHE_TTL, MAX_TRACKED_VAULTS,
+                    SIZE_CHANGE_ALERT_PCT, TOP_K_COINS)
+
+
+VAULT_LISTING_CACHE_FILE_PATH = "./saved_data/cache/vault_listing.json"
+VAULT_LISTING_CACHE_FIELDS = ["vaultAddress", "name", "tvl", "apr"]
+VAULT_LISTING_CHUNK_SIZE = 64 * 1024
+
+VAULT_HEADER_TEMPLATE = TelegramTemplate("*_**📌 Vault: {vault_name}**_*\n"
+                                         "_**🔗 Address: `{vault_address}`**_\n"
+                                         "💰 TVL: {vault_tvl:,.2f} USD\n"
+                                         "📈 APR: {vault_apr:,.2f}%")
+COIN_UPDATE_TEMPLATE = TelegramTemplate(
+    "\n{dot} *Coin: {coin}*\n"
+    "• Leverage: {before_leverage} → {after_leverage}\n"
+    "• Direction: {before_direction} → {after_direction}")
+COIN_VALUE_TEMPLATE = TelegramTemplate(
+    "• Value at Mid: {mark_value:,.2f} USD (mid {mid:,.6g})")
+COIN_COUNT_TEMPLATE = TelegramTemplate(
+    "{direction_icon} {coin}: {count} time(s)")
+TOP_COIN_TEMPLATE = TelegramTemplate(
+    "{direction_icon} {coin}: {net_notional:+,.2f} USD "
+    "({tvl_weighted_net_exposure:+.2%} of TVL, "
+    "{apr_weighted_net_exposure:+.2%} APR-weighted)")
+
+
+def get_vault_listing_cache_key(top_n=MAX_TRACKED_VAULTS):
+    return [MIN_VAULT_TVL, sorted(EXCLUDED_VAULT_ADDRESSES), top_n]
+
+
+def load_vault_listing_cache(top_n=MAX_TRACKED_VAULTS):
+
+    cache = load_json_file_atomic(VAULT_LISTING_CACHE_FILE_PATH)
+
+    # Filters changed since the cache was written, it cannot be reused
+    if cache.get("key") != get_vault_listing_cache_key(top_n):
+        return {}
 
+    return cache
 
-def get_top_tvl_vaults():
 
-    response = requests.get(
-        "https://stats-data.hyperliquid.xyz/Mainnet/vaults", verify=False)
+def save_vault_listing_cache(vaults,
+                             etag=None,
+                             last_modified=None,
+                             top_n=MAX_TRACKED_VAULTS):
 
-    if response.status_code == 200:
-        data = response.json()
-        sorted_data = sorted(data,
-                             key=lambda x: float(x['summary']['tvl']),
-                             reverse=True)
-        filtered_vaults = []
+    cache = {
+        "key": get_vault_listing_cache_key(top_n),
+        "fetched_at": time.time(),
+        "etag": etag,
+        "last_modified": last_modified,
+        "fields": VAULT_LISTING_CACHE_FIELDS,
+        "vaults": [[vault.get(field) for field in VAULT_LISTING_CACHE_FIELDS]
+                   for vault in vaults],
+    }
+    save_json_file_atomic(VAULT_LISTING_CACHE_FILE_PATH,
+                          cache,
+                          keep_previous=False)
+
+
+def get_cached_vaults(cache):
+    fields = cache.get("fields", VAULT_LISTING_CACHE_FIELDS)
+    return [dict(zip(fields, row)) for row in cache.get("vaults", [])]
+
+
+def iter_vault_summaries(vaults):
+
+    # Only the summary fields are kept, and vaults below MIN_VAULT_TVL are
+    # dropped as soon as they are read
+    for vault in vaults:
+        vault_summary = vault.get('summary', {})
+        vault_address = vault_summary.get('vaultAddress', '')
+        vault_tvl = float(vault_summary.get('tvl', 0))
+        if (vault_address) and (vault_address
+                                not in EXCLUDED_VAULT_ADDRESSES) and (
+                                    vault_tvl >= MIN_VAULT_TVL):
+            # The listing APR sits next to the summary, keep it for the
+            # fetch planning stage
+            yield {
+                "vaultAddress": vault_address,
+                "name": vault_summary.get('name'),
+                "tvl": vault_tvl,
+                "apr": vault.get('apr'),
+            }
 
-        for vault in sorted_data:
-            vault_summary = vault.get('summary', {})
-            vault_address = vault_summary.get('vaultAddress', '')
-            vault_tvl = float(vault_summary.get('tvl', 0))
-            if (vault_address) and (vault_address
-                                    not in EXCLUDED_VAULT_ADDRESSES) and (
-                                        vault_tvl >= MIN_VAULT_TVL):
-                filtered_vaults.append(vault_summary)
 
-        return filtered_vaults
-    else:
-        print(f"Error: {response.status_code}, {response.text}")
+def filter_top_tvl_vaults(vaults, top_n=MAX_TRACKED_VAULTS):
+
+    vault_summaries = iter_vault_summaries(vaults)
+
+    if top_n:
+        # Bounded heap, only top_n summaries are held at any time
+        return heapq.nlargest(top_n, vault_summaries, key=lambda x: x['tvl'])
+
+    return sorted(vault_summaries, key=lambda x: x['tvl'], reverse=True)
+
+
+def get_top_tvl_vaults(use_cache=True,
+                       cache_ttl=VAULT_LISTING_CACHE_TTL,
+                       top_n=MAX_TRACKED_VAULTS):
+
+    cache = load_vault_listing_cache(top_n) if use_cache else {}
+
+    if cache and time.time() - cache.get("fetched_at", 0) < cache_ttl:
+        print("Using cached vault listing.")
+        return get_cached_vaults(cache)
+
+    headers = {}
+    if cache.get("etag"):
+        headers["If-None-Match"] = cache["etag"]
+    if cache.get("last_modified"):
+        headers["If-Modified-Since"] = cache["last_modified"]
+
+    try:
+        response = get_api_client().get(VAULTS_LISTING_URL,
+                                        endpoint="stats:vaults",
+                                        headers=headers,
+                                        stream=True)
+    except requests.exceptions.RequestException as e:
+        print(f"Error: {e}")
         return []
 
+    with response:
+        if response.status_code == 304 and cache:
+            print("Vault listing not modified, using cached vault listing.")
+            cached_vaults = get_cached_vaults(cache)
+            save_vault_listing_cache(cached_vaults, cache.get("etag"),
+                                     cache.get("last_modified"), top_n)
+            return cached_vaults
+        elif response.status_code == 200:
+            try:
+                filtered_vaults = filter_top_tvl_vaults(
+                    iter_json_array(
+                        response.iter_content(
+                            chunk_size=VAULT_LISTING_CHUNK_SIZE)), top_n)
+            except (requests.exceptions.RequestException, ValueError) as e:
+                print(f"Error: {e}")
+                return []
 
-def get_vault_details(vault_address):
+            if use_cache:
+                save_vault_listing_cache(filtered_vaults,
+                                         response.headers.get("ETag"),
+                                         response.headers.get("Last-Modified"),
+                                         top_n)
 
-    url = "https://api.hyperliquid.xyz/info"
-    headers = {"Content-Type": "application/json"}
-    payload = {"type": "vaultDetails", "vaultAddress": vault_address}
+            return filtered_vaults
+        else:
+            print(f"Error: {response.status_code}, {response.text}")
+            return []
 
-    response = requests.post(url, headers=headers, json=payload, verify=False)
 
-    if response.status_code == 200:
-        data = response.json()
-        return data
-    else:
-        print(f"Error: {response.status_code}, {response.text}")
-        return {}
+def estimate_vault_apr(vault, tracked_top_tvl_vaults_dict):
+
+    apr_estimates = []
+    listing_apr = vault.get('apr')
+    if listing_apr is not None and can_be_float(listing_apr):
+        apr_estimates.append(float(listing_apr) * 100)
+
+    tracked_vault = tracked_top_tvl_vaults_dict.get(vault.get('vaultAddress'))
+    if tracked_vault and "vault_apr" in tracked_vault:
+        apr_estimates.append(float(tracked_vault["vault_apr"]))
+
+    if not apr_estimates:
+        return None
+
+    # Be conservative and keep the most optimistic estimate
+    return max(apr_estimates)
 
 
-def get_vaults_updates(chat_id, send_to_tg=True):
+def plan_vault_fetches(vaults,
+                       tracked_top_tvl_vaults_dict,
+                       full_collection=FULL_VAULT_COLLECTION):
+
+    planned_vaults = []
+    pruned_vaults = []
+
+    for vault in vaults:
+        vault_apr = estimate_vault_apr(vault, tracked_top_tvl_vaults_dict)
+        if (not full_collection and vault_apr is not None
+                and vault_apr < MIN_VAULT_APR - APR_PRUNE_MARGIN):
+            pruned_vaults.append(vault)
+        else:
+            planned_vaults.append((vault, vault_apr))
+
+    # Vaults likely to pass the APR filter (or unknown ones) are fetched
+    # first, the others only fill in the aggregate counters
+    planned_vaults.sort(key=lambda x: x[1] is not None and x[1] <
+                        MIN_VAULT_APR)
+
+    return [vault for vault, _ in planned_vaults], pruned_vaults
+
+
+def parse_asset_positions(vault_asset_positions):
+
+    positions_dict = {}
+
+    for asset_position in vault_asset_positions:
+        coin = asset_position.get('position', {}).get('coin', '')
+        leverage = float(
+            asset_position.get('position', {}).get('leverage',
+                                                   {}).get('value', 1))
+        position_value = float(
+            asset_position.get('position', {}).get('positionValue', 0))
+        size = float(asset_position.get('position', {}).get('szi', 0))
+        unrealised_pnl = float(
+            asset_position.get('position', {}).get('unrealizedPnl', 0))
+
+        if size >= 0:
+            direction = "LONG"
+        else:
+            direction = "SHORT"
+
+        positions_dict[coin] = {
+            "leverage": leverage,
+            "position_value": position_value,
+            "size": size,
+            "unrealised_pnl": unrealised_pnl,
+            "direction": direction
+        }
+
+    return positions_dict
+
+
+def fetch_vaults_states(vault_addresses,
+                        concurrency=FETCH_CONCURRENCY,
+                        requests_per_second=MAX_REQUESTS_PER_SECOND):
+
+    rate_limiter = InfoRateLimiter(requests_per_second,
+                                   INFO_WEIGHT_PER_MINUTE)
+    payloads = {}
+
+    # Both endpoints of a vault are queued back to back so that they are
+    # fetched in parallel rather than one after the other
+    for vault_address in vault_addresses:
+        payloads[("vaultDetails", vault_address)] = {
+            "type": "vaultDetails",
+            "vaultAddress": vault_address
+        }
+        payloads[("clearinghouseState", vault_address)] = {
+            "type": "clearinghouseState",
+            "user": vault_address
+        }
+
+    results = fetch_info_batch(payloads, concurrency, rate_limiter)
+
+    return {
+        vault_address: (results.get(("vaultDetails", vault_address)) or {},
+                        results.get(("clearinghouseState", vault_address)))
+        for vault_address in vault_addresses
+    }
+
+
+def format_vault_updates(vault_address, vault_updates, mid_prices=None):
+    # Terminal output and Telegram section of the changes of one vault,
+    # open positions are marked to market when mid_prices has a fresh price
+    terminal_output = ""
+
+    vault_name = vault_updates["vault_name"]
+    vault_tvl = vault_updates["vault_tvl"]
+    vault_apr = vault_updates["vault_apr"]
+    positions_updates = vault_updates["positions"]
+
+    terminal_msg = f"\n📌 Vault: {vault_name}\n🔗 Address: {vault_address}\n💰 TVL: {vault_tvl:,.2f} USD\n📈 APR: {vault_apr:,.2f}%\n{'-'*40}"
+    print(terminal_msg)
+    terminal_output += terminal_msg
+
+    # The lines of a vault are kept in one Telegram message
+    vault_section = [
+        VAULT_HEADER_TEMPLATE.render(vault_name=vault_name,
+                                     vault_address=vault_address,
+                                     vault_tvl=vault_tvl,
+                                     vault_apr=vault_apr)
+    ]
+
+    for coin, updates in positions_updates.items():
+        before = updates.get('before', {})
+        after = updates.get('after', {})
+
+        before_leverage = before.get("leverage", "OPENED")
+        after_leverage = after.get("leverage", "CLOSED")
+        before_direction = before.get("direction", "OPENED")
+        after_direction = after.get("direction", "CLOSED")
+
+        if before_direction in ["SHORT", "OPENED"] and after_direction == "LONG":
+            dot = "🟢"
+        elif before_direction in ["LONG", "OPENED"
+                                  ] and after_direction == "SHORT":
+            dot = "🔴"
+        elif after_direction == "LONG":
+            dot = "🟢"
+        elif after_direction == "SHORT":
+            dot = "🔴"
+        else:
+            dot = "🔹"
+
+        mid = mid_prices.get(coin) if mid_prices is not None and after else None
+        mark_value = abs(after.get("size", 0)) * mid if mid else 0
+        terminal_msg = (
+            f"\n{dot} Coin: {coin}"
+            f"\n   - Leverage: {before_leverage} → {after_leverage}"
+            f"\n   - Direction: {before_direction} → {after_direction}")
+        if mid:
+            terminal_msg += f"\n   - Value at Mid: {mark_value:,.2f} USD (mid {mid:,.6g})"
+        terminal_msg += f"\n{'-'*40}"
+        print(terminal_msg)
+        terminal_output += terminal_msg
+
+        vault_section.append(
+            COIN_UPDATE_TEMPLATE.render(dot=dot,
+                                        coin=coin,
+                                        before_leverage=before_leverage,
+                                        after_leverage=after_leverage,
+                                        before_direction=before_direction,
+                                        after_direction=after_direction))
+        if mid:
+            vault_section.append(
+                COIN_VALUE_TEMPLATE.render(mark_value=mark_value, mid=mid))
+
+    terminal_output += terminal_msg
+    vault_section.append(f"{'_'*32}\n")
+
+    return terminal_output, vault_section
+
+
+def format_positions_summary(aggregation):
+    # Terminal output and Telegram messages of the long/short summary and
+    # the top coins by net exposure
+    valid_vaults_count = aggregation["valid_vaults_count"]
+    total_long_positions_value = aggregation["total_long_positions_value"]
+    total_short_positions_value = aggregation["total_short_positions_value"]
+    long_short_counter = aggregation["long_short_counter"]
+    terminal_output = ""
+    tg_msg_list = []
+
+    summary_msg = f"\n📊 **Summary of Long/Short Positions (Count >= {MIN_POSITION_COUNTS}):**\n\nTotal No. of Vaults: {valid_vaults_count}"
+    tg_summary_msg = f"\n📊 *Summary of Long/Short Positions (Count >= {MIN_POSITION_COUNTS}):*\n\n*Total No. of Vaults:* {valid_vaults_count}"
+
+    print(summary_msg)
+    terminal_output += summary_msg
+    tg_msg_list.append(tg_summary_msg)
+    count = 1
+
+    for direction, coins in long_short_counter.items():
+        direction_icon = "🟢" if direction == "LONG" else "🔴"
+        total_positions_value = total_long_positions_value if direction == "LONG" else total_short_positions_value
+        direction_msg = f"\n{direction} Positions (Total Positions Value = {total_positions_value:,.2f} USD):"
+        print(direction_msg)
+        terminal_output += direction_msg
+        if count == 1:
+            tg_msg_list.append(
+                f"*{direction} Positions (Total Positions Value = {total_positions_value:,.2f} USD):*"
+            )
+        else:
+            tg_msg_list.append(
+                f"\n*{direction} Positions (Total Positions Value = {total_positions_value:,.2f} USD):*"
+            )
+
+        sorted_coins = sorted(coins.items(), key=lambda x: x[1], reverse=True)
+
+        for coin, count in sorted_coins:
+            if count >= MIN_POSITION_COUNTS:
+                coin_msg = f"{direction_icon} {coin}: {count} time(s)"
+                print(coin_msg)
+                terminal_output += f"\n{coin_msg}"
+                tg_msg_list.append(
+                    COIN_COUNT_TEMPLATE.render(direction_icon=direction_icon,
+                                               coin=coin,
+                                               count=count))
+
+        count += 1
+
+    top_coins = aggregation["top_coins"]
+    if top_coins:
+        top_coins_msg = f"\nTop {len(top_coins)} Coins by Net Exposure (APR >= {MIN_VAULT_APR:,.2f}%):"
+        print(top_coins_msg)
+        terminal_output += top_coins_msg
+        tg_msg_list.append(f"\n*{top_coins_msg.strip()}*")
+
+        for top_coin in top_coins:
+            net_notional = top_coin["net_notional"]
+            direction_icon = "🟢" if net_notional >= 0 else "🔴"
+            coin_msg = TOP_COIN_TEMPLATE.format(direction_icon=direction_icon,
+                                                **top_coin)
+            print(coin_msg)
+            terminal_output += f"\n{coin_msg}"
+            tg_msg_list.append(
+                TOP_COIN_TEMPLATE.render(direction_icon=direction_icon,
+                                         **top_coin))
+
+    print("\n" + "-" * 40)
+    terminal_output += "\n" + "-" * 40
+    tg_msg_list.append(f"{'_'*32}\n")
+
+    return terminal_output, tg_msg_list
+
+
+def get_vaults_updates(chat_id,
+                       send_to_tg=True,
+                       concurrency=FETCH_CONCURRENCY,
+                       requests_per_second=MAX_REQUESTS_PER_SECOND,
+                       full_collection=FULL_VAULT_COLLECTION,
+                       use_cache=True,
+                       top_n=MAX_TRACKED_VAULTS):
 
     start_time = time.time()
 
+    # Alerts left undelivered by an earlier run are resent on every run, not
+    # only on runs that have updates of their own
+    outbox = None
+    if send_to_tg:
+        bot = telebot.TeleBot(token=TELEGRAM_BOT_TOKEN, threaded=False)
+        outbox = open_outbox(bot, "vaults")
+
     saved_data_base_dir = "./saved_data"
     tracked_top_tvl_vaults_dir = saved_data_base_dir + "/tracked_top_tvl_vaults"
-    os.makedirs(tracked_top_tvl_vaults_dir, exist_ok=True)
     tracked_top_tvl_vaults_file_path = f"{tracked_top_tvl_vaults_dir}/tracked_top_tvl_vaults.json"
-    tracked_top_tvl_vaults_dict = load_json_file(
-        tracked_top_tvl_vaults_file_path)
+    snapshot_store = SnapshotStore()
+    has_previous_snapshot = snapshot_store.has_snapshot()
+    tracked_top_tvl_vaults_dict = snapshot_store.load_latest_snapshot()
+
+    # First run on the snapshot store, start from the legacy JSON state
+    if (not has_previous_snapshot
+            and os.path.exists(tracked_top_tvl_vaults_file_path)):
+        has_previous_snapshot = True
+        tracked_top_tvl_vaults_dict = load_json_file(
+            tracked_top_tvl_vaults_file_path)
+
+    # A snapshot existed but none of its generations could be read, so every
+    # position would be reported as OPENED. Rebuild the state silently.
+    if has_previous_snapshot and not tracked_top_tvl_vaults_dict:
+        print("Previous vault snapshot could not be recovered, "
+              "this run only rebuilds the state.")
+        send_report = False
+    else:
+        send_report = send_to_tg
 
-    curr_top_tvl_vaults = get_top_tvl_vaults()
+    curr_top_tvl_vaults = get_top_tvl_vaults(use_cache, top_n=top_n)
 
     if not curr_top_tvl_vaults:
         print("No vaults found. Exiting...")
+        snapshot_store.close()
+        if outbox is not None:
+            drain_outbox(outbox)
         return
 
     count = 1
-    valid_vaults_count = 0
-    total_long_positions_value = 0
-    total_short_positions_value = 0
     total_curr_top_tvl_vaults = len(curr_top_tvl_vaults)
     updated_top_tvl_vaults = {}
-    long_short_counter = {"LONG": {}, "SHORT": {}}
-    url = "https://api.hyperliquid.xyz/info"
-    headers = {"Content-Type": "application/json"}
 
+    planned_vaults, pruned_vaults = plan_vault_fetches(
+        curr_top_tvl_vaults, tracked_top_tvl_vaults_dict, full_collection)
+    pruned_vault_addresses = set(
+        vault.get('vaultAddress') for vault in pruned_vaults)
+
+    print("\nRetrieving vault details for {} vaults ({} pruned by APR, {} workers, {} requests/s)..."
+          .format(len(planned_vaults), len(pruned_vaults), concurrency,
+                  requests_per_second))
+
+    vaults_states = fetch_vaults_states(
+        [vault.get('vaultAddress') for vault in planned_vaults], concurrency,
+        requests_per_second)
+
+    carried_forward_vault_addresses = set()
+
+    def carry_forward_vault(vault_address):
+        # Keep the last known positions of a vault that was pruned or could
+        # not be fetched, so that it does not come back as all "OPENED"
+        if vault_address in tracked_top_tvl_vaults_dict:
+            updated_top_tvl_vaults[
+                vault_address] = tracked_top_tvl_vaults_dict[vault_address]
+            carried_forward_vault_addresses.add(vault_address)
+
+    # Results are consumed in listing order so that the updated snapshot
+    # comes out exactly as it would from a serial run
     for vault in curr_top_tvl_vaults:
 
-        retry_count = 0
-        break_flag = False
         vault_name = vault.get('name')
         vault_address = vault.get('vaultAddress')
         vault_tvl = float(vault.get('tvl', 0))
@@ -91,147 +500,58 @@ def get_vaults_updates(chat_id, send_to_tg=True):
             vault_name = vault_address
 
         print('\n')
-
-        while retry_count < MAX_RETRIES:
-
-            print("Retrieving vault details for {} ({}/{})...".format(
-                vault_name, count, total_curr_top_tvl_vaults))
-
-            vault_details = get_vault_details(vault_address)
-
-            if not vault_details:
-                print('No vault details found. Skipping...')
-                break_flag = True
-                break
-            else:
-                vault_apr = float(vault_details.get('apr', 0)) * 100
-
-            payload = {"type": "clearinghouseState", "user": vault_address}
-            response = requests.post(url,
-                                     headers=headers,
-                                     json=payload,
-                                     verify=False)
-
-            if response.status_code == 200:
-                vault_details = response.json()
-                vault_asset_positions = vault_details.get('assetPositions', [])
-
-                if not vault_asset_positions:
-                    print('No asset positions found. Skipping...')
-                    break_flag = True
-                    break
-
-                positions_dict = {}
-
-                for asset_position in vault_asset_positions:
-                    coin = asset_position.get('position', {}).get('coin', '')
-                    leverage = float(
-                        asset_position.get('position',
-                                           {}).get('leverage',
-                                                   {}).get('value', 1))
-                    position_value = float(
-                        asset_position.get('position',
-                                           {}).get('positionValue', 0))
-                    size = float(
-                        asset_position.get('position', {}).get('szi', 0))
-                    unrealised_pnl = float(
-                        asset_position.get('position',
-                                           {}).get('unrealizedPnl', 0))
-
-                    if size >= 0:
-                        direction = "LONG"
-                        total_long_positions_value += position_value
-                    else:
-                        direction = "SHORT"
-                        total_short_positions_value += position_value
-
-                    positions_dict[coin] = {
-                        "leverage": leverage,
-                        "position_value": position_value,
-                        "size": size,
-                        "unrealised_pnl": unrealised_pnl,
-                        "direction": direction
-                    }
-
-                    if vault_apr >= MIN_VAULT_APR:
-                        if coin in long_short_counter[direction]:
-                            long_short_counter[direction][coin] += 1
-                        else:
-                            long_short_counter[direction][coin] = 1
-
-                updated_top_tvl_vaults[vault_address] = {
-                    "vault_name": vault_name,
-                    "vault_tvl": vault_tvl,
-                    "vault_apr": vault_apr,
-                    "positions": positions_dict,
-                }
-
-                if vault_apr >= MIN_VAULT_APR:
-                    valid_vaults_count += 1
-
-                break_flag = True
-                time.sleep(0.5)
-                break
-
-            else:
-                retry_count += 1
-
-                print(
-                    'Query failed and return code is {}. Retrying ({}) after {} seconds...'
-                    .format(response.status_code, retry_count, RETRY_AFTER))
-
-                time.sleep(RETRY_AFTER)
-
-        if not break_flag:
-            print('Maximum retries reached. Skipping...')
-
+        print("Processing vault details for {} ({}/{})...".format(
+            vault_name, count, total_curr_top_tvl_vaults))
         count += 1
 
-    if os.path.exists(tracked_top_tvl_vaults_file_path):
-        os.remove(tracked_top_tvl_vaults_file_path)
-    save_json_file(tracked_top_tvl_vaults_file_path, updated_top_tvl_vaults)
-
-    differences = {}
+        if vault_address in pruned_vault_addresses:
+            print('APR estimate below {:,.2f}%. Skipping...'.format(
+                MIN_VAULT_APR))
+            carry_forward_vault(vault_address)
+            continue
 
-    for vault_address, updated_vault in updated_top_tvl_vaults.items():
-        updated_positions = updated_vault.get("positions", {})
-        tracked_positions = tracked_top_tvl_vaults_dict.get(
-            vault_address, {}).get("positions", {})
+        vault_details, clearinghouse_state = vaults_states[vault_address]
 
-        changed_positions = {}
+        if not vault_details:
+            print('No vault details found. Skipping...')
+            carry_forward_vault(vault_address)
+            continue
 
-        for coin, updated_position in updated_positions.items():
-            tracked_position = tracked_positions.get(coin)
+        vault_apr = float(vault_details.get('apr', 0)) * 100
 
-            if tracked_position:
-                if (updated_position["leverage"]
-                        != tracked_position["leverage"]
-                        or updated_position["direction"]
-                        != tracked_position["direction"]):
-                    changed_positions[coin] = {
-                        "before": tracked_position,
-                        "after": updated_position
-                    }
-            else:
-                changed_positions[coin] = {
-                    "before": {},
-                    "after": updated_position
-                }
-
-        for coin, tracked_position in tracked_positions.items():
-            if coin not in updated_positions:
-                changed_positions[coin] = {
-                    "before": tracked_position,
-                    "after": {}
-                }
-
-        if changed_positions:
-            differences[vault_address] = {
-                "vault_name": updated_vault["vault_name"],
-                "vault_tvl": updated_vault["vault_tvl"],
-                "vault_apr": updated_vault["vault_apr"],
-                "positions": changed_positions
-            }
+        if clearinghouse_state is None:
+            print('Maximum retries reached. Skipping...')
+            carry_forward_vault(vault_address)
+            continue
+
+        vault_asset_positions = clearinghouse_state.get('assetPositions', [])
+
+        if not vault_asset_positions:
+            print('No asset positions found. Skipping...')
+            continue
+
+        positions_dict = parse_asset_positions(vault_asset_positions)
+
+        updated_top_tvl_vaults[vault_address] = {
+            "vault_name": vault_name,
+            "vault_tvl": vault_tvl,
+            "vault_apr": vault_apr,
+            "positions": positions_dict,
+        }
+
+    base_run_id = snapshot_store.latest_run_id() or 0
+
+    # Carried forward vaults were not fetched in this run, leave them out of
+    # the aggregates
+    aggregation = aggregate_positions(
+        {
+            vault_address: vault
+            for vault_address, vault in updated_top_tvl_vaults.items()
+            if vault_address not in carried_forward_vault_addresses
+        }, MIN_VAULT_APR, TOP_K_COINS)
+    differences = compute_differences(tracked_top_tvl_vaults_dict,
+                                      updated_top_tvl_vaults,
+                                      SIZE_CHANGE_ALERT_PCT)
 
     filtered_differences = {
         vault_address: data
@@ -257,103 +577,15 @@ def get_vaults_updates(chat_id, send_to_tg=True):
         ]
 
         for vault_address, vault_updates in sorted_differences:
+            vault_terminal_output, vault_section = format_vault_updates(
+                vault_address, vault_updates)
+            terminal_output += vault_terminal_output
+            tg_msg_list.append(vault_section)
 
-            vault_name = vault_updates["vault_name"]
-            vault_tvl = vault_updates["vault_tvl"]
-            vault_apr = vault_updates["vault_apr"]
-            positions_updates = vault_updates["positions"]
-
-            terminal_msg = f"\n📌 Vault: {vault_name}\n🔗 Address: {vault_address}\n💰 TVL: {vault_tvl:,.2f} USD\n📈 APR: {vault_apr:,.2f}%\n{'-'*40}"
-            print(terminal_msg)
-            terminal_output += terminal_msg
-
-            escaped_vault_name = re.escape(vault_name)
-            escaped_vault_name = escaped_vault_name.replace(r'\ ', ' ')
-            tg_msg_list.append(f"*_**📌 Vault: {escaped_vault_name}**_*\n"
-                               f"_**🔗 Address: `{vault_address}`**_\n"
-                               f"💰 TVL: {vault_tvl:,.2f} USD\n"
-                               f"📈 APR: {vault_apr:,.2f}%")
-
-            for coin, updates in positions_updates.items():
-                before = updates.get('before', {})
-                after = updates.get('after', {})
-
-                before_leverage = before.get("leverage", "OPENED")
-                after_leverage = after.get("leverage", "CLOSED")
-                before_direction = before.get("direction", "OPENED")
-                after_direction = after.get("direction", "CLOSED")
-
-                if before_direction in ["SHORT", "OPENED"
-                                        ] and after_direction == "LONG":
-                    dot = "🟢"
-                elif before_direction in ["LONG", "OPENED"
-                                          ] and after_direction == "SHORT":
-                    dot = "🔴"
-                elif after_direction == "LONG":
-                    dot = "🟢"
-                elif after_direction == "SHORT":
-                    dot = "🔴"
-                else:
-                    dot = "🔹"
-
-                terminal_msg = (
-                    f"\n{dot} Coin: {coin}"
-                    f"\n   - Leverage: {before_leverage} → {after_leverage}"
-                    f"\n   - Direction: {before_direction} → {after_direction}"
-                    f"\n{'-'*40}")
-                print(terminal_msg)
-                terminal_output += terminal_msg
-
-                escaped_coin = re.escape(coin)
-                escaped_coin = escaped_coin.replace(r'\ ', ' ')
-                tg_msg_list.append(
-                    f"\n{dot} *Coin: {escaped_coin}*\n"
-                    f"• Leverage: {before_leverage} → {after_leverage}\n"
-                    f"• Direction: {before_direction} → {after_direction}")
-
-            terminal_output += terminal_msg
-            tg_msg_list.append(f"{'_'*32}\n")
-
-        summary_msg = f"\n📊 **Summary of Long/Short Positions (Count >= {MIN_POSITION_COUNTS}):**\n\nTotal No. of Vaults: {valid_vaults_count}"
-        tg_summary_msg = f"\n📊 *Summary of Long/Short Positions (Count >= {MIN_POSITION_COUNTS}):*\n\n*Total No. of Vaults:* {valid_vaults_count}"
-
-        print(summary_msg)
-        terminal_output += summary_msg
-        tg_msg_list.append(tg_summary_msg)
-        count = 1
-
-        for direction, coins in long_short_counter.items():
-            direction_icon = "🟢" if direction == "LONG" else "🔴"
-            total_positions_value = total_long_positions_value if direction == "LONG" else total_short_positions_value
-            direction_msg = f"\n{direction} Positions (Total Positions Value = {total_positions_value:,.2f} USD):"
-            print(direction_msg)
-            terminal_output += direction_msg
-            if count == 1:
-                tg_msg_list.append(
-                    f"*{direction} Positions (Total Positions Value = {total_positions_value:,.2f} USD):*"
-                )
-            else:
-                tg_msg_list.append(
-                    f"\n*{direction} Positions (Total Positions Value = {total_positions_value:,.2f} USD):*"
-                )
-
-            sorted_coins = sorted(coins.items(),
-                                  key=lambda x: x[1],
-                                  reverse=True)
-
-            for coin, count in sorted_coins:
-                if count >= MIN_POSITION_COUNTS:
-                    coin_msg = f"{direction_icon} {coin}: {count} time(s)"
-                    print(coin_msg)
-                    terminal_output += f"\n{coin_msg}"
-                    tg_msg_list.append(
-                        f"{direction_icon} {coin}: {count} time(s)")
-
-            count += 1
-
-        print("\n" + "-" * 40)
-        terminal_output += "\n" + "-" * 40
-        tg_msg_list.append(f"{'_'*32}\n")
+        summary_terminal_output, summary_msg_list = format_positions_summary(
+            aggregation)
+        terminal_output += summary_terminal_output
+        tg_msg_list.extend(summary_msg_list)
 
         file_path = "latest_vault_updates_terminal_output.txt"
         with open(file_path, "w") as file:
@@ -361,19 +593,34 @@ def get_vaults_updates(chat_id, send_to_tg=True):
 
         print(f"\nTerminal output saved to {file_path}\n")
 
-        if send_to_tg:
+        if send_report:
             if tg_msg_list:
                 print("Sending vault updates to Telegram...\n")
-                bot = telebot.TeleBot(token=TELEGRAM_BOT_TOKEN, threaded=False)
                 tg_msg_title_list.extend(tg_msg_list)
-                send_to_telegram(tg_msg_title_list, bot, chat_id, MAX_RETRIES)
-
-                print('Vault updates sent to Telegram.\n')
-
+                # Stored before the snapshot that makes it obsolete, and
+                # keyed by the run it was diffed against and its changes, so
+                # a rerun after a crash sends the same report only once
+                outbox.add(tg_msg_title_list,
+                           chat_id,
+                           PRIORITY_SUMMARY,
+                           key="vault_updates:{}:{}".format(
+                               base_run_id,
+                               get_differences_hash(filtered_differences,
+                                                    SIZE_CHANGE_ALERT_PCT)))
             else:
                 print(
                     'No vault update found, so no message sent to Telegram.\n')
 
+    snapshot_store.save_snapshot(updated_top_tvl_vaults)
+    snapshot_store.close()
+
+    if outbox is not None:
+        drain_outbox(outbox)
+        if send_report and filtered_differences:
+            print('Vault updates sent to Telegram.\n')
+
+    get_api_client().print_latency_stats()
+
     print('Total time taken: {:.2f} seconds\n'.format(time.time() -
                                                       start_time))
 
@@ -392,6 +639,43 @@ if __name__ == "__main__":
                         default='GROUP',
                         help="GROUP: Send to TEST_TG_CHAT_ID Telegram group, \
         USER: Send to USER_ID Telegram user")
+    parser.add_argument('-n',
+                        '--concurrency',
+                        type=int,
+                        default=FETCH_CONCURRENCY,
+                        help="Number of concurrent vault requests, \
+        1 fetches the vaults one at a time")
+    parser.add_argument('-r',
+                        '--rps',
+                        type=float,
+                        default=MAX_REQUESTS_PER_SECOND,
+                        help="Global budget of info API requests per second, \
+        0 disables throttling")
+    parser.add_argument('-f',
+                        '--full',
+                        action='store_true',
+                        default=FULL_VAULT_COLLECTION,
+                        help="Fetch every vault above MIN_VAULT_TVL, even those \
+        whose APR cannot pass MIN_VAULT_APR, to keep the total positions values complete")
+    parser.add_argument('--no-cache',
+                        action='store_true',
+                        help="Always download the full vault listing instead \
+        of using the on-disk cache")
+    parser.add_argument('-t',
+                        '--top',
+                        type=int,
+                        default=MAX_TRACKED_VAULTS,
+                        help="Only track the TOP vaults with the highest TVL")
+    parser.add_argument('-d',
+                        '--daemon',
+                        action='store_true',
+                        help="Keep running and poll each vault on its own \
+        schedule, alerting changes as soon as they are found")
+    parser.add_argument('-w',
+                        '--websocket',
+                        action='store_true',
+                        help="Daemon mode that follows the vaults' fills over \
+        websockets and only polls to reconcile drift")
     args = parser.parse_args()
     chat = str(args.chat).upper()
 
@@ -405,4 +689,20 @@ if __name__ == "__main__":
     else:
         chat_id = USER_ID
 
-    get_vaults_updates(chat_id)
+    if args.daemon or args.websocket:
+        from vault_daemon import run_vault_daemon
+        run_vault_daemon(chat_id,
+                         use_websocket=args.websocket,
+                         concurrency=args.concurrency,
+                         requests_per_second=args.rps,
+                         full_collection=args.full,
+                         use_cache=not args.no_cache,
+                         top_n=args.top)
+        sys.exit(0)
+
+    get_vaults_updates(chat_id,
+                       concurrency=args.concurrency,
+                       requests_per_second=args.rps,
+                       full_collection=args.full,
+                       use_cache=not args.no_cache,
+                       top_n=args.top)
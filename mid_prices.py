@@ -0,0 +1,99 @@
+import threading
+import time
+
+from config import MID_PRICE_MAX_AGE, WS_MID_PRICES_OVERFLOW_POLICY
+
+
+class MidPriceCache:
+
+    # Latest mid price of every coin, fed by one allMids subscription and
+    # shared by all alert and report paths of the process. Each update
+    # builds a new dict and swaps it in, so readers never take a lock and
+    # always see a consistent mapping. Prices older than max_age seconds
+    # are not used. Every allMids message carries all mids, so a queued
+    # subscription overflows with overflow_policy instead of blocking the
+    # socket reader behind the alert subscriptions.
+
+    def __init__(self,
+                 max_age=MID_PRICE_MAX_AGE,
+                 overflow_policy=WS_MID_PRICES_OVERFLOW_POLICY):
+        self.max_age = max_age
+        self.overflow_policy = overflow_policy
+        # coin -> (mid price, monotonic time of the update)
+        self.prices = {}
+        self.write_lock = threading.Lock()
+        self.subscribed_managers = set()
+        self.updates = 0
+
+    def subscribe(self, manager):
+        # manager is a WebsocketManager, AsyncWebsocketManager or
+        # WebsocketPool; subscribing the same one twice is a no-op
+        if id(manager) in self.subscribed_managers:
+            return None
+        self.subscribed_managers.add(id(manager))
+        return manager.subscribe({"type": "allMids"},
+                                 self.on_all_mids,
+                                 overflow_policy=self.overflow_policy)
+
+    def on_all_mids(self, ws_msg):
+        self.update(ws_msg.get("data", {}).get("mids", {}))
+
+    def update(self, mids):
+        now = time.monotonic()
+        with self.write_lock:
+            prices = dict(self.prices)
+            for coin, mid in mids.items():
+                try:
+                    prices[coin] = (float(mid), now)
+                except (TypeError, ValueError):
+                    continue
+            self.prices = prices
+            self.updates += 1
+
+    def get(self, coin, max_age=None):
+        entry = self.prices.get(coin)
+        if entry is None:
+            return None
+        mid, updated_at = entry
+        max_age = self.max_age if max_age is None else max_age
+        if max_age and time.monotonic() - updated_at > max_age:
+            return None
+        return mid
+
+    def get_age(self, coin):
+        entry = self.prices.get(coin)
+        return None if entry is None else time.monotonic() - entry[1]
+
+    def mark_positions(self, positions):
+        # Copy of a vault's positions with position_value at the mid price,
+        # positions without a fresh mid keep their value
+        marked_positions = {}
+        for coin, position in positions.items():
+            mid = self.get(coin)
+            if mid is not None:
+                position = dict(position,
+                                position_value=abs(position.get("size", 0)) *
+                                mid)
+            marked_positions[coin] = position
+        return marked_positions
+
+    def mark_snapshot(self, snapshot):
+        return {
+            vault_address:
+            dict(vault,
+                 positions=self.mark_positions(vault.get("positions", {})))
+            for vault_address, vault in snapshot.items()
+        }
+
+
+_mid_price_cache = None
+_mid_price_cache_lock = threading.Lock()
+
+
+def get_mid_price_cache():
+    global _mid_price_cache
+
+    with _mid_price_cache_lock:
+        if _mid_price_cache is None:
+            _mid_price_cache = MidPriceCache()
+        return _mid_price_cache
@@ -0,0 +1,170 @@
+import hashlib
+import heapq
+import json
+
+
+def has_position_changed(tracked_position, updated_position,
+                         size_change_pct=None):
+    if (updated_position["leverage"] != tracked_position["leverage"]
+            or updated_position["direction"] != tracked_position["direction"]):
+        return True
+    if size_change_pct is None:
+        return False
+    tracked_size = abs(tracked_position["size"])
+    return abs(abs(updated_position["size"]) -
+               tracked_size) > tracked_size * size_change_pct / 100
+
+
+def compute_differences(tracked_snapshot, updated_snapshot,
+                        size_change_pct=None):
+    # Vaults in updated order, changed and opened coins in updated order,
+    # followed by closed coins in tracked order. Plain dict lookups: the
+    # daemon diffs one vault at a time, where building arrays costs more
+    # than the comparison itself.
+    differences = {}
+
+    for vault_address, updated_vault in updated_snapshot.items():
+        updated_positions = updated_vault.get("positions", {})
+        tracked_positions = tracked_snapshot.get(vault_address,
+                                                 {}).get("positions", {})
+
+        changed_positions = {}
+
+        for coin, updated_position in updated_positions.items():
+            tracked_position = tracked_positions.get(coin)
+
+            if not tracked_position:
+                changed_positions[coin] = {
+                    "before": {},
+                    "after": updated_position
+                }
+            elif has_position_changed(tracked_position, updated_position,
+                                      size_change_pct):
+                changed_positions[coin] = {
+                    "before": tracked_position,
+                    "after": updated_position
+                }
+
+        for coin, tracked_position in tracked_positions.items():
+            if coin not in updated_positions:
+                changed_positions[coin] = {
+                    "before": tracked_position,
+                    "after": {}
+                }
+
+        if changed_positions:
+            differences[vault_address] = {
+                "vault_name": updated_vault["vault_name"],
+                "vault_tvl": updated_vault["vault_tvl"],
+                "vault_apr": updated_vault["vault_apr"],
+                "positions": changed_positions
+            }
+
+    return differences
+
+
+def get_differences_hash(differences, size_change_pct=None):
+    # Hash of the fields has_position_changed compares, so the same changes
+    # hash the same although values and PnL move between polls
+    fields = ["direction", "leverage"]
+    if size_change_pct is not None:
+        fields.append("size")
+    changes = {
+        vault_address: {
+            coin: {
+                side: [position.get(field) for field in fields]
+                for side, position in change.items()
+            }
+            for coin, change in vault_updates["positions"].items()
+        }
+        for vault_address, vault_updates in differences.items()
+    }
+    return hashlib.sha256(json.dumps(changes,
+                                     sort_keys=True).encode()).hexdigest()
+
+
+def aggregate_positions(snapshot, min_vault_apr, top_k=10):
+    # One pass over the positions. Counters and per-coin sums are filled in
+    # first-seen coin order, only vaults with APR >= min_vault_apr are
+    # counted, the total positions values cover every vault.
+    total_long_positions_value = 0.0
+    total_short_positions_value = 0.0
+    long_short_counter = {"LONG": {}, "SHORT": {}}
+    long_notional = {}
+    short_notional = {}
+    net_notional = {}
+    apr_weighted_sum = {}
+    valid_vaults_count = 0
+    total_tvl = 0.0
+    total_apr = 0.0
+
+    for vault in snapshot.values():
+        vault_tvl = vault["vault_tvl"]
+        vault_apr = vault["vault_apr"]
+        qualifying = vault_apr >= min_vault_apr
+        if qualifying:
+            valid_vaults_count += 1
+            total_tvl += vault_tvl
+            total_apr += vault_apr
+
+        for coin, position in vault.get("positions", {}).items():
+            if not position:
+                continue
+            direction = position["direction"]
+            position_value = position["position_value"]
+            if direction == "LONG":
+                total_long_positions_value += position_value
+            else:
+                total_short_positions_value += position_value
+            if not qualifying:
+                continue
+
+            counter = long_short_counter[direction]
+            counter[coin] = counter.get(coin, 0) + 1
+            if direction == "LONG":
+                signed_value = position_value
+                long_notional[coin] = long_notional.get(coin,
+                                                        0.0) + position_value
+            else:
+                signed_value = -position_value
+                short_notional[coin] = short_notional.get(
+                    coin, 0.0) + position_value
+            net_notional[coin] = net_notional.get(coin, 0.0) + signed_value
+            # Exposure/TVL ratio of the vault, averaged by APR below
+            exposure_ratio = signed_value / vault_tvl if vault_tvl > 0 else 0.0
+            apr_weighted_sum[coin] = apr_weighted_sum.get(
+                coin, 0.0) + exposure_ratio * vault_apr
+
+    # Net exposure of each coin, weighted by vault TVL (net notional over
+    # the total TVL) and by vault APR
+    tvl_weighted = {
+        coin: value / total_tvl if total_tvl > 0 else 0.0
+        for coin, value in net_notional.items()
+    }
+    apr_weighted = {
+        coin: value / total_apr if total_apr > 0 else 0.0
+        for coin, value in apr_weighted_sum.items()
+    }
+
+    # nlargest is stable, ties keep the first-seen coin first
+    top_coins = heapq.nlargest(max(0, top_k),
+                               net_notional,
+                               key=lambda coin: abs(net_notional[coin]))
+
+    return {
+        "valid_vaults_count": valid_vaults_count,
+        "total_long_positions_value": total_long_positions_value,
+        "total_short_positions_value": total_short_positions_value,
+        "long_short_counter": long_short_counter,
+        "long_notional": long_notional,
+        "short_notional": short_notional,
+        "net_notional": net_notional,
+        "tvl_weighted_net_exposure": tvl_weighted,
+        "apr_weighted_net_exposure": apr_weighted,
+        "top_coins": [{
+            "coin": coin,
+            "net_notional": net_notional[coin],
+            "tvl_weighted_net_exposure": tvl_weighted[coin],
+            "apr_weighted_net_exposure": apr_weighted[coin],
+        } for coin in top_coins],
+    }
@@ -0,0 +1,129 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from utils import can_be_float
+
+
+class TokenBucket:
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate or 0)
+        self.capacity = float(capacity if capacity is not None else max(
+            self.rate, 1))
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def wait_time(self, tokens=1):
+        # Seconds until the tokens are available, without taking them
+        if self.rate <= 0:
+            return 0
+        with self.lock:
+            self._refill()
+            return max(0.0, (tokens - self.tokens) / self.rate)
+
+    def try_acquire(self, tokens=1):
+        # Returns 0 once the tokens are taken, otherwise the seconds to wait
+        if self.rate <= 0:
+            return 0
+        with self.lock:
+            self._refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0
+            return (tokens - self.tokens) / self.rate
+
+    def acquire(self, tokens=1):
+        # A non-positive rate disables throttling altogether
+        while True:
+            wait_time = self.try_acquire(tokens)
+            if wait_time <= 0:
+                return
+            time.sleep(wait_time)
+
+
+# Request weights of the info endpoint, everything else weighs DEFAULT_INFO_WEIGHT
+INFO_REQUEST_WEIGHTS = {
+    "l2Book": 2,
+    "allMids": 2,
+    "clearinghouseState": 2,
+    "orderStatus": 2,
+    "spotClearinghouseState": 2,
+    "exchangeStatus": 2,
+}
+DEFAULT_INFO_WEIGHT = 20
+
+
+def get_info_request_weight(request_type):
+    return INFO_REQUEST_WEIGHTS.get(request_type, DEFAULT_INFO_WEIGHT)
+
+
+def backoff_delay(attempt, base, cap):
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(cap, base * (2**attempt)))
+
+
+def parse_retry_after(headers):
+    value = (headers or {}).get("Retry-After")
+    if not value:
+        return None
+
+    if can_be_float(value):
+        return max(0.0, float(value))
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class InfoRateLimiter:
+
+    def __init__(self,
+                 requests_per_second,
+                 weight_per_minute,
+                 min_weight_per_minute=None):
+        self.request_bucket = TokenBucket(requests_per_second)
+        self.max_weight_rate = weight_per_minute / 60
+        self.min_weight_rate = (min_weight_per_minute
+                                or weight_per_minute / 8) / 60
+        self.weight_bucket = TokenBucket(self.max_weight_rate,
+                                         weight_per_minute)
+        self.cooldown_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, request_type):
+        with self.lock:
+            cooldown = self.cooldown_until - time.monotonic()
+        if cooldown > 0:
+            time.sleep(cooldown)
+
+        self.request_bucket.acquire()
+        self.weight_bucket.acquire(get_info_request_weight(request_type))
+
+    def on_success(self):
+        # Additive increase back towards the documented weight budget
+        with self.weight_bucket.lock:
+            self.weight_bucket.rate = min(
+                self.max_weight_rate,
+                self.weight_bucket.rate + self.max_weight_rate / 100)
+
+    def on_throttled(self, retry_after=None):
+        # Multiplicative decrease, and a short global pause when the server
+        # tells us how long to wait
+        with self.weight_bucket.lock:
+            self.weight_bucket.rate = max(self.min_weight_rate,
+                                          self.weight_bucket.rate / 2)
+        if retry_after:
+            with self.lock:
+                self.cooldown_until = max(self.cooldown_until,
+                                          time.monotonic() + retry_after)
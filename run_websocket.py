@@ -1,46 +1,72 @@
 import signal
+import time
 import telebot
 from datetime import datetime
 import pytz
 import asyncio
-import queue
-import threading
+import hashlib
 from websocket_manager import WebsocketManager
+from api_client import fetch_info_batch
+from rate_limiter import InfoRateLimiter
+from seen_fills import SeenFills
+from fill_aggregator import FillAggregator, aggregate_fills
+from alert_outbox import AlertOutbox
+from mid_prices import get_mid_price_cache
+from telegram_delivery import (TelegramDelivery, PRIORITY_ERROR,
+                               PRIORITY_FILL, PRIORITY_SUMMARY,
+                               print_delivery_stats)
 from utils import *
 from config import (TIMEZONE, TELEGRAM_BOT_TOKEN, TEST_TG_CHAT_ID_2,
-                    MAX_RETRIES, ADDRESSES_TO_TRACK, SUBSCRIPTION_TYPE)
+                    ADDRESSES_TO_TRACK, SUBSCRIPTION_TYPE,
+                    WS_DISPATCH_MODE, WS_DISPATCH_WORKERS,
+                    WS_DISPATCH_QUEUE_SIZE, WS_DISPATCH_OVERFLOW_POLICY,
+                    WS_STATS_INTERVAL, WS_USE_ASYNCIO,
+                    SEEN_FILLS_PER_ADDRESS, SEEN_FILLS_SAVE_INTERVAL,
+                    SEEN_FILLS_RESUME_WINDOW, FILL_AGGREGATION_WINDOW,
+                    FILL_AGGREGATION_MAX_WINDOW, TELEGRAM_DRAIN_TIMEOUT,
+                    MAX_REQUESTS_PER_SECOND, INFO_WEIGHT_PER_MINUTE)
 
 bot = telebot.TeleBot(TELEGRAM_BOT_TOKEN, threaded=False)
-is_first_message = True
+tracked_addresses = list(
+    dict.fromkeys(address.lower() for address in ADDRESSES_TO_TRACK
+                  if address))
+subscription_types = [
+    subscription_type.strip()
+    for subscription_type in SUBSCRIPTION_TYPE.split(",")
+    if subscription_type.strip()
+]
+# orderUpdates messages do not carry the user, so only one address can be
+# subscribed per connection
+order_updates_user = tracked_addresses[0] if tracked_addresses else ''
+# Alerted fills per lower-cased address, also used to resume after a
+# reconnect or restart without alerting a fill twice
+seen_fills = SeenFills(max_per_address=SEEN_FILLS_PER_ADDRESS,
+                       save_interval=SEEN_FILLS_SAVE_INTERVAL,
+                       resume_window=SEEN_FILLS_RESUME_WINDOW).load()
+# Shared by the missed-fills requests of every address, which all go out at
+# once after a reconnect
+info_rate_limiter = InfoRateLimiter(MAX_REQUESTS_PER_SECOND,
+                                    INFO_WEIGHT_PER_MINUTE)
 send_to_tg = True
-message_queue = queue.Queue()
-mirrored_queue = queue.Queue()
-
 try:
     timezone = pytz.timezone(TIMEZONE)
 except:
     timezone = pytz.timezone('Asia/Singapore')
 
 
-def worker():
-    while True:
-        msg_list = message_queue.get()
-        if msg_list is None:
-            break
-        try:
-            send_to_telegram(msg_list, bot, TEST_TG_CHAT_ID_2, MAX_RETRIES, 1,
-                             5)
-        except Exception as e:
-            print(f"Error sending message to Telegram: {e}")
-        finally:
-            message_queue.task_done()
-
-        print("Current queue before get: ", list(mirrored_queue.queue))
-        _ = mirrored_queue.get()
+telegram_delivery = TelegramDelivery(bot)
+# Alerts are stored before they are queued, undelivered ones are resent on
+# the next start
+alert_outbox = AlertOutbox(telegram_delivery, "websocket")
+# Latest mid price of every coin, alerts are marked to market from it
+mid_prices = get_mid_price_cache()
 
 
-worker_thread = threading.Thread(target=worker, daemon=True)
-worker_thread.start()
+def queue_telegram_message(msg_list, priority, key=None):
+    # Waits for room when the delivery queue is full, the websocket keeps
+    # reading while handlers run on the dispatcher workers
+    if not alert_outbox.add(msg_list, TEST_TG_CHAT_ID_2, priority, key=key):
+        print("Alert already sent or delivery queue full, message dropped.")
 
 
 def get_direction_icon(direction):
@@ -54,73 +80,148 @@ def get_direction_icon(direction):
         return "⚪"
 
 
+def fetch_missed_fills(user, snapshot_fills):
+    # The snapshot sent after a reconnect or restart only holds the latest
+    # fills, so the gap since the newest seen fill is fetched from the info
+    # API, throttled and retried like the vault queries. The snapshot is
+    # only used once the retries are exhausted.
+    fills = fetch_info_batch(
+        {
+            user: {
+                "type": "userFillsByTime",
+                "user": user,
+                "startTime": seen_fills.latest_time(user)
+            }
+        }, 1, info_rate_limiter).get(user)
+    if not isinstance(fills, list):
+        print(
+            f"Could not fetch missed fills of {user}, using the snapshot instead."
+        )
+        fills = snapshot_fills
+    fills = sorted(fills,
+                   key=lambda fill: (fill.get("time", 0), fill.get("tid", 0)))
+    return seen_fills.add_new(user, fills)
+
+
+FILL_TEMPLATE = ("🔗 *Tracked Address*: {user}\n"
+                 "#️⃣ *Hash*: {hash}\n"
+                 "⏰ **Time**: {time}\n"
+                 "💰 **Coin**: {coin}\n"
+                 "{price_lines}"
+                 "💵 **Size (in USD)**: ${notional:,.2f}\n"
+                 "{mark_lines}"
+                 "{direction_icon} **Direction**: {direction}\n\n")
+SINGLE_FILL_PRICE_LINES = "📊 **Price**: ${vwap:,.2f}\n"
+MULTIPLE_FILLS_PRICE_LINES = ("📊 **Avg Price (VWAP)**: ${vwap:,.2f}\n"
+                              "🧩 **Fills**: {fill_count}\n")
+MARK_LINES = ("📍 **Mid Price**: ${mid:,.2f} ({mid_change:+.2%} vs fill)\n"
+              "💹 **Value at Mid**: ${mark_value:,.2f}\n")
+
+
+def make_fill_template(price_lines, mark_lines=""):
+    return TelegramTemplate(
+        FILL_TEMPLATE.replace("{price_lines}",
+                              price_lines).replace("{mark_lines}",
+                                                   mark_lines))
+
+
+SINGLE_FILL_TEMPLATE = make_fill_template(SINGLE_FILL_PRICE_LINES)
+MULTIPLE_FILLS_TEMPLATE = make_fill_template(MULTIPLE_FILLS_PRICE_LINES)
+# Used while the allMids price of the coin is fresh
+MARKED_SINGLE_FILL_TEMPLATE = make_fill_template(SINGLE_FILL_PRICE_LINES,
+                                                 MARK_LINES)
+MARKED_MULTIPLE_FILLS_TEMPLATE = make_fill_template(
+    MULTIPLE_FILLS_PRICE_LINES, MARK_LINES)
+
+
+def format_fill_aggregate(aggregate):
+    # Returns the template of the alert and its values
+    dt_str = datetime.fromtimestamp(aggregate.last_time / 1000,
+                                    timezone).strftime('%Y-%m-%d %H:%M:%S')
+    mid = mid_prices.get(aggregate.coin)
+    if mid is None:
+        template = (SINGLE_FILL_TEMPLATE if aggregate.fill_count == 1 else
+                    MULTIPLE_FILLS_TEMPLATE)
+    else:
+        template = (MARKED_SINGLE_FILL_TEMPLATE if aggregate.fill_count == 1
+                    else MARKED_MULTIPLE_FILLS_TEMPLATE)
+    return template, {
+        "user": aggregate.user,
+        "hash": aggregate.last_hash,
+        "time": dt_str,
+        "coin": aggregate.coin,
+        "vwap": aggregate.vwap,
+        "fill_count": aggregate.fill_count,
+        "notional": aggregate.notional,
+        "mid": mid,
+        "mid_change": mid / aggregate.vwap - 1 if mid and aggregate.vwap else 0,
+        "mark_value": mid * aggregate.size if mid else 0,
+        "direction_icon": get_direction_icon(aggregate.direction),
+        "direction": aggregate.direction,
+    }
+
+
+def emit_fill_alerts(aggregates, header=f"🚨 **Trade Filled Alert** 🚨\n\n"):
+    msg_list = [header]
+    for aggregate in aggregates:
+        template, values = format_fill_aggregate(aggregate)
+        print(template.format(**values))
+        msg_list.append(template.render(**values))
+
+    if send_to_tg:
+        # The same fills are never alerted twice, even when they are replayed
+        # after a restart
+        key = "fills:" + hashlib.sha256("\n".join(
+            f"{aggregate.user}:{aggregate.oid}:{aggregate.last_hash}:{aggregate.fill_count}"
+            for aggregate in aggregates).encode()).hexdigest()
+        queue_telegram_message(msg_list, PRIORITY_FILL, key=key)
+
+    # Only now that the alert is in the outbox are its fills recorded as
+    # seen, a crash inside the aggregation window leaves them to be fetched
+    # again as missed fills
+    for aggregate in aggregates:
+        seen_fills.commit(aggregate.user, aggregate.fills)
+    seen_fills.save_if_due()
+
+
+# Partial fills of an order are merged into a single alert
+fill_aggregator = FillAggregator(emit_fill_alerts,
+                                 window=FILL_AGGREGATION_WINDOW,
+                                 max_window=FILL_AGGREGATION_MAX_WINDOW)
+
+
 def on_user_fills_message(ws_msg):
-    global is_first_message
 
     if not isinstance(ws_msg, dict):
         print("Unexpected message format:", type(ws_msg))
         return
 
     try:
-        fills = ws_msg.get("data", {}).get("fills", [])
+        data = ws_msg.get("data", {})
+        user = data.get("user", "").lower()
+        fills = data.get("fills", [])
 
         if not fills:
             print("No fills found in the message.")
             return
 
-        if is_first_message:
-            is_first_message = False
-            print("Skipping alert for historical data.")
+        if data.get("isSnapshot"):
+            if not seen_fills.can_resume(user):
+                seen_fills.commit(user, fills)
+                seen_fills.save_if_due()
+                print(f"Skipping alert for historical data of {user}.")
+                return
+            fills = fetch_missed_fills(user, fills)
+            print(f"Found {len(fills)} missed fill(s) of {user}.")
+            if fills:
+                emit_fill_alerts(
+                    aggregate_fills(user, fills),
+                    f"🚨 **Missed Fills While Disconnected** 🚨\n\n")
             return
 
-        msg_list = []
-        header = f"🚨 **Trade Filled Alert** 🚨\n\n"
-
-        coin_dir_cache = {}
-
-        print("Received user fills:")
-        for fill in fills:
-            coin = fill.get("coin")
-            px = float(fill.get("px", 0))
-            sz = float(fill.get("sz", 0))
-            sz_usd = px * sz
-            timestamp = fill.get("time")
-            direction = fill.get("dir")
-            hash = fill.get("hash")
-
-            if coin not in coin_dir_cache:
-                coin_dir_cache[coin] = direction
-            else:
-                if coin_dir_cache[coin] == direction:
-                    continue
-                else:
-                    coin_dir_cache[coin] = direction
-
-            dt_utc = datetime.utcfromtimestamp(timestamp / 1000)
-            dt_sg = pytz.utc.localize(dt_utc).astimezone(timezone)
-            dt_str = dt_sg.strftime('%Y-%m-%d %H:%M:%S')
-
-            msg = (
-                f"🔗 *Tracked Address*: {ADDRESSES_TO_TRACK[0]}\n"
-                f"#️⃣ *Hash*: {hash}\n"
-                f"⏰ **Time**: {dt_str}\n"
-                f"💰 **Coin**: {coin}\n"
-                f"📊 **Price**: ${px:,.2f}\n"
-                f"💵 **Size (in USD)**: ${sz_usd:,.2f}\n"
-                f"{get_direction_icon(direction)} **Direction**: {direction}\n\n"
-            )
-
-            print(msg)
-
-            msg_list.append(msg)
-
-        if send_to_tg and msg_list:
-            msg_list.insert(0, header)
-
-            # send_to_telegram(msg_list, bot, TEST_TG_CHAT_ID_2, MAX_RETRIES, 1,
-            #                  5)
-            message_queue.put(msg_list)
-            mirrored_queue.put(msg_list)
+        fills = seen_fills.add_new(user, fills)
+        print(f"Received {len(fills)} new fill(s) of {user}.")
+        fill_aggregator.add(user, fills)
 
     except Exception as e:
         print(f"Error processing userFills message: {e}")
@@ -129,10 +230,7 @@ def on_user_fills_message(ws_msg):
             error_message += f"**Error Message**: {e}\n"
             error_message += f"Please investigate the issue."
             msg_list = [error_message]
-            # send_to_telegram(msg_list, bot, TEST_TG_CHAT_ID_2, MAX_RETRIES, 1,
-            #                  5)
-            message_queue.put(msg_list)
-            mirrored_queue.put(msg_list)
+            queue_telegram_message(msg_list, PRIORITY_ERROR)
 
 
 def on_order_updates_message(ws_msg):
@@ -173,18 +271,32 @@ def on_order_updates_message(ws_msg):
 
             sz_usd = limit_px * sz
             orig_sz_usd = limit_px * origSz
+            mid = mid_prices.get(coin)
+            if mid is not None:
+                mid_change = mid / limit_px - 1 if limit_px else 0
+                mark_lines = (
+                    f"📍 **Mid Price**: ${mid:,.2f} ({mid_change:+.2%} vs limit)\n"
+                    f"💹 **Size at Mid (in USD)**: ${mid * sz:,.2f}\n")
+            else:
+                mark_lines = ""
+
+            # Pending partial fills of a finished order are alerted now
+            if status not in ("open", "triggered"):
+                fill_aggregator.complete_order(order_updates_user,
+                                               basic_order.get("oid"))
 
             dt_utc = datetime.utcfromtimestamp(timestamp / 1000)
             dt_sg = pytz.utc.localize(dt_utc).astimezone(timezone)
             dt_str = dt_sg.strftime('%Y-%m-%d %H:%M:%S')
 
             msg = (
-                f"🔗 *Tracked Address*: {ADDRESSES_TO_TRACK[0]}\n"
+                f"🔗 *Tracked Address*: {order_updates_user}\n"
                 f"⏰ **Time**: {dt_str}\n"
                 f"💰 **Coin**: {coin}\n"
                 f"📊 **Limit Price**: ${limit_px:,.2f}\n"
                 f"💵 **Size (in USD)**: ${sz_usd:,.2f}\n"
                 f"💵 **Original Size (in USD)**: ${orig_sz_usd:,.2f}\n"
+                f"{mark_lines}"
                 f"{get_direction_icon(direction)} **Direction**: {direction}\n"
                 f"🛒 **Order Status**: {status.capitalize()}\n\n")
 
@@ -193,10 +305,7 @@ def on_order_updates_message(ws_msg):
             msg_list.append(msg)
 
         if send_to_tg:
-            # send_to_telegram(msg_list, bot, TEST_TG_CHAT_ID_2, MAX_RETRIES, 1,
-            #                  5)
-            message_queue.put(msg_list)
-            mirrored_queue.put(msg_list)
+            queue_telegram_message(msg_list, PRIORITY_FILL)
 
     except Exception as e:
         print(f"Error processing orderUpdates message: {e}")
@@ -205,86 +314,240 @@ def on_order_updates_message(ws_msg):
             error_message += f"**Error Message**: {e}\n"
             error_message += f"Please investigate the issue."
             msg_list = [error_message]
-            # send_to_telegram(msg_list, bot, TEST_TG_CHAT_ID_2, MAX_RETRIES, 1,
-            #                  5)
-            message_queue.put(msg_list)
-            mirrored_queue.put(msg_list)
+            queue_telegram_message(msg_list, PRIORITY_ERROR)
 
 
-def on_ws_close(ws):
-    print("WebSocket closed. Reconnecting...")
-    if send_to_tg:
-        error_message = f"❌ **WebSocket Closed** ❌\n\n"
-        error_message += f"Attempting to reconnect..."
-        msg_list = [error_message]
-        # send_to_telegram(msg_list, bot, TEST_TG_CHAT_ID_2, MAX_RETRIES, 1, 5)
-        message_queue.put(msg_list)
-        mirrored_queue.put(msg_list)
+def on_user_fundings_message(ws_msg):
 
-    reconnect()
+    if not isinstance(ws_msg, dict):
+        print("Unexpected message format:", type(ws_msg))
+        return
 
+    try:
+        data = ws_msg.get("data", {})
+        user = data.get("user", "").lower()
+        fundings = data.get("fundings", [])
 
-def on_ws_error(ws, error):
-    print(f"WebSocket error: {error}. Reconnecting...")
-    if send_to_tg:
-        error_message = f"❌ **WebSocket Error** ❌\n\n"
-        error_message += f"**Error**: {error}\n"
-        error_message += f"Attempting to reconnect..."
-        msg_list = [error_message]
-        # send_to_telegram(msg_list, bot, TEST_TG_CHAT_ID_2, MAX_RETRIES, 1, 5)
-        message_queue.put(msg_list)
-        mirrored_queue.put(msg_list)
+        if not fundings:
+            print("No fundings found in the message.")
+            return
 
-    reconnect()
+        if data.get("isSnapshot"):
+            print(f"Skipping alert for historical fundings of {user}.")
+            return
 
+        msg_list = [f"💸 **Funding Payments Alert** 💸\n\n"]
 
-def create_ws_manager_and_subscribe():
-    global ws_manager
-    ws_manager = WebsocketManager("http://api.hyperliquid.xyz")
-    ws_manager.on_close = on_ws_close
-    ws_manager.on_error = on_ws_error
-    ws_manager.start()
-    if SUBSCRIPTION_TYPE == "userFills":
-        subscription = {
-            "type": "userFills",
-            "user": ADDRESSES_TO_TRACK[0],
-        }
-        ws_manager.subscribe(subscription, on_user_fills_message)
+        print(f"Received user fundings of {user}:")
+        for funding in fundings:
+            coin = funding.get("coin")
+            usdc = float(funding.get("usdc", 0))
+            szi = float(funding.get("szi", 0))
+            funding_rate = float(funding.get("fundingRate", 0))
+            timestamp = funding.get("time", 0)
+
+            dt_utc = datetime.utcfromtimestamp(timestamp / 1000)
+            dt_sg = pytz.utc.localize(dt_utc).astimezone(timezone)
+            dt_str = dt_sg.strftime('%Y-%m-%d %H:%M:%S')
+
+            msg = (f"🔗 *Tracked Address*: {user}\n"
+                   f"⏰ **Time**: {dt_str}\n"
+                   f"💰 **Coin**: {coin}\n"
+                   f"📏 **Position Size**: {szi:,.4f}\n"
+                   f"📈 **Funding Rate**: {funding_rate:.6%}\n"
+                   f"💵 **Payment (in USD)**: ${usdc:,.2f}\n\n")
+
+            print(msg)
+
+            msg_list.append(msg)
+
+        if send_to_tg:
+            queue_telegram_message(msg_list, PRIORITY_FILL)
+
+    except Exception as e:
+        print(f"Error processing userFundings message: {e}")
+        if send_to_tg:
+            error_message = f"❌ **An error occurred while processing the userFundings message** ❌\n\n"
+            error_message += f"**Error Message**: {e}\n"
+            error_message += f"Please investigate the issue."
+            msg_list = [error_message]
+            queue_telegram_message(msg_list, PRIORITY_ERROR)
+
+
+SUBSCRIPTION_HANDLERS = {
+    "userFills": on_user_fills_message,
+    "orderUpdates": on_order_updates_message,
+    "userFundings": on_user_fundings_message,
+}
+
+
+def queue_ws_disconnect_alert(error=None):
+    # Called once per lost connection, the manager reconnects in place
+    if error is None:
+        print("WebSocket closed. Reconnecting...")
     else:
-        subscription = {"type": "orderUpdates", "user": ADDRESSES_TO_TRACK[0]}
-        ws_manager.subscribe(subscription, on_order_updates_message)
+        print(f"WebSocket error: {error}. Reconnecting...")
+    if send_to_tg:
+        if error is None:
+            error_message = f"❌ **WebSocket Closed** ❌\n\n"
+        else:
+            error_message = f"❌ **WebSocket Error** ❌\n\n"
+            error_message += f"**Error**: {error}\n"
+        error_message += f"Attempting to reconnect..."
+        msg_list = [error_message]
+        queue_telegram_message(msg_list, PRIORITY_ERROR)
+
 
+def queue_ws_reconnected_alert(attempts):
+    if send_to_tg:
+        msg_list = [
+            f"✅ **WebSocket Reconnected** ✅\n\n"
+            f"Reconnected after {attempts} attempt(s), subscriptions resumed."
+        ]
+        queue_telegram_message(msg_list, PRIORITY_ERROR)
+
+
+def run_off_loop(func):
+    # In asyncio mode, the handlers would block the event loop on the missed
+    # fills request, the outbox fsync and the delivery queue. They run on a
+    # worker thread instead, and are awaited so that the messages of a
+    # connection are still handled in order.
+    async def callback(*args):
+        await asyncio.to_thread(func, *args)
+
+    return callback
+
+
+def schedule_off_loop(func):
+    # Connection callbacks are not awaited by the manager, they only need
+    # to leave the event loop
+    def callback(*args):
+        asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    return callback
+
+
+def subscribe_tracked_addresses(manager, wrap_handler=None):
+    # Every tracked address shares the same connection, along with the
+    # allMids feed the alerts are marked to market from
+    mid_prices.subscribe(manager)
+    for subscription_type in subscription_types:
+        handler = SUBSCRIPTION_HANDLERS.get(subscription_type)
+        if handler is None:
+            print(f"Subscription type {subscription_type} is not supported.")
+            continue
+        if wrap_handler is not None:
+            handler = wrap_handler(handler)
+
+        if subscription_type == "orderUpdates":
+            if len(tracked_addresses) > 1:
+                print(
+                    f"orderUpdates can only track one address per connection, only {order_updates_user} is subscribed."
+                )
+            addresses = tracked_addresses[:1]
+        else:
+            addresses = tracked_addresses
+
+        for address in addresses:
+            subscription = {"type": subscription_type, "user": address}
+            manager.subscribe(subscription, handler)
+
+
+def queue_started_message():
     if send_to_tg:
         init_message = f"🚀 **WebSocket Started** 🚀\n\n"
-        init_message += f"**Subscription Type**: {SUBSCRIPTION_TYPE}\n"
-        init_message += f"**Tracked User Address**: {ADDRESSES_TO_TRACK[0]}"
+        init_message += f"**Subscription Type**: {', '.join(subscription_types)}\n"
+        if len(tracked_addresses) <= 10:
+            init_message += f"**Tracked User Address**: {', '.join(tracked_addresses)}"
+        else:
+            init_message += f"**Tracked User Addresses**: {len(tracked_addresses)}"
         msg_list = [init_message]
-        # send_to_telegram(msg_list, bot, TEST_TG_CHAT_ID_2, MAX_RETRIES, 1, 5)
-        message_queue.put(msg_list)
-        mirrored_queue.put(msg_list)
+        queue_telegram_message(msg_list, PRIORITY_SUMMARY)
 
 
-def reconnect():
+def create_ws_manager_and_subscribe():
     global ws_manager
-    print("Attempting to reconnect...")
-
-    if ws_manager:
-        ws_manager.stop()
-
-    create_ws_manager_and_subscribe()
+    ws_manager = WebsocketManager("http://api.hyperliquid.xyz",
+                                  dispatch_mode=WS_DISPATCH_MODE,
+                                  dispatch_workers=WS_DISPATCH_WORKERS,
+                                  dispatch_queue_size=WS_DISPATCH_QUEUE_SIZE,
+                                  overflow_policy=WS_DISPATCH_OVERFLOW_POLICY,
+                                  on_disconnect=queue_ws_disconnect_alert,
+                                  on_reconnect=queue_ws_reconnected_alert)
+    ws_manager.start()
+    subscribe_tracked_addresses(ws_manager)
+    queue_started_message()
 
 
 def signal_handler(sig, frame):
     print("Stopping WebSocketManager...")
     if ws_manager:
         ws_manager.stop()
+    fill_aggregator.stop()
+    telegram_delivery.stop(drain=True, timeout=TELEGRAM_DRAIN_TIMEOUT)
+    alert_outbox.prune()
+    seen_fills.save()
     print("WebSocketManager stopped. Exiting.")
     exit(0)
 
 
 signal.signal(signal.SIGINT, signal_handler)
 
+
+def print_dispatch_stats():
+    for subscription_id, stats in ws_manager.get_dispatch_stats().items():
+        print(
+            "Subscription {} ({}): queue depth {} (max {}), {} dispatched, {} dropped, {} coalesced"
+            .format(subscription_id, stats["identifier"],
+                    stats["queue_depth"], stats["max_depth"],
+                    stats["dispatched"], stats["dropped"],
+                    stats["coalesced"]))
+
+
+async def run_async():
+    # The connection and its ping timer run on this event loop, the handlers
+    # run on worker threads
+    from async_websocket_manager import AsyncWebsocketManager
+    global ws_manager
+
+    stop_event = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGINT,
+                                                  stop_event.set)
+
+    ws_manager = AsyncWebsocketManager(
+        "http://api.hyperliquid.xyz",
+        on_disconnect=schedule_off_loop(queue_ws_disconnect_alert),
+        on_reconnect=schedule_off_loop(queue_ws_reconnected_alert))
+    subscribe_tracked_addresses(ws_manager, run_off_loop)
+    ws_manager.start()
+    await asyncio.to_thread(queue_started_message)
+    while not stop_event.is_set():
+        try:
+            await asyncio.wait_for(stop_event.wait(), WS_STATS_INTERVAL)
+        except asyncio.TimeoutError:
+            print_delivery_stats(telegram_delivery)
+
+    print("Stopping WebSocketManager...")
+    await ws_manager.stop()
+    fill_aggregator.stop()
+    telegram_delivery.stop(drain=True, timeout=TELEGRAM_DRAIN_TIMEOUT)
+    alert_outbox.prune()
+    seen_fills.save()
+    print("WebSocketManager stopped. Exiting.")
+
+
 if __name__ == "__main__":
+    telegram_delivery.start()
+    alert_outbox.replay()
+    fill_aggregator.start()
+    if WS_USE_ASYNCIO:
+        asyncio.run(run_async())
+        exit(0)
     create_ws_manager_and_subscribe()
+    last_stats_time = time.time()
     while True:
         time.sleep(1)
+        if time.time() - last_stats_time >= WS_STATS_INTERVAL:
+            last_stats_time = time.time()
+            print_dispatch_stats()
+            print_delivery_stats(telegram_delivery)
@@ -0,0 +1,145 @@
+import threading
+import time
+from collections import OrderedDict
+from utils import load_json_file_atomic, save_json_file_atomic
+
+SEEN_FILLS_FILE_PATH = "./saved_data/cache/seen_fills.json"
+
+
+def get_fill_key(fill):
+    tid = fill.get("tid")
+    return str(tid) if tid is not None else fill.get("hash")
+
+
+class SeenFills:
+
+    # Bounded LRU of alerted fill ids (tid, or hash when there is none) per
+    # address, plus the time missed fills are fetched from per address: the
+    # newest alerted fill, held back to the oldest fill still waiting for
+    # its alert. Persisted to disk so that duplicates are still suppressed
+    # and no fill is missed after a restart.
+
+    def __init__(self,
+                 file_path=SEEN_FILLS_FILE_PATH,
+                 max_per_address=1000,
+                 save_interval=10,
+                 resume_window=3600):
+        self.file_path = file_path
+        self.max_per_address = max_per_address
+        self.save_interval = save_interval
+        self.resume_window = resume_window
+        self.fills = {}
+        self.latest_times = {}
+        # Newest alerted fill time per address
+        self.committed_times = {}
+        # Fills received but not alerted yet, key -> fill time per address,
+        # never saved
+        self.pending = {}
+        # Addresses whose fill stream was followed by this process
+        self.live_users = set()
+        self.saved_at = 0
+        self.last_save_time = time.time()
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    def load(self):
+        data = load_json_file_atomic(self.file_path, {})
+        with self.lock:
+            self.saved_at = data.get("saved_at", 0)
+            for user, entry in data.get("addresses", {}).items():
+                self.fills[user] = OrderedDict.fromkeys(
+                    entry.get("fills", [])[-self.max_per_address:])
+                self.latest_times[user] = entry.get("latest_time", 0)
+                self.committed_times[user] = self.latest_times[user]
+        return self
+
+    def save(self):
+        with self.lock:
+            data = {
+                "saved_at": time.time(),
+                "addresses": {
+                    user: {
+                        "latest_time": self.latest_times.get(user, 0),
+                        "fills": list(fill_keys),
+                    }
+                    for user, fill_keys in self.fills.items()
+                }
+            }
+            self.dirty = False
+            self.last_save_time = time.time()
+        try:
+            save_json_file_atomic(self.file_path, data, keep_previous=False)
+        except OSError as e:
+            print(f"Could not save seen fills to {self.file_path}: {e}")
+
+    def save_if_due(self):
+        if self.dirty and time.time(
+        ) - self.last_save_time >= self.save_interval:
+            self.save()
+
+    def can_resume(self, user):
+        # Fills missed since the newest seen fill can be fetched when this
+        # process followed the address, or when the saved state is recent
+        with self.lock:
+            if user not in self.latest_times:
+                return False
+            return (user in self.live_users
+                    or time.time() - self.saved_at <= self.resume_window)
+
+    def latest_time(self, user):
+        with self.lock:
+            return self.latest_times.get(user, 0)
+
+    def add_new(self, user, fills):
+        # Returns the fills that were neither alerted nor already received by
+        # this process. They are only recorded as seen, and saved, by
+        # commit() once their alert is stored, so a crash before that does
+        # not drop them as duplicates after a restart.
+        new_fills = []
+        with self.lock:
+            self.live_users.add(user)
+            fill_keys = self.fills.setdefault(user, OrderedDict())
+            pending_times = self.pending.setdefault(user, {})
+            for fill in fills:
+                key = get_fill_key(fill)
+                if key in fill_keys:
+                    fill_keys.move_to_end(key)
+                    continue
+                if key in pending_times:
+                    continue
+                pending_times[key] = fill.get("time", 0)
+                new_fills.append(fill)
+            if new_fills:
+                self.update_latest_time(user)
+        return new_fills
+
+    def commit(self, user, fills):
+        # Records the fills as alerted (or skipped as history)
+        with self.lock:
+            self.live_users.add(user)
+            fill_keys = self.fills.setdefault(user, OrderedDict())
+            pending_times = self.pending.get(user, {})
+            for fill in fills:
+                key = get_fill_key(fill)
+                pending_times.pop(key, None)
+                fill_time = fill.get("time", 0)
+                if fill_time > self.committed_times.get(user, 0):
+                    self.committed_times[user] = fill_time
+                fill_keys[key] = None
+                fill_keys.move_to_end(key)
+                if len(fill_keys) > self.max_per_address:
+                    fill_keys.popitem(last=False)
+            self.update_latest_time(user)
+            self.dirty = True
+
+    def update_latest_time(self, user):
+        # Called with the lock held. Missed fills are fetched from the
+        # oldest pending fill on, so fills still in the aggregation window
+        # when the process dies are fetched again; the alerted ones in
+        # between are dropped by their key.
+        latest_time = self.committed_times.get(user, 0)
+        pending_times = self.pending.get(user)
+        if pending_times:
+            latest_time = min(latest_time, min(pending_times.values()))
+        if user in self.latest_times or latest_time:
+            self.latest_times[user] = latest_time
@@ -0,0 +1,287 @@
+import os
+import sqlite3
+import time
+import argparse
+from utils import save_json_file_atomic, load_json_file_atomic
+from config import SNAPSHOT_RETENTION_RUNS, SNAPSHOT_RETENTION_DAYS
+
+SNAPSHOT_DB_FILE_PATH = "./saved_data/snapshots/vault_snapshots.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS vaults (
+    run_id INTEGER NOT NULL,
+    vault_address TEXT NOT NULL,
+    vault_name TEXT,
+    vault_tvl REAL,
+    vault_apr REAL
+);
+CREATE TABLE IF NOT EXISTS positions (
+    run_id INTEGER NOT NULL,
+    vault_address TEXT NOT NULL,
+    coin TEXT NOT NULL,
+    leverage REAL,
+    position_value REAL,
+    size REAL,
+    unrealised_pnl REAL,
+    direction TEXT
+);
+CREATE INDEX IF NOT EXISTS vaults_run_idx ON vaults (run_id);
+CREATE INDEX IF NOT EXISTS vaults_address_idx ON vaults (vault_address, run_id);
+CREATE INDEX IF NOT EXISTS positions_run_idx ON positions (run_id);
+CREATE INDEX IF NOT EXISTS positions_address_idx ON positions (vault_address, run_id);
+"""
+
+
+class SnapshotStore:
+
+    def __init__(self,
+                 db_file_path=SNAPSHOT_DB_FILE_PATH,
+                 retention_runs=SNAPSHOT_RETENTION_RUNS,
+                 retention_days=SNAPSHOT_RETENTION_DAYS):
+        db_dir = os.path.dirname(db_file_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self.db_file_path = db_file_path
+        self.retention_runs = retention_runs
+        self.retention_days = retention_days
+        # Checksummed copy of the latest snapshot (plus its previous
+        # generation), used when the database itself cannot be read
+        self.latest_file_path = os.path.splitext(
+            db_file_path)[0] + "_latest.json"
+        self.recovered_from_corruption = False
+
+        try:
+            self.conn = self.connect()
+        except sqlite3.DatabaseError as e:
+            corrupted_file_path = "{}.corrupted.{}".format(
+                db_file_path, int(time.time()))
+            print("\n{} is corrupted ({}), moved to {}.\n".format(
+                db_file_path, e, corrupted_file_path))
+            os.replace(db_file_path, corrupted_file_path)
+            self.recovered_from_corruption = True
+            self.conn = self.connect()
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_file_path)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            conn.executescript(SCHEMA)
+            conn.execute("PRAGMA quick_check").fetchone()
+        except sqlite3.DatabaseError:
+            conn.close()
+            raise
+        return conn
+
+    def close(self):
+        self.conn.close()
+
+    def save_snapshot(self, snapshot, timestamp=None):
+        # Each run is appended in a single transaction
+        with self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO runs (timestamp) VALUES (?)",
+                (timestamp if timestamp is not None else time.time(), ))
+            run_id = cursor.lastrowid
+
+            self.conn.executemany(
+                "INSERT INTO vaults VALUES (?, ?, ?, ?, ?)",
+                ((run_id, vault_address, vault["vault_name"],
+                  vault["vault_tvl"], vault["vault_apr"])
+                 for vault_address, vault in snapshot.items()))
+            self.conn.executemany(
+                "INSERT INTO positions VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                ((run_id, vault_address, coin, position["leverage"],
+                  position["position_value"], position["size"],
+                  position["unrealised_pnl"], position["direction"])
+                 for vault_address, vault in snapshot.items()
+                 for coin, position in vault.get("positions", {}).items()))
+
+        save_json_file_atomic(self.latest_file_path, {
+            "run_id": run_id,
+            "snapshot": snapshot
+        })
+
+        try:
+            self.prune()
+        except sqlite3.DatabaseError as e:
+            print("\nFailed to prune {} ({}).\n".format(self.db_file_path, e))
+
+        return run_id
+
+    def prune(self):
+        # Drops the runs beyond the last retention_runs and those older than
+        # retention_days, the latest run is always kept
+        latest_run_id = self.latest_run_id()
+        if latest_run_id is None:
+            return 0
+
+        first_kept_run_id = None
+        if self.retention_runs:
+            row = self.conn.execute(
+                "SELECT run_id FROM runs ORDER BY run_id DESC LIMIT 1 OFFSET ?",
+                (self.retention_runs - 1, )).fetchone()
+            if row is not None:
+                first_kept_run_id = row[0]
+        if self.retention_days:
+            row = self.conn.execute(
+                "SELECT MIN(run_id) FROM runs WHERE timestamp >= ?",
+                (time.time() - self.retention_days * 86400, )).fetchone()
+            run_id = row[0] if row[0] is not None else latest_run_id
+            first_kept_run_id = max(first_kept_run_id or 0, run_id)
+        if first_kept_run_id is None:
+            return 0
+
+        with self.conn:
+            self.conn.execute("DELETE FROM vaults WHERE run_id < ?",
+                              (first_kept_run_id, ))
+            self.conn.execute("DELETE FROM positions WHERE run_id < ?",
+                              (first_kept_run_id, ))
+            cursor = self.conn.execute("DELETE FROM runs WHERE run_id < ?",
+                                       (first_kept_run_id, ))
+        return cursor.rowcount
+
+    def load_latest_snapshot(self):
+        try:
+            if self.latest_run_id() is not None:
+                return self.load_snapshot()
+        except sqlite3.DatabaseError as e:
+            print("\nFailed to read {} ({}).\n".format(self.db_file_path, e))
+
+        # Empty or unreadable database, fall back to the checksummed copy
+        latest = load_json_file_atomic(self.latest_file_path)
+        return latest.get("snapshot", {})
+
+    def has_snapshot(self):
+        try:
+            if self.latest_run_id() is not None:
+                return True
+        except sqlite3.DatabaseError:
+            pass
+        return (os.path.exists(self.latest_file_path)
+                or os.path.exists(self.latest_file_path + ".prev"))
+
+    def latest_run_id(self):
+        row = self.conn.execute("SELECT MAX(run_id) FROM runs").fetchone()
+        return row[0]
+
+    def get_runs(self, last_n_runs):
+        return self.conn.execute(
+            "SELECT run_id, timestamp FROM runs ORDER BY run_id DESC LIMIT ?",
+            (last_n_runs, )).fetchall()[::-1]
+
+    def load_snapshot(self, run_id=None):
+        # Only the rows of a single run are read, through the run_id indexes
+        if run_id is None:
+            run_id = self.latest_run_id()
+        if run_id is None:
+            return {}
+
+        snapshot = {}
+        for vault_address, vault_name, vault_tvl, vault_apr in self.conn.execute(
+                "SELECT vault_address, vault_name, vault_tvl, vault_apr "
+                "FROM vaults WHERE run_id = ? ORDER BY rowid", (run_id, )):
+            snapshot[vault_address] = {
+                "vault_name": vault_name,
+                "vault_tvl": vault_tvl,
+                "vault_apr": vault_apr,
+                "positions": {},
+            }
+
+        for row in self.conn.execute(
+                "SELECT vault_address, coin, leverage, position_value, size, "
+                "unrealised_pnl, direction FROM positions WHERE run_id = ? "
+                "ORDER BY rowid", (run_id, )):
+            vault = snapshot.get(row[0])
+            if vault is not None:
+                vault["positions"][row[1]] = {
+                    "leverage": row[2],
+                    "position_value": row[3],
+                    "size": row[4],
+                    "unrealised_pnl": row[5],
+                    "direction": row[6]
+                }
+
+        return snapshot
+
+    def get_vault_history(self, vault_address, last_n_runs=10):
+        # Positions of a vault over the last N runs, None for runs in which
+        # the vault was not tracked
+        runs = self.get_runs(last_n_runs)
+        if not runs:
+            return []
+
+        first_run_id = runs[0][0]
+        history = {
+            run_id: {
+                "timestamp": timestamp,
+                "vault": None
+            }
+            for run_id, timestamp in runs
+        }
+
+        for run_id, vault_name, vault_tvl, vault_apr in self.conn.execute(
+                "SELECT run_id, vault_name, vault_tvl, vault_apr FROM vaults "
+                "WHERE vault_address = ? AND run_id >= ?",
+            (vault_address, first_run_id)):
+            history[run_id]["vault"] = {
+                "vault_name": vault_name,
+                "vault_tvl": vault_tvl,
+                "vault_apr": vault_apr,
+                "positions": {},
+            }
+
+        for row in self.conn.execute(
+                "SELECT run_id, coin, leverage, position_value, size, "
+                "unrealised_pnl, direction FROM positions "
+                "WHERE vault_address = ? AND run_id >= ? ORDER BY rowid",
+            (vault_address, first_run_id)):
+            vault = history[row[0]]["vault"]
+            if vault is not None:
+                vault["positions"][row[1]] = {
+                    "leverage": row[2],
+                    "position_value": row[3],
+                    "size": row[4],
+                    "unrealised_pnl": row[5],
+                    "direction": row[6]
+                }
+
+        return [
+            dict(run_id=run_id, **history[run_id]) for run_id, _ in runs
+        ]
+
+
+if __name__ == "__main__":
+    from datetime import datetime
+
+    parser = argparse.ArgumentParser(
+        description="Show the positions of a vault over the last runs.")
+    parser.add_argument('vault_address', type=str, help="Vault address")
+    parser.add_argument('-n',
+                        '--runs',
+                        type=int,
+                        default=10,
+                        help="Number of runs to show")
+    args = parser.parse_args()
+
+    store = SnapshotStore()
+    for record in store.get_vault_history(args.vault_address.lower(),
+                                          args.runs):
+        run_time = datetime.fromtimestamp(
+            record["timestamp"]).strftime('%Y-%m-%d %H:%M:%S')
+        vault = record["vault"]
+        if vault is None:
+            print(f"\n[{run_time}] Not tracked")
+            continue
+
+        print(f"\n[{run_time}] {vault['vault_name']} "
+              f"(TVL: {vault['vault_tvl']:,.2f} USD, APR: {vault['vault_apr']:,.2f}%)")
+        for coin, position in vault["positions"].items():
+            print(f"   - {coin}: {position['direction']} "
+                  f"{position['size']} @ {position['leverage']}x "
+                  f"({position['position_value']:,.2f} USD)")
+    store.close()
@@ -0,0 +1,335 @@
+import itertools
+import threading
+import time
+from collections import deque
+
+import requests
+from telebot.apihelper import ApiTelegramException
+
+from rate_limiter import TokenBucket, backoff_delay
+from utils import (render_telegram_messages, pack_rendered_messages,
+                   telegram_length)
+from config import (MAX_RETRIES, RETRY_AFTER, TELEGRAM_QUEUE_SIZE,
+                    TELEGRAM_CHAT_MESSAGES_PER_SECOND,
+                    TELEGRAM_GROUP_MESSAGES_PER_MINUTE,
+                    TELEGRAM_GLOBAL_MESSAGES_PER_SECOND)
+
+# Priority lanes, lower is sent first
+PRIORITY_ERROR = 0
+PRIORITY_FILL = 1
+PRIORITY_SUMMARY = 2
+PRIORITY_NAMES = {
+    PRIORITY_ERROR: "error",
+    PRIORITY_FILL: "fill",
+    PRIORITY_SUMMARY: "summary",
+}
+
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+
+
+def is_group_chat(chat_id):
+    return str(chat_id).startswith("-")
+
+
+def get_telegram_retry_after(error):
+    if isinstance(error, ApiTelegramException):
+        return (error.result_json or {}).get("parameters",
+                                             {}).get("retry_after")
+    return None
+
+
+def is_retryable_telegram_error(error):
+    if isinstance(error, ApiTelegramException):
+        return error.error_code == 429 or error.error_code >= 500
+    return isinstance(error, requests.exceptions.RequestException)
+
+
+class DeliveryItem:
+
+    def __init__(self, seq, chat_id, priority, msg_list, key=None):
+        self.seq = seq
+        self.chat_id = chat_id
+        self.priority = priority
+        self.msg_list = msg_list
+        self.key = key
+        self.enqueued_at = time.monotonic()
+        self.rendered = None
+
+    def render(self):
+        if self.rendered is None:
+            self.rendered = render_telegram_messages(self.msg_list)
+        return self.rendered
+
+    def rendered_length(self):
+        return sum(
+            telegram_length(fragment) + 1 for message in self.render()
+            for fragment in (message if isinstance(message, list) else [message]))
+
+
+class ChatLanes:
+
+    def __init__(self, messages_per_second):
+        self.lanes = {priority: deque() for priority in PRIORITY_NAMES}
+        # One message at a time, spaced by the chat's rate limit
+        self.bucket = TokenBucket(messages_per_second, 1)
+        self.blocked_until = 0
+
+    def top_item(self):
+        for priority in sorted(self.lanes):
+            if self.lanes[priority]:
+                return self.lanes[priority][0]
+        return None
+
+    def wait_time(self):
+        return max(self.bucket.wait_time(),
+                   self.blocked_until - time.monotonic(), 0)
+
+
+class TelegramDelivery:
+
+    # Sends queued message lists to Telegram from a single sender thread.
+    # Each chat has its own priority lanes and token bucket (Telegram allows
+    # about one message per second in a chat and 20 per minute in a group,
+    # 30 per second overall). Queued messages of a chat are coalesced into
+    # chunks of up to 4096 characters, errors first. The queue is bounded:
+    # put() blocks producers when it is full, except for errors, which evict
+    # the oldest message of the lowest priority lane. Messages put with a key
+    # are reported to on_delivered(keys, delivered) once their batch was sent
+    # or given up on.
+
+    def __init__(self,
+                 bot,
+                 max_queue_size=TELEGRAM_QUEUE_SIZE,
+                 chat_messages_per_second=TELEGRAM_CHAT_MESSAGES_PER_SECOND,
+                 group_messages_per_minute=TELEGRAM_GROUP_MESSAGES_PER_MINUTE,
+                 global_messages_per_second=TELEGRAM_GLOBAL_MESSAGES_PER_SECOND,
+                 max_retries=MAX_RETRIES,
+                 retry_cap=RETRY_AFTER,
+                 max_length=TELEGRAM_MAX_MESSAGE_LENGTH,
+                 send=None,
+                 on_delivered=None):
+        self.send = send or (lambda chat_id, text: bot.send_message(
+            chat_id, text, parse_mode='MarkdownV2'))
+        self.max_queue_size = max(1, max_queue_size)
+        self.chat_messages_per_second = chat_messages_per_second
+        self.group_messages_per_second = group_messages_per_minute / 60
+        self.global_bucket = TokenBucket(global_messages_per_second)
+        self.max_retries = max_retries
+        self.retry_cap = retry_cap
+        self.max_length = max_length
+        self.on_delivered = on_delivered
+        self.chats = {}
+        self.size = 0
+        self.seq = itertools.count()
+        self.condition = threading.Condition()
+        self.stopping = False
+        self.drain = True
+        self.sender = threading.Thread(target=self.run, daemon=True)
+        self.metrics = {
+            "enqueued": 0,
+            "sent_messages": 0,
+            "sent_chunks": 0,
+            "coalesced": 0,
+            "dropped": 0,
+            "failed_chunks": 0,
+            "retries": 0,
+            "throttled": 0,
+            "max_depth": 0,
+            "blocked_seconds": 0.0,
+            "max_latency": 0.0,
+        }
+
+    def start(self):
+        self.sender.start()
+        return self
+
+    def stop(self, drain=True, timeout=None):
+        # With drain, everything queued so far is sent before returning,
+        # unless timeout runs out first
+        with self.condition:
+            self.stopping = True
+            self.drain = drain
+            self.condition.notify_all()
+        if self.sender.is_alive():
+            self.sender.join(timeout)
+
+    def get_chat(self, chat_id):
+        chat = self.chats.get(chat_id)
+        if chat is None:
+            rate = (self.group_messages_per_second if is_group_chat(chat_id)
+                    else self.chat_messages_per_second)
+            chat = self.chats[chat_id] = ChatLanes(rate)
+        return chat
+
+    def put(self,
+            msg_list,
+            chat_id,
+            priority=PRIORITY_FILL,
+            timeout=None,
+            key=None):
+        if not msg_list:
+            return True
+        with self.condition:
+            if self.size >= self.max_queue_size:
+                if priority == PRIORITY_ERROR:
+                    self.evict_lowest_priority()
+                else:
+                    start_time = time.monotonic()
+                    has_room = self.condition.wait_for(
+                        lambda: self.size < self.max_queue_size or self.
+                        stopping, timeout)
+                    self.metrics["blocked_seconds"] += time.monotonic(
+                    ) - start_time
+                    if not has_room or self.size >= self.max_queue_size:
+                        self.metrics["dropped"] += 1
+                        return False
+            item = DeliveryItem(next(self.seq), chat_id, priority,
+                                list(msg_list), key)
+            self.get_chat(chat_id).lanes[priority].append(item)
+            self.size += 1
+            self.metrics["enqueued"] += 1
+            self.metrics["max_depth"] = max(self.metrics["max_depth"],
+                                            self.size)
+            self.condition.notify_all()
+            return True
+
+    def evict_lowest_priority(self):
+        oldest = None
+        for chat in self.chats.values():
+            for priority in sorted(chat.lanes, reverse=True):
+                lane = chat.lanes[priority]
+                if lane:
+                    if oldest is None or (priority, -lane[0].seq) > (
+                            oldest[1].priority, -oldest[1].seq):
+                        oldest = (lane, lane[0])
+                    break
+        if oldest is not None:
+            oldest[0].popleft()
+            self.size -= 1
+            self.metrics["dropped"] += 1
+
+    def next_chat(self):
+        # Ready chat holding the most urgent message, or the time until one
+        # is ready
+        best = None
+        min_wait = None
+        for chat_id, chat in self.chats.items():
+            item = chat.top_item()
+            if item is None:
+                continue
+            wait = chat.wait_time()
+            if wait > 0:
+                min_wait = wait if min_wait is None else min(min_wait, wait)
+                continue
+            if best is None or (item.priority, item.seq) < (best[1].priority,
+                                                            best[1].seq):
+                best = (chat_id, item)
+        if best is not None:
+            global_wait = self.global_bucket.wait_time()
+            if global_wait > 0:
+                return None, global_wait
+            return best[0], 0
+        return None, min_wait
+
+    def take_batch(self, chat_id):
+        # Messages of the chat in priority order, as many as fit in one chunk
+        chat = self.chats[chat_id]
+        items = []
+        length = 0
+        for priority in sorted(chat.lanes):
+            lane = chat.lanes[priority]
+            while lane:
+                item_length = lane[0].rendered_length()
+                if items and length + item_length > self.max_length:
+                    return items
+                items.append(lane.popleft())
+                length += item_length
+        return items
+
+    def run(self):
+        while True:
+            with self.condition:
+                while True:
+                    if self.stopping and (not self.drain or self.size == 0):
+                        return
+                    chat_id, wait = self.next_chat()
+                    if chat_id is not None:
+                        break
+                    self.condition.wait(wait)
+                chat = self.chats[chat_id]
+                chat.bucket.try_acquire()
+                self.global_bucket.try_acquire()
+                items = self.take_batch(chat_id)
+                self.size -= len(items)
+                self.condition.notify_all()
+
+            self.metrics["coalesced"] += len(items) - 1
+            now = time.monotonic()
+            self.metrics["max_latency"] = max(
+                [self.metrics["max_latency"]] +
+                [now - item.enqueued_at for item in items])
+            rendered = [
+                message for item in items for message in item.render()
+            ]
+            chunks = pack_rendered_messages(rendered, self.max_length)
+            delivered = True
+            for i, chunk in enumerate(chunks):
+                if i > 0:
+                    chat.bucket.acquire()
+                    self.global_bucket.acquire()
+                if not self.send_chunk(chat, chat_id, chunk):
+                    delivered = False
+            self.metrics["sent_messages"] += len(items)
+            keys = [item.key for item in items if item.key is not None]
+            if keys and self.on_delivered:
+                try:
+                    self.on_delivered(keys, delivered)
+                except Exception as e:
+                    print(f"Error reporting Telegram delivery: {e}")
+
+    def send_chunk(self, chat, chat_id, chunk):
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.send(chat_id, chunk)
+                self.metrics["sent_chunks"] += 1
+                return True
+            except Exception as e:
+                if not is_retryable_telegram_error(
+                        e) or attempt == self.max_retries:
+                    self.metrics["failed_chunks"] += 1
+                    print(f"Error sending message to Telegram: {e}")
+                    return False
+                retry_after = get_telegram_retry_after(e)
+                if retry_after is not None:
+                    self.metrics["throttled"] += 1
+                    delay = float(retry_after)
+                    chat.blocked_until = time.monotonic() + delay
+                else:
+                    delay = backoff_delay(attempt, 1, self.retry_cap)
+                self.metrics["retries"] += 1
+                print(
+                    f"Telegram send failed ({e}), retrying in {delay:.1f}s...")
+                time.sleep(delay)
+        return False
+
+    def stats(self):
+        with self.condition:
+            stats = dict(self.metrics)
+            stats["queue_depth"] = self.size
+            stats["lane_depths"] = {
+                PRIORITY_NAMES[priority]:
+                sum(len(chat.lanes[priority]) for chat in self.chats.values())
+                for priority in PRIORITY_NAMES
+            }
+            return stats
+
+
+def print_delivery_stats(delivery):
+    stats = delivery.stats()
+    print(
+        "Telegram delivery: queue depth {} (max {}), lanes {}, {} message(s) in {} chunk(s), {} coalesced, {} dropped, {} failed chunk(s), {} retries ({} throttled), producers blocked {:.1f}s, max latency {:.1f}s"
+        .format(stats["queue_depth"], stats["max_depth"],
+                stats["lane_depths"], stats["sent_messages"],
+                stats["sent_chunks"], stats["coalesced"], stats["dropped"],
+                stats["failed_chunks"], stats["retries"], stats["throttled"],
+                stats["blocked_seconds"], stats["max_latency"]))
@@ -0,0 +1,42 @@
+import json
+
+import pytest
+
+from utils import iter_json_array
+
+DOCUMENT = [
+    2.5, -1, 1e3, 12.25e-2, 0, True, None, "a, b]", {
+        "summary": {
+            "name": "Vault 1.2",
+            "tvl": "1234.5"
+        },
+        "apr": 0.125
+    }, [1, [2]]
+]
+
+
+def byte_chunks(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 1024])
+def test_chunked_array(size):
+    data = json.dumps(DOCUMENT, ensure_ascii=False).encode()
+    assert list(iter_json_array(byte_chunks(data, size))) == DOCUMENT
+
+
+@pytest.mark.parametrize("text", ["[2.5]", "[ 2.5 , 3e2 ]", "[-0.5e+3]"])
+def test_numbers_split_in_one_byte_chunks(text):
+    assert list(iter_json_array(byte_chunks(
+        text.encode(), 1))) == json.loads(text)
+
+
+def test_multibyte_characters_split_across_chunks():
+    data = json.dumps(["📌 Vault"], ensure_ascii=False).encode()
+    assert list(iter_json_array(byte_chunks(data, 1))) == ["📌 Vault"]
+
+
+@pytest.mark.parametrize("text", ["[1, 2", "[2.5", "{}", "[2x]"])
+def test_invalid_array(text):
+    with pytest.raises(ValueError):
+        list(iter_json_array(byte_chunks(text.encode(), 1)))
@@ -0,0 +1,34 @@
+from seen_fills import SeenFills
+
+
+def restart(seen_fills, file_path):
+    seen_fills.save()
+    return SeenFills(file_path=file_path).load()
+
+
+def test_pending_fill_is_fetched_again_after_restart(tmp_path):
+    file_path = str(tmp_path / "seen_fills.json")
+    seen_fills = SeenFills(file_path=file_path)
+    btc_fill = {"tid": 1, "time": 1000, "coin": "BTC"}
+    eth_fill = {"tid": 2, "time": 2000, "coin": "ETH"}
+    assert seen_fills.add_new("0xa", [btc_fill, eth_fill]) == [
+        btc_fill, eth_fill
+    ]
+    seen_fills.commit("0xa", [eth_fill])
+
+    seen_fills = restart(seen_fills, file_path)
+    assert seen_fills.latest_time("0xa") == 1000
+    assert seen_fills.add_new("0xa", [btc_fill, eth_fill]) == [btc_fill]
+
+
+def test_latest_time_moves_forward_once_nothing_is_pending(tmp_path):
+    file_path = str(tmp_path / "seen_fills.json")
+    seen_fills = SeenFills(file_path=file_path)
+    fills = [{"tid": 1, "time": 1000}, {"tid": 2, "time": 2000}]
+    seen_fills.add_new("0xa", fills)
+    seen_fills.commit("0xa", fills[1:])
+    seen_fills.commit("0xa", fills[:1])
+
+    seen_fills = restart(seen_fills, file_path)
+    assert seen_fills.latest_time("0xa") == 2000
+    assert seen_fills.add_new("0xa", fills) == []
@@ -1,13 +1,18 @@
 import os
 import json
+import codecs
+import hashlib
+import tempfile
 import sys
-import time
 from datetime import datetime
 import pytz
 from tzlocal import get_localzone
 import requests
 import textwrap
+import string
+from functools import lru_cache
 import telegramify_markdown
+from config import TELEGRAM_RENDER_CACHE_SIZE
 
 
 def load_json_file(file_path):
@@ -27,6 +32,135 @@ def save_json_file(file_path, data):
             json.dump(data, f, indent=4)
 
 
+def fsync_dir(dir_path):
+    # Makes a rename durable, not supported on every platform
+    try:
+        dir_fd = os.open(dir_path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+def atomic_write_bytes(file_path, data, keep_previous=False):
+    dir_path = os.path.dirname(os.path.abspath(file_path))
+    os.makedirs(dir_path, exist_ok=True)
+    fd, tmp_file_path = tempfile.mkstemp(dir=dir_path,
+                                         prefix=os.path.basename(file_path) +
+                                         ".",
+                                         suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        # The current file becomes the previous generation, so there is
+        # always at least one complete file on disk
+        if keep_previous and os.path.exists(file_path):
+            os.replace(file_path, file_path + ".prev")
+        os.replace(tmp_file_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_file_path):
+            os.remove(tmp_file_path)
+        raise
+
+    fsync_dir(dir_path)
+
+
+def save_json_file_atomic(file_path, data, keep_previous=True):
+    payload = json.dumps(data, separators=(',', ':'),
+                         ensure_ascii=False).encode('utf-8')
+    checksum = hashlib.sha256(payload).hexdigest()
+    atomic_write_bytes(file_path,
+                       b"sha256:" + checksum.encode('ascii') + b"\n" + payload,
+                       keep_previous)
+
+
+def read_checksummed_json_file(file_path):
+    with open(file_path, 'rb') as f:
+        header, _, payload = f.read().partition(b"\n")
+
+    if not header.startswith(b"sha256:"):
+        raise ValueError("missing checksum header")
+    if hashlib.sha256(payload).hexdigest().encode('ascii') != header[7:]:
+        raise ValueError("checksum mismatch")
+
+    return json.loads(payload.decode('utf-8'))
+
+
+def load_json_file_atomic(file_path, default=None):
+    # Falls back to the previous generation when the latest file is missing
+    # or corrupted
+    for candidate_path in [file_path, file_path + ".prev"]:
+        if not os.path.exists(candidate_path):
+            continue
+        try:
+            return read_checksummed_json_file(candidate_path)
+        except (OSError, ValueError) as e:
+            print("\n{} is corrupted ({}).\n".format(candidate_path, e))
+
+    return {} if default is None else default
+
+
+JSON_ARRAY_SEPARATORS = " \t\r\n,]"
+JSON_NUMBER_CHARACTERS = "0123456789.eE+-"
+
+
+def iter_json_array(chunks):
+    # Yields the elements of a top-level JSON array one by one from an
+    # iterable of byte chunks, without holding the whole document in memory
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buffer = ""
+    pos = 0
+    started = False
+
+    while True:
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+
+        if pos < len(buffer):
+            if not started:
+                if buffer[pos] != "[":
+                    raise ValueError("Expected a JSON array")
+                started = True
+                pos += 1
+                continue
+
+            if buffer[pos] == "]":
+                return
+
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                end = None
+
+            # A complete element is always followed by a separator, so an
+            # element running up to the end of the buffer, or a number cut
+            # at ".", "e" or a digit, may still be truncated
+            if end is not None and end < len(buffer):
+                if buffer[end] in JSON_ARRAY_SEPARATORS:
+                    yield item
+                    pos = end
+                    continue
+                if buffer[end] not in JSON_NUMBER_CHARACTERS:
+                    raise ValueError(
+                        f"Unexpected {buffer[end]!r} after a JSON array element")
+
+        chunk = next(chunks, None)
+        if chunk is None:
+            raise ValueError("Unexpected end of JSON array")
+
+        buffer = buffer[pos:] + text_decoder.decode(chunk)
+        pos = 0
+
+
 def load_txt_file_to_list(file_path):
     try:
         with open(file_path, 'r') as file:
@@ -78,44 +212,292 @@ def send_telegram_message(bot_token, chat_id, message, verbose=True):
             print(f"Failed to send message. Error: {response.text}")
 
 
+# Characters that must be escaped in MarkdownV2 text, and in code spans
+MARKDOWN_V2_ESCAPES = str.maketrans(
+    {char: "\\" + char
+     for char in "_*[]()~`>#+-=|{}.!\\"})
+MARKDOWN_V2_CODE_ESCAPES = str.maketrans(
+    {char: "\\" + char
+     for char in "`\\"})
+
+
+def escape_markdown_v2(text, code=False):
+    return str(text).translate(
+        MARKDOWN_V2_CODE_ESCAPES if code else MARKDOWN_V2_ESCAPES)
+
+
+class RenderedMessage(str):
+    # MarkdownV2 that is sent as is
+    pass
+
+
+@lru_cache(maxsize=TELEGRAM_RENDER_CACHE_SIZE)
+def render_markdown(message):
+    return telegramify_markdown.markdownify(textwrap.dedent(message))
+
+
+def render_telegram_message(message):
+    if isinstance(message, RenderedMessage):
+        return message
+    return render_markdown(message)
+
+
+class TelegramTemplate:
+
+    # Message template in the str.format syntax. The markdown around the
+    # fields is converted to MarkdownV2 once; render() only formats and
+    # escapes the field values, which are taken literally. Templates that
+    # cannot be split that way (links, or fields the converter rewrites) are
+    # rendered whole through the cache instead.
+
+    def __init__(self, template):
+        self.template = template
+        self.fields = []
+        self.parts = None
+        source = []
+        for literal, field_name, format_spec, conversion in string.Formatter(
+        ).parse(template):
+            source.append(literal)
+            if field_name is not None:
+                source.append(f"TGFIELD{len(self.fields)}X")
+                self.fields.append((field_name, format_spec, conversion))
+        if "[" in "".join(source):
+            return
+
+        rendered = render_markdown("".join(source))
+        parts = []
+        code_contexts = []
+        position = 0
+        for i in range(len(self.fields)):
+            placeholder = f"TGFIELD{i}X"
+            index = rendered.find(placeholder, position)
+            if index < 0 or rendered.count(placeholder) != 1:
+                return
+            parts.append(rendered[position:index])
+            # Inside a code span when an odd number of unescaped backticks
+            # precede the field
+            prefix = rendered[:index].replace("\\\\", "").replace("\\`", "")
+            code_contexts.append(prefix.count("`") % 2 == 1)
+            position = index + len(placeholder)
+        parts.append(rendered[position:])
+        self.parts = parts
+        self.code_contexts = code_contexts
+
+    def format_field(self, field, values):
+        field_name, format_spec, conversion = field
+        value = values[field_name]
+        if conversion == "r":
+            value = repr(value)
+        elif conversion == "s":
+            value = str(value)
+        elif conversion == "a":
+            value = ascii(value)
+        return format(value, format_spec)
+
+    def format(self, **values):
+        return self.template.format(**values)
+
+    def render(self, **values):
+        if self.parts is None:
+            return RenderedMessage(
+                render_markdown(self.template.format(**values)))
+        pieces = [self.parts[0]]
+        for field, code, part in zip(self.fields, self.code_contexts,
+                                     self.parts[1:]):
+            pieces.append(
+                escape_markdown_v2(self.format_field(field, values), code))
+            pieces.append(part)
+        return RenderedMessage("".join(pieces))
+
+
+def render_telegram_messages(messages):
+    # A list in messages is a section, kept in one chunk when it fits
+    return [
+        render_telegram_messages(message) if isinstance(message, list) else
+        render_telegram_message(message) for message in messages
+    ]
+
+
+def telegram_length(text):
+    # Telegram counts UTF-16 code units, emojis take two
+    return len(text.encode("utf-16-le")) // 2
+
+
 def chunk_message(messages, max_length=4096):
-    chunks = []
-    current_chunk = ""
+    return pack_rendered_messages(render_telegram_messages(messages),
+                                  max_length)
 
-    for message in messages:
-        markdown_text = textwrap.dedent(message)
-        can_be_sent = telegramify_markdown.markdownify(markdown_text)
 
-        if len(current_chunk) + len(can_be_sent) <= max_length:
-            current_chunk += can_be_sent + "\n"
-        else:
-            chunks.append(current_chunk.strip())
-            current_chunk = can_be_sent + "\n"
+# MarkdownV2 entity markers, longest first
+MARKDOWN_V2_MARKERS = ["||", "__", "*", "_", "~"]
+# Code points that continue the previous character (emoji sequences)
+JOINING_CHARACTERS = "\u200d\ufe0e\ufe0f\u20e3"
 
-    if current_chunk:
-        chunks.append(current_chunk.strip())
 
-    return chunks
+def closing_markers(stack):
+    return "".join("```" if marker.startswith("```") else marker
+                   for marker in reversed(stack))
 
 
-def send_to_telegram(msg_list,
-                     bot,
-                     chat_id,
-                     max_retries,
-                     try_sleep=3,
-                     except_sleep=60):
+def scan_split_points(text):
+    # Positions where text can be cut without breaking an escape sequence,
+    # a link or an emoji, with the entities open there. Each point is
+    # (position, rank, open entities), rank 2 after a newline, 1 after a
+    # space, 0 anywhere else.
+    points = []
+    stack = []
+    i = 0
+    n = len(text)
+    while i < n:
+        top = stack[-1] if stack else None
+        if top is not None and top.startswith("```"):
+            if text.startswith("```", i):
+                stack.pop()
+                i += 3
+            else:
+                i += 2 if text[i] == "\\" else 1
+        elif top == "`":
+            if text[i] == "`":
+                stack.pop()
+            i += 2 if text[i] == "\\" else 1
+        elif text[i] == "\\":
+            i += 2
+        elif text.startswith("```", i):
+            end = text.find("\n", i)
+            end = n if end < 0 else end + 1
+            stack.append(text[i:end])
+            i = end
+        elif text[i] == "`":
+            stack.append("`")
+            i += 1
+        elif text[i] == "[" or text.startswith("![", i):
+            # Links and custom emojis are never split
+            end = text.find("](", i)
+            if end >= 0:
+                end = text.find(")", end)
+                while end > 0 and text[end - 1] == "\\":
+                    end = text.find(")", end + 1)
+            i = n if end < 0 else end + 1
+        else:
+            for marker in MARKDOWN_V2_MARKERS:
+                if text.startswith(marker, i):
+                    if stack and stack[-1] == marker:
+                        stack.pop()
+                    else:
+                        stack.append(marker)
+                    i += len(marker)
+                    break
+            else:
+                i += 1
+        if i >= n or text[i] in JOINING_CHARACTERS or text[i -
+                                                          1] == "\u200d":
+            continue
+        rank = 2 if text[i - 1] == "\n" else 1 if text[i - 1] == " " else 0
+        points.append((i, rank, tuple(stack)))
+    return points
 
-    chunks = chunk_message(msg_list)
-    for chunk in chunks:
-        retry_count = 0
-        while retry_count < max_retries:
-            try:
-                bot.send_message(chat_id, chunk, parse_mode='MarkdownV2')
-                time.sleep(try_sleep)
+
+def split_rendered_message(text, max_length=4096, first_length=None):
+    # Splits rendered MarkdownV2 into pieces of at most max_length (the first
+    # one at most first_length), cutting after a newline or a space when one
+    # is in the second half of the piece. Entities open at a cut are closed
+    # and reopened in the next piece. The first piece is empty when nothing
+    # fits in first_length.
+    points = scan_split_points(text)
+    pieces = []
+    start = 0
+    opened = ()
+    limit = max_length if first_length is None else first_length
+    index = 0
+    while True:
+        prefix = "".join(opened)
+        if telegram_length(prefix + text[start:]) <= limit:
+            break
+        # Latest cut of each rank that fits
+        best = {}
+        i = index
+        while i < len(points):
+            position, rank, stack = points[i]
+            length = telegram_length(prefix + text[start:position] +
+                                     closing_markers(stack))
+            if length > limit:
                 break
-            except:
-                retry_count += 1
-                time.sleep(except_sleep)
-        else:
-            print("Max retries reached. No new message will be sent.\n")
+            if rank == 0 or length * 2 >= limit:
+                best[rank] = i
+            i += 1
+        if best:
+            i = best[max(best)]
+        elif limit < max_length:
+            # Nothing fits in the space left, start on a new chunk
+            pieces.append("")
+            limit = max_length
+            continue
+        elif i >= len(points):
             break
+        # Otherwise a link or code unit longer than a whole chunk, cut
+        # right after it
+        position, _, stack = points[i]
+        pieces.append((prefix + text[start:position]).rstrip() +
+                      closing_markers(stack))
+        start = position
+        opened = stack
+        limit = max_length
+        index = i + 1
+    pieces.append("".join(opened) + text[start:])
+    return pieces
+
+
+def pack_rendered_messages(rendered_messages, max_length=4096):
+    # Packs fragments in order into chunks of at most max_length. A section
+    # of up to half a chunk starts a new chunk when it does not fit in the
+    # current one, longer sections fill the current chunk first so at most
+    # half of a chunk is left empty. Fragments longer than a chunk are
+    # split, also filling the current chunk first.
+    chunks = []
+    current_chunk = []
+    current_length = 0
+
+    def flush():
+        nonlocal current_chunk, current_length
+        # Joined once per chunk, appending to a string copies it every time
+        chunk = "\n".join(current_chunk).strip()
+        if chunk:
+            chunks.append(chunk)
+        current_chunk = []
+        current_length = 0
+
+    def add(fragment):
+        nonlocal current_length
+        length = telegram_length(fragment)
+        if current_length + length <= max_length:
+            current_chunk.append(fragment)
+            current_length += length + 1
+            return
+        if length <= max_length:
+            flush()
+            current_chunk.append(fragment)
+            current_length = length + 1
+            return
+        pieces = split_rendered_message(fragment, max_length,
+                                        max_length - current_length)
+        if pieces[0]:
+            current_chunk.append(pieces[0])
+        for piece in pieces[1:]:
+            flush()
+            current_chunk.append(piece)
+            current_length = telegram_length(piece) + 1
+
+    for message in rendered_messages:
+        if isinstance(message, list):
+            section_length = sum(
+                telegram_length(fragment) + 1 for fragment in message)
+            if (current_length + section_length - 1 > max_length
+                    and section_length - 1 <= max_length // 2):
+                flush()
+            for fragment in message:
+                add(fragment)
+        else:
+            add(message)
+
+    flush()
+    return chunks
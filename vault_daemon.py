@@ -0,0 +1,557 @@
+import heapq
+import math
+import queue
+import signal
+import threading
+import time
+
+import telebot
+
+from api_client import fetch_info_batch, get_api_client
+from rate_limiter import InfoRateLimiter
+from snapshot_store import SnapshotStore
+from positions import (compute_differences, aggregate_positions,
+                       get_differences_hash)
+from telegram_delivery import (TelegramDelivery, PRIORITY_FILL,
+                               PRIORITY_SUMMARY, print_delivery_stats)
+from alert_outbox import AlertOutbox
+from websocket_pool import WebsocketPool
+from websocket_manager import WebsocketManager
+from mid_prices import get_mid_price_cache
+from get_vaults_updates import (get_top_tvl_vaults, plan_vault_fetches,
+                                parse_asset_positions, format_vault_updates,
+                                format_positions_summary)
+from config import (MIN_VAULT_APR, TELEGRAM_BOT_TOKEN, FETCH_CONCURRENCY,
+                    MAX_REQUESTS_PER_SECOND, INFO_WEIGHT_PER_MINUTE,
+                    FULL_VAULT_COLLECTION, VAULT_LISTING_CACHE_TTL,
+                    MAX_TRACKED_VAULTS, SIZE_CHANGE_ALERT_PCT, TOP_K_COINS,
+                    TELEGRAM_DRAIN_TIMEOUT, VAULT_POLL_MIN_INTERVAL,
+                    VAULT_POLL_MAX_INTERVAL, VAULT_POLL_TVL_BOOST,
+                    VAULT_POLL_CHURN_DECAY, VAULT_DAEMON_SAVE_INTERVAL,
+                    VAULT_DAEMON_SUMMARY_INTERVAL, VAULT_RECONCILE_INTERVAL,
+                    VAULT_WS_SHARDS)
+
+
+class PolledVault:
+
+    def __init__(self, vault_address):
+        self.vault_address = vault_address
+        self.vault_name = vault_address
+        self.vault_tvl = 0.0
+        self.vault_apr = 0.0
+        # Decaying count of polls that found a position change
+        self.churn = 0.0
+        self.interval = VAULT_POLL_MAX_INTERVAL
+        self.next_poll_at = 0.0
+        self.polls = 0
+        self.changes = 0
+        # Wall clock time (ms) of the last clearinghouseState request
+        self.reconciled_at = 0
+
+
+class VaultPoller:
+
+    # Long-running replacement for the one-shot get_vaults_updates run. The
+    # last snapshot stays in memory, every vault is polled on its own
+    # schedule and diffed as soon as its clearinghouseState arrives, so a
+    # position change is alerted within one poll interval. Vaults with a
+    # higher TVL or recent changes are polled more often:
+    #   interval = max_interval / (1 + tvl_boost * sqrt(tvl / max_tvl) + churn)
+    # clamped to [min_interval, max_interval]. churn grows by one on every
+    # poll that found a change and decays on quiet polls. The vault listing
+    # (name, TVL and APR) is refreshed every listing_interval seconds.
+    # Alerts and summaries mark positions to market from the shared allMids
+    # cache, fed by one websocket subscription.
+
+    def __init__(self,
+                 chat_id,
+                 send_to_tg=True,
+                 concurrency=FETCH_CONCURRENCY,
+                 requests_per_second=MAX_REQUESTS_PER_SECOND,
+                 full_collection=FULL_VAULT_COLLECTION,
+                 use_cache=True,
+                 top_n=MAX_TRACKED_VAULTS,
+                 min_interval=VAULT_POLL_MIN_INTERVAL,
+                 max_interval=VAULT_POLL_MAX_INTERVAL,
+                 tvl_boost=VAULT_POLL_TVL_BOOST,
+                 churn_decay=VAULT_POLL_CHURN_DECAY,
+                 listing_interval=VAULT_LISTING_CACHE_TTL,
+                 save_interval=VAULT_DAEMON_SAVE_INTERVAL,
+                 summary_interval=VAULT_DAEMON_SUMMARY_INTERVAL,
+                 base_url="http://api.hyperliquid.xyz",
+                 delivery=None):
+        self.chat_id = chat_id
+        self.send_to_tg = send_to_tg
+        self.concurrency = concurrency
+        self.full_collection = full_collection
+        self.use_cache = use_cache
+        self.top_n = top_n
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.tvl_boost = tvl_boost
+        self.churn_decay = churn_decay
+        self.listing_interval = listing_interval
+        self.save_interval = save_interval
+        self.summary_interval = summary_interval
+        self.base_url = base_url
+        self.rate_limiter = InfoRateLimiter(requests_per_second,
+                                            INFO_WEIGHT_PER_MINUTE)
+
+        self.snapshot_store = SnapshotStore()
+        has_previous_snapshot = self.snapshot_store.has_snapshot()
+        self.snapshot = self.snapshot_store.load_latest_snapshot()
+        # Alert keys are scoped to the snapshot changes are diffed against,
+        # so a change alerted before a crash is not alerted again
+        self.base_run_id = self.snapshot_store.latest_run_id() or 0
+        # Without a usable snapshot, the first round only builds the state
+        # instead of reporting every position as OPENED
+        self.rebuilding = not self.snapshot
+        if has_previous_snapshot and not self.snapshot:
+            print("Previous vault snapshot could not be recovered, "
+                  "the first round only rebuilds the state.")
+
+        self.vaults = {}
+        self.max_tvl = 0.0
+        self.schedule = []
+        self.unpolled = set()
+        self.changed_since_save = False
+        self.last_listing_time = None
+        self.last_save_time = time.monotonic()
+        self.last_summary_time = time.monotonic()
+        self.stop_event = threading.Event()
+        self.alerts = 0
+        self.mid_prices = get_mid_price_cache()
+        self.ws_manager = None
+
+        if delivery is None:
+            bot = telebot.TeleBot(token=TELEGRAM_BOT_TOKEN, threaded=False)
+            delivery = TelegramDelivery(bot)
+        self.delivery = delivery
+        self.outbox = AlertOutbox(delivery, "vaults")
+
+    def get_interval(self, vault, max_tvl):
+        tvl_weight = math.sqrt(vault.vault_tvl /
+                               max_tvl) if max_tvl > 0 else 0.0
+        interval = self.max_interval / (1 + self.tvl_boost * tvl_weight +
+                                        vault.churn)
+        return min(self.max_interval, max(self.min_interval, interval))
+
+    def reschedule(self, vault, poll_at):
+        vault.next_poll_at = poll_at
+        heapq.heappush(self.schedule, (poll_at, vault.vault_address))
+
+    def refresh_listing(self):
+        self.last_listing_time = time.monotonic()
+        listed_vaults = get_top_tvl_vaults(self.use_cache,
+                                           cache_ttl=self.listing_interval,
+                                           top_n=self.top_n)
+        if not listed_vaults:
+            print("No vaults found, keeping the current vault list.")
+            return
+
+        planned_vaults, pruned_vaults = plan_vault_fetches(
+            listed_vaults, self.snapshot, self.full_collection)
+        listed_addresses = set(
+            vault.get('vaultAddress') for vault in listed_vaults)
+        max_tvl = max(float(vault.get('tvl', 0)) for vault in listed_vaults)
+
+        # Vaults that left the listing are dropped, like in a one-shot run.
+        # Pruned vaults keep their last known positions but are not polled.
+        for vault_address in list(self.snapshot):
+            if vault_address not in listed_addresses:
+                del self.snapshot[vault_address]
+                self.changed_since_save = True
+
+        polled_vaults = {}
+        now = time.monotonic()
+        for listed_vault in planned_vaults:
+            vault_address = listed_vault.get('vaultAddress')
+            vault = self.vaults.get(vault_address)
+            if vault is None:
+                vault = PolledVault(vault_address)
+                self.unpolled.add(vault_address)
+                self.reschedule(vault, now)
+            vault.vault_name = listed_vault.get('name') or vault_address
+            vault.vault_tvl = float(listed_vault.get('tvl', 0))
+            vault.vault_apr = float(listed_vault.get('apr') or 0) * 100
+            vault.interval = self.get_interval(vault, max_tvl)
+            polled_vaults[vault_address] = vault
+        self.vaults = polled_vaults
+        self.unpolled &= set(polled_vaults)
+        self.max_tvl = max_tvl
+
+        print("Polling {} vaults ({} pruned by APR), every {:.0f}s to {:.0f}s."
+              .format(len(planned_vaults), len(pruned_vaults),
+                      min((vault.interval for vault in self.vaults.values()),
+                          default=0),
+                      max((vault.interval for vault in self.vaults.values()),
+                          default=0)))
+
+    def pop_due_vaults(self, now, limit):
+        due = []
+        while self.schedule and len(due) < limit:
+            poll_at, vault_address = self.schedule[0]
+            vault = self.vaults.get(vault_address)
+            # Entries of dropped or rescheduled vaults are stale
+            if vault is None or vault.next_poll_at != poll_at:
+                heapq.heappop(self.schedule)
+                continue
+            if poll_at > now:
+                break
+            heapq.heappop(self.schedule)
+            due.append(vault)
+        return due
+
+    def poll(self, vaults):
+        payloads = {
+            vault.vault_address: {
+                "type": "clearinghouseState",
+                "user": vault.vault_address
+            }
+            for vault in vaults
+        }
+        fetch_info_batch(payloads,
+                         self.concurrency,
+                         self.rate_limiter,
+                         verbose=False,
+                         on_result=self.on_vault_state)
+
+    def on_vault_state(self, vault_address, clearinghouse_state):
+        vault = self.vaults.get(vault_address)
+        if vault is None:
+            return
+        vault.polls += 1
+        self.unpolled.discard(vault_address)
+
+        changed = False
+        if clearinghouse_state is not None:
+            changed = self.update_vault(vault, clearinghouse_state)
+
+        # Every position is new while the state is rebuilt
+        if changed and not self.rebuilding:
+            vault.churn += 1
+            vault.changes += 1
+        else:
+            vault.churn *= self.churn_decay
+        vault.interval = self.get_interval(vault, self.max_tvl)
+        self.reschedule(vault, time.monotonic() + vault.interval)
+
+    def update_vault(self, vault, clearinghouse_state):
+        return self.apply_positions(
+            vault,
+            parse_asset_positions(clearinghouse_state.get(
+                'assetPositions', [])))
+
+    def apply_positions(self, vault, positions_dict):
+        # Diffs the vault against its tracked positions, alerts the changes
+        # and returns whether there were any
+        vault_address = vault.vault_address
+        if not positions_dict:
+            # Left out of the snapshot, as in a one-shot run
+            if self.snapshot.pop(vault_address, None) is not None:
+                self.changed_since_save = True
+            return False
+
+        updated_vault = {
+            "vault_name": vault.vault_name,
+            "vault_tvl": vault.vault_tvl,
+            "vault_apr": vault.vault_apr,
+            "positions": positions_dict,
+        }
+        tracked_vault = self.snapshot.get(vault_address)
+        self.snapshot[vault_address] = updated_vault
+
+        differences = compute_differences(
+            {vault_address: tracked_vault} if tracked_vault else {},
+            {vault_address: updated_vault}, SIZE_CHANGE_ALERT_PCT)
+        if not differences:
+            return False
+
+        self.changed_since_save = True
+        vault_updates = differences[vault_address]
+        if not self.rebuilding and vault_updates["vault_apr"] >= MIN_VAULT_APR:
+            self.send_vault_updates(vault_address, vault_updates)
+        return True
+
+    def send_vault_updates(self, vault_address, vault_updates):
+        _, vault_section = format_vault_updates(vault_address, vault_updates,
+                                                self.mid_prices)
+        if not self.send_to_tg:
+            return
+        changes_hash = get_differences_hash({vault_address: vault_updates},
+                                            SIZE_CHANGE_ALERT_PCT)
+        self.outbox.add([vault_section],
+                        self.chat_id,
+                        PRIORITY_FILL,
+                        key="vault_update:{}:{}:{}".format(
+                            vault_address, self.base_run_id, changes_hash))
+        self.alerts += 1
+
+    def save_snapshot(self):
+        self.base_run_id = self.snapshot_store.save_snapshot(self.snapshot)
+        self.changed_since_save = False
+        self.last_save_time = time.monotonic()
+
+    def send_summary(self):
+        self.last_summary_time = time.monotonic()
+        aggregation = aggregate_positions(
+            self.mid_prices.mark_snapshot({
+                vault_address: vault
+                for vault_address, vault in self.snapshot.items()
+                if vault_address in self.vaults
+            }), MIN_VAULT_APR, TOP_K_COINS)
+        _, summary_msg_list = format_positions_summary(aggregation)
+        if self.send_to_tg:
+            self.outbox.add(summary_msg_list,
+                            self.chat_id,
+                            PRIORITY_SUMMARY,
+                            key="vault_summary:{}".format(
+                                int(time.time() // self.summary_interval)))
+
+    def print_stats(self):
+        intervals = sorted(vault.interval for vault in self.vaults.values())
+        print(
+            "Vault poller: {} vaults, {} polls, {} changes, {} alerts, interval median {:.0f}s (min {:.0f}s)"
+            .format(len(self.vaults),
+                    sum(vault.polls for vault in self.vaults.values()),
+                    sum(vault.changes for vault in self.vaults.values()),
+                    self.alerts,
+                    intervals[len(intervals) // 2] if intervals else 0,
+                    intervals[0] if intervals else 0))
+        print_delivery_stats(self.delivery)
+        get_api_client().print_latency_stats()
+
+    def start_mid_prices(self):
+        self.ws_manager = WebsocketManager(self.base_url)
+        self.ws_manager.start()
+        self.mid_prices.subscribe(self.ws_manager)
+
+    def stop_mid_prices(self):
+        if self.ws_manager is not None:
+            self.ws_manager.stop()
+
+    def run(self):
+        self.delivery.start()
+        self.outbox.replay()
+        self.start_mid_prices()
+        self.refresh_listing()
+
+        while not self.stop_event.is_set():
+            now = time.monotonic()
+            if now - self.last_listing_time >= self.listing_interval:
+                self.print_stats()
+                self.refresh_listing()
+
+            # A few batches per tick keep the workers busy without delaying
+            # the listing refresh and snapshot saves
+            due_vaults = self.pop_due_vaults(now, 4 * self.concurrency)
+            if due_vaults:
+                self.poll(due_vaults)
+
+            if self.rebuilding and not self.unpolled:
+                print("Vault state rebuilt, alerting changes from now on.")
+                self.rebuilding = False
+                self.save_snapshot()
+            elif (self.changed_since_save and time.monotonic() -
+                  self.last_save_time >= self.save_interval):
+                self.save_snapshot()
+
+            if (self.summary_interval > 0 and not self.rebuilding
+                    and time.monotonic() - self.last_summary_time >=
+                    self.summary_interval):
+                self.send_summary()
+
+            next_poll_at = self.schedule[0][0] if self.schedule else now + 1
+            self.wait(0 if due_vaults else min(
+                1.0, max(0.0, next_poll_at - time.monotonic())))
+
+        if self.changed_since_save:
+            self.save_snapshot()
+        self.stop_mid_prices()
+        self.snapshot_store.close()
+        self.delivery.stop(drain=True, timeout=TELEGRAM_DRAIN_TIMEOUT)
+        self.outbox.prune()
+        self.outbox.close()
+        self.print_stats()
+
+    def wait(self, timeout):
+        self.stop_event.wait(timeout)
+
+    def stop(self):
+        self.stop_event.set()
+
+
+def get_fill_position_size(fill):
+    # startPosition is the size before the fill, so the size after it does
+    # not depend on any earlier fill having been seen
+    size = float(fill.get("sz", 0))
+    return float(fill.get("startPosition", 0)) + (size if fill.get("side")
+                                                  == "B" else -size)
+
+
+class VaultFillTracker(VaultPoller):
+
+    # VaultPoller variant that follows the vaults' userFills over a
+    # WebsocketPool and updates their positions from each fill, so the REST
+    # polling only reconciles drift, once every reconcile_interval for every
+    # vault. A fill gives the position size, direction and a value at the
+    # fill price; the leverage of an existing position is kept. A fill
+    # opening a coin the vault did not hold triggers an immediate
+    # reconciliation of that vault instead, since fills do not carry the
+    # leverage. After a websocket reconnect every vault is reconciled.
+
+    def __init__(self,
+                 chat_id,
+                 reconcile_interval=VAULT_RECONCILE_INTERVAL,
+                 shards=VAULT_WS_SHARDS,
+                 **poller_kwargs):
+        poller_kwargs["min_interval"] = reconcile_interval
+        poller_kwargs["max_interval"] = reconcile_interval
+        super().__init__(chat_id, **poller_kwargs)
+        self.events = queue.Queue()
+        self.pool = WebsocketPool(self.base_url,
+                                  shards=shards,
+                                  on_reconnect=self.on_ws_reconnect)
+        # vault address -> pool subscription id
+        self.subscription_ids = {}
+        # Vaults reconciled early for a coin opened by a fill
+        self.opened_by_fills = set()
+        self.fills = 0
+        self.reconciliations = 0
+        self.corrections = 0
+
+    def subscription(self, vault_address):
+        return {"type": "userFills", "user": vault_address}
+
+    def refresh_listing(self):
+        super().refresh_listing()
+        for vault_address in list(self.subscription_ids):
+            if vault_address not in self.vaults:
+                self.pool.unsubscribe(
+                    self.subscription(vault_address),
+                    self.subscription_ids.pop(vault_address))
+        for vault_address in self.vaults:
+            if vault_address not in self.subscription_ids:
+                self.subscription_ids[vault_address] = self.pool.subscribe(
+                    self.subscription(vault_address), self.on_user_fills)
+
+    def on_user_fills(self, ws_msg):
+        # Runs on a websocket thread, the poller thread applies the fills
+        data = ws_msg.get("data", {})
+        # Fills from before the subscription are covered by the
+        # reconciliation
+        if data.get("isSnapshot"):
+            return
+        self.events.put(("fills", data.get("user", "").lower(),
+                         data.get("fills", [])))
+
+    def on_ws_reconnect(self, attempts):
+        self.events.put(("reconnect", None, None))
+
+    def wait(self, timeout):
+        deadline = time.monotonic() + timeout
+        while not self.stop_event.is_set():
+            try:
+                event, vault_address, fills = self.events.get(
+                    timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                return
+            if event == "fills":
+                self.apply_fills(vault_address, fills)
+            elif event == "reconnect":
+                print("Websocket reconnected, reconciling every vault.")
+                now = time.monotonic()
+                for vault in self.vaults.values():
+                    self.reschedule(vault, now)
+                return
+
+    def poll(self, vaults):
+        reconciled_at = int(time.time() * 1000)
+        for vault in vaults:
+            vault.reconciled_at = reconciled_at
+        self.reconciliations += len(vaults)
+        super().poll(vaults)
+
+    def update_vault(self, vault, clearinghouse_state):
+        changed = super().update_vault(vault, clearinghouse_state)
+        # After the first round, a change found by REST was missed by fills
+        if (changed and not self.rebuilding
+                and vault.vault_address not in self.opened_by_fills):
+            self.corrections += 1
+        self.opened_by_fills.discard(vault.vault_address)
+        return changed
+
+    def apply_fills(self, vault_address, fills):
+        vault = self.vaults.get(vault_address)
+        tracked_vault = self.snapshot.get(vault_address)
+        # Positions are only known once the vault was reconciled
+        if vault is None or vault_address in self.unpolled:
+            return
+        positions_dict = {
+            coin: dict(position)
+            for coin, position in (
+                tracked_vault or {}).get("positions", {}).items()
+        }
+        needs_reconciliation = False
+        fills = sorted(fills,
+                       key=lambda fill: (fill.get("time", 0),
+                                         fill.get("tid", 0)))
+        for fill in fills:
+            # Already part of the last reconciled state
+            if fill.get("time", 0) < vault.reconciled_at:
+                continue
+            self.fills += 1
+            coin = fill.get("coin", "")
+            size = get_fill_position_size(fill)
+            position = positions_dict.get(coin)
+            if size == 0:
+                positions_dict.pop(coin, None)
+            elif position is None:
+                needs_reconciliation = True
+            else:
+                position["size"] = size
+                position["direction"] = "LONG" if size >= 0 else "SHORT"
+                position["position_value"] = abs(size) * float(
+                    fill.get("px", 0))
+
+        if self.apply_positions(vault, positions_dict):
+            vault.changes += 1
+        if needs_reconciliation:
+            self.opened_by_fills.add(vault_address)
+            self.reschedule(vault, time.monotonic())
+
+    def print_stats(self):
+        print(
+            "Vault fill tracker: {} fills applied, {} reconciliations, {} drift corrections"
+            .format(self.fills, self.reconciliations, self.corrections))
+        super().print_stats()
+
+    def start_mid_prices(self):
+        # allMids shares the pool with the userFills subscriptions
+        self.mid_prices.subscribe(self.pool)
+
+    def stop_mid_prices(self):
+        pass
+
+    def run(self):
+        self.pool.start()
+        try:
+            super().run()
+        finally:
+            self.pool.stop()
+
+
+def run_vault_daemon(chat_id, use_websocket=False, **poller_kwargs):
+    if use_websocket:
+        poller = VaultFillTracker(chat_id, **poller_kwargs)
+    else:
+        poller = VaultPoller(chat_id, **poller_kwargs)
+
+    def handle_signal(sig, frame):
+        print("Stopping vault poller...")
+        poller.stop()
+
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+    poller.run()
+    print("Vault poller stopped.")
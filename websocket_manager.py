@@ -1,12 +1,27 @@
 import json
 import logging
+import queue
 import threading
-from collections import defaultdict
+import time
+from collections import defaultdict, deque
 
 import websocket
 
+from rate_limiter import backoff_delay
+
 from hyperliquid.utils.types import Any, Callable, Dict, List, NamedTuple, Optional, Subscription, Tuple, WsMsg
 
+# Faster JSON decoders are used for incoming frames when installed
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    try:
+        import ujson
+        json_loads = ujson.loads
+    except ImportError:
+        json_loads = json.loads
+
 ActiveSubscription = NamedTuple("ActiveSubscription",
                                 [("callback", Callable[[Any], None]),
                                  ("subscription_id", int)])
@@ -35,38 +50,237 @@ def subscription_to_identifier(subscription: Subscription) -> str:
         return f'webData2:{subscription["user"].lower()}'
 
 
+def _trades_identifier(ws_msg: WsMsg) -> Optional[str]:
+    trades = ws_msg["data"]
+    if len(trades) == 0:
+        return None
+    else:
+        return f'trades:{trades[0]["coin"].lower()}'
+
+
+# Channel -> identifier extractor, a single dict lookup per frame instead of
+# walking an if/elif chain
+WS_MSG_IDENTIFIER_EXTRACTORS: Dict[str, Callable[[WsMsg], Optional[str]]] = {
+    "pong": lambda ws_msg: "pong",
+    "allMids": lambda ws_msg: "allMids",
+    "l2Book": lambda ws_msg: f'l2Book:{ws_msg["data"]["coin"].lower()}',
+    "trades": _trades_identifier,
+    "user": lambda ws_msg: "userEvents",
+    "userFills":
+    lambda ws_msg: f'userFills:{ws_msg["data"]["user"].lower()}',
+    "candle":
+    lambda ws_msg: f'candle:{ws_msg["data"]["s"].lower()},{ws_msg["data"]["i"]}',
+    "orderUpdates": lambda ws_msg: "orderUpdates",
+    "userFundings":
+    lambda ws_msg: f'userFundings:{ws_msg["data"]["user"].lower()}',
+    "userNonFundingLedgerUpdates":
+    lambda ws_msg:
+    f'userNonFundingLedgerUpdates:{ws_msg["data"]["user"].lower()}',
+    "webData2": lambda ws_msg: f'webData2:{ws_msg["data"]["user"].lower()}',
+}
+
+
 def ws_msg_to_identifier(ws_msg: WsMsg) -> Optional[str]:
-    if ws_msg["channel"] == "pong":
-        return "pong"
-    elif ws_msg["channel"] == "allMids":
-        return "allMids"
-    elif ws_msg["channel"] == "l2Book":
-        return f'l2Book:{ws_msg["data"]["coin"].lower()}'
-    elif ws_msg["channel"] == "trades":
-        trades = ws_msg["data"]
-        if len(trades) == 0:
-            return None
-        else:
-            return f'trades:{trades[0]["coin"].lower()}'
-    elif ws_msg["channel"] == "user":
-        return "userEvents"
-    elif ws_msg["channel"] == "userFills":
-        return f'userFills:{ws_msg["data"]["user"].lower()}'
-    elif ws_msg["channel"] == "candle":
-        return f'candle:{ws_msg["data"]["s"].lower()},{ws_msg["data"]["i"]}'
-    elif ws_msg["channel"] == "orderUpdates":
-        return "orderUpdates"
-    elif ws_msg["channel"] == "userFundings":
-        return f'userFundings:{ws_msg["data"]["user"].lower()}'
-    elif ws_msg["channel"] == "userNonFundingLedgerUpdates":
-        return f'userNonFundingLedgerUpdates:{ws_msg["data"]["user"].lower()}'
-    elif ws_msg["channel"] == "webData2":
-        return f'webData2:{ws_msg["data"]["user"].lower()}'
+    extractor = WS_MSG_IDENTIFIER_EXTRACTORS.get(ws_msg["channel"])
+    if extractor is None:
+        return None
+    return extractor(ws_msg)
+
+
+DISPATCH_INLINE = "inline"
+DISPATCH_QUEUED = "queued"
+
+OVERFLOW_BLOCK = "block"
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+# Replaces the newest queued message, for state channels (l2Book, allMids,
+# webData2) where only the latest message matters
+OVERFLOW_COALESCE = "coalesce"
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_COALESCE)
+
+
+class SubscriptionQueue:
+
+    def __init__(self, identifier: str, callback: Callable[[Any], None],
+                 maxsize: int, overflow_policy: str):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow_policy}")
+        self.identifier = identifier
+        self.callback = callback
+        self.maxsize = max(1, maxsize)
+        self.overflow_policy = overflow_policy
+        self.items: deque = deque()
+        self.not_full = threading.Condition()
+        self.scheduled = False
+        self.closed = False
+        self.max_depth = 0
+        self.enqueued = 0
+        self.dispatched = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def put(self, item: Any) -> bool:
+        # Returns True when the queue has to be handed to a worker
+        with self.not_full:
+            if len(self.items) >= self.maxsize:
+                if self.overflow_policy == OVERFLOW_BLOCK:
+                    while len(self.items) >= self.maxsize and not self.closed:
+                        self.not_full.wait()
+                    if self.closed:
+                        self.dropped += 1
+                        return False
+                elif self.overflow_policy == OVERFLOW_DROP_OLDEST:
+                    self.items.popleft()
+                    self.dropped += 1
+                else:
+                    self.items.pop()
+                    self.coalesced += 1
+            self.items.append(item)
+            self.enqueued += 1
+            self.max_depth = max(self.max_depth, len(self.items))
+            if self.scheduled:
+                return False
+            self.scheduled = True
+            return True
+
+    def pop(self) -> Any:
+        with self.not_full:
+            item = self.items.popleft()
+            self.not_full.notify()
+            return item
+
+    def reschedule(self) -> bool:
+        with self.not_full:
+            self.dispatched += 1
+            if self.items:
+                return True
+            self.scheduled = False
+            return False
+
+    def close(self):
+        with self.not_full:
+            self.closed = True
+            self.not_full.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.not_full:
+            return {
+                "identifier": self.identifier,
+                "queue_depth": len(self.items),
+                "max_depth": self.max_depth,
+                "enqueued": self.enqueued,
+                "dispatched": self.dispatched,
+                "dropped": self.dropped,
+                "coalesced": self.coalesced,
+            }
+
+
+class CallbackDispatcher:
+
+    # Runs subscription callbacks on a worker pool. Each subscription has its
+    # own bounded queue and is drained by at most one worker at a time, so
+    # messages of a subscription are still handled in order. A subscription
+    # can override the overflow policy, e.g. to coalesce a price feed while
+    # the alert subscriptions block.
+
+    def __init__(self, workers: int, queue_size: int, overflow_policy: str):
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        self.overflow_policies: Dict[int, str] = {}
+        self.queues: Dict[int, SubscriptionQueue] = {}
+        self.queues_lock = threading.Lock()
+        self.ready: queue.Queue = queue.Queue()
+        self.workers = [
+            threading.Thread(target=self.work, daemon=True)
+            for _ in range(max(1, workers))
+        ]
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def stop(self):
+        with self.queues_lock:
+            subscription_queues = list(self.queues.values())
+        for subscription_queue in subscription_queues:
+            subscription_queue.close()
+        for _ in self.workers:
+            self.ready.put(None)
+        for worker in self.workers:
+            if worker.is_alive() and worker is not threading.current_thread():
+                worker.join()
+
+    def set_overflow_policy(self, subscription_id: int, overflow_policy: str):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow_policy}")
+        with self.queues_lock:
+            self.overflow_policies[subscription_id] = overflow_policy
+
+    def put(self, identifier: str, active_subscription: ActiveSubscription,
+            ws_msg: WsMsg):
+        subscription_id = active_subscription.subscription_id
+        subscription_queue = self.queues.get(subscription_id)
+        if subscription_queue is None:
+            with self.queues_lock:
+                subscription_queue = self.queues.setdefault(
+                    subscription_id,
+                    SubscriptionQueue(
+                        identifier, active_subscription.callback,
+                        self.queue_size,
+                        self.overflow_policies.get(subscription_id,
+                                                   self.overflow_policy)))
+        if subscription_queue.put(ws_msg):
+            self.ready.put(subscription_queue)
+
+    def remove(self, subscription_id: int):
+        with self.queues_lock:
+            subscription_queue = self.queues.pop(subscription_id, None)
+            self.overflow_policies.pop(subscription_id, None)
+        if subscription_queue is not None:
+            subscription_queue.close()
+
+    def work(self):
+        while True:
+            subscription_queue = self.ready.get()
+            if subscription_queue is None:
+                break
+            ws_msg = subscription_queue.pop()
+            try:
+                subscription_queue.callback(ws_msg)
+            except Exception:
+                logging.exception("Websocket callback for %s failed",
+                                  subscription_queue.identifier)
+            if subscription_queue.reschedule():
+                self.ready.put(subscription_queue)
+
+    def stats(self) -> Dict[int, Dict[str, Any]]:
+        with self.queues_lock:
+            subscription_queues = dict(self.queues)
+        return {
+            subscription_id: subscription_queue.stats()
+            for subscription_id, subscription_queue in
+            subscription_queues.items()
+        }
 
 
 class WebsocketManager(threading.Thread):
 
-    def __init__(self, base_url):
+    # The connection is re-established in place with exponential backoff and
+    # every active subscription is replayed on the new connection.
+    # on_disconnect(error) is called once per lost connection and
+    # on_reconnect(attempts) once it is back; error is None on a clean close.
+
+    def __init__(self,
+                 base_url,
+                 dispatch_mode=DISPATCH_INLINE,
+                 dispatch_workers=2,
+                 dispatch_queue_size=1000,
+                 overflow_policy=OVERFLOW_BLOCK,
+                 reconnect=True,
+                 reconnect_base_delay=1,
+                 reconnect_max_delay=60,
+                 max_reconnect_attempts=None,
+                 on_disconnect: Optional[Callable[[Any], None]] = None,
+                 on_reconnect: Optional[Callable[[int], None]] = None):
         super().__init__()
         self.subscription_id_counter = 0
         self.ws_ready = False
@@ -74,23 +288,80 @@ class WebsocketManager(threading.Thread):
                                               ActiveSubscription]] = []
         self.active_subscriptions: Dict[
             str, List[ActiveSubscription]] = defaultdict(list)
-        ws_url = "ws" + base_url[len("http"):] + "/ws"
-        self.ws = websocket.WebSocketApp(ws_url,
-                                         on_message=self.on_message,
-                                         on_open=self.on_open)
+        # identifier -> subscription, to replay active subscriptions
+        self.subscriptions: Dict[str, Subscription] = {}
+        self.subscriptions_lock = threading.RLock()
+        self.ws_url = "ws" + base_url[len("http"):] + "/ws"
+        self.ws = self.create_ws_app()
         self.ping_sender = threading.Thread(target=self.send_ping)
         self.stop_event = threading.Event()
+        self.reconnect = reconnect
+        self.reconnect_base_delay = reconnect_base_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        self.max_reconnect_attempts = max_reconnect_attempts
+        self.on_disconnect = on_disconnect
+        self.on_reconnect = on_reconnect
+        self.connection_count = 0
+        self.reconnect_attempts = 0
+        self.last_error = None
+        self.dispatcher: Optional[CallbackDispatcher] = None
+        if dispatch_mode == DISPATCH_QUEUED:
+            self.dispatcher = CallbackDispatcher(dispatch_workers,
+                                                 dispatch_queue_size,
+                                                 overflow_policy)
+        elif dispatch_mode != DISPATCH_INLINE:
+            raise ValueError(f"Unknown dispatch mode {dispatch_mode}")
+
+    def create_ws_app(self):
+        return websocket.WebSocketApp(self.ws_url,
+                                      on_message=self.on_message,
+                                      on_open=self.on_open,
+                                      on_close=self.on_close,
+                                      on_error=self.on_error)
 
     def run(self):
+        if self.dispatcher:
+            self.dispatcher.start()
         self.ping_sender.start()
-        self.ws.run_forever()
+        while not self.stop_event.is_set():
+            connected_at = time.monotonic()
+            self.last_error = None
+            self.ws.run_forever()
+            was_ready = self.ws_ready
+            self.ws_ready = False
+            if self.stop_event.is_set():
+                break
+            if was_ready:
+                if self.on_disconnect:
+                    self.on_disconnect(self.last_error)
+                # Only back off from scratch after a connection that held
+                if time.monotonic() - connected_at > self.reconnect_max_delay:
+                    self.reconnect_attempts = 0
+            if not self.reconnect or (
+                    self.max_reconnect_attempts is not None and
+                    self.reconnect_attempts >= self.max_reconnect_attempts):
+                break
+            delay = backoff_delay(self.reconnect_attempts,
+                                  self.reconnect_base_delay,
+                                  self.reconnect_max_delay)
+            self.reconnect_attempts += 1
+            print("Websocket disconnected, reconnect attempt {} in {:.1f}s".
+                  format(self.reconnect_attempts, delay))
+            if self.stop_event.wait(delay):
+                break
+            self.ws = self.create_ws_app()
+        # Lets send_ping exit without waiting for its next tick
+        self.stop_event.set()
 
     def send_ping(self):
         while not self.stop_event.wait(50):
-            if not self.ws.keep_running:
-                break
+            if not self.ws_ready:
+                continue
             logging.debug("Websocket sending ping")
-            self.ws.send(json.dumps({"method": "ping"}))
+            try:
+                self.ws.send(json.dumps({"method": "ping"}))
+            except websocket.WebSocketException as e:
+                logging.debug("Websocket ping failed: %s", e)
         logging.debug("Websocket ping sender stopped")
 
     def stop(self):
@@ -98,13 +369,20 @@ class WebsocketManager(threading.Thread):
         self.ws.close()
         if self.ping_sender.is_alive():
             self.ping_sender.join()
+        if self.dispatcher:
+            self.dispatcher.stop()
+
+    def get_dispatch_stats(self) -> Dict[int, Dict[str, Any]]:
+        if not self.dispatcher:
+            return {}
+        return self.dispatcher.stats()
 
     def on_message(self, _ws, message):
         if message == "Websocket connection established.":
             logging.debug(message)
             return
-        logging.debug(f"on_message {message}")
-        ws_msg: WsMsg = json.loads(message)
+        logging.debug("on_message %s", message)
+        ws_msg: WsMsg = json_loads(message)
         identifier = ws_msg_to_identifier(ws_msg)
         if identifier == "pong":
             logging.debug("Websocket received pong")
@@ -116,61 +394,115 @@ class WebsocketManager(threading.Thread):
         if len(active_subscriptions) == 0:
             print("Websocket message from an unexpected subscription:",
                   message, identifier)
+        elif self.dispatcher:
+            for active_subscription in active_subscriptions:
+                self.dispatcher.put(identifier, active_subscription, ws_msg)
         else:
             for active_subscription in active_subscriptions:
                 active_subscription.callback(ws_msg)
 
     def on_open(self, _ws):
         logging.debug("on_open")
-        self.ws_ready = True
-        for subscription, active_subscription in self.queued_subscriptions:
-            self.subscribe(subscription, active_subscription.callback,
-                           active_subscription.subscription_id)
+        if self.stop_event.is_set():
+            self.ws.close()
+            return
+        with self.subscriptions_lock:
+            self.ws_ready = True
+            self.connection_count += 1
+            # Replay what was active on the previous connection, then what
+            # was subscribed while disconnected
+            for identifier, active_subscriptions in list(
+                    self.active_subscriptions.items()):
+                if active_subscriptions:
+                    self.send_subscription("subscribe",
+                                           self.subscriptions[identifier])
+            queued_subscriptions = self.queued_subscriptions
+            self.queued_subscriptions = []
+            for subscription, active_subscription in queued_subscriptions:
+                self.subscribe(subscription, active_subscription.callback,
+                               active_subscription.subscription_id)
+        if self.connection_count > 1:
+            print("Websocket reconnected after {} attempt(s)".format(
+                self.reconnect_attempts))
+            if self.on_reconnect:
+                self.on_reconnect(self.reconnect_attempts)
 
-    def subscribe(self,
-                  subscription: Subscription,
-                  callback: Callable[[Any], None],
-                  subscription_id: Optional[int] = None) -> int:
-        if subscription_id is None:
-            self.subscription_id_counter += 1
-            subscription_id = self.subscription_id_counter
-        if not self.ws_ready:
-            logging.debug("enqueueing subscription")
-            self.queued_subscriptions.append(
-                (subscription, ActiveSubscription(callback, subscription_id)))
-        else:
-            logging.debug("subscribing")
-            identifier = subscription_to_identifier(subscription)
-            if identifier == "userEvents" or identifier == "orderUpdates":
-                # TODO: ideally the userEvent and orderUpdates messages would include the user so that we can multiplex
-                if len(self.active_subscriptions[identifier]) != 0:
-                    raise NotImplementedError(
-                        f"Cannot subscribe to {identifier} multiple times")
-            self.active_subscriptions[identifier].append(
-                ActiveSubscription(callback, subscription_id))
+    def on_close(self, _ws, close_status_code, close_msg):
+        logging.debug("on_close %s %s", close_status_code, close_msg)
+
+    def on_error(self, _ws, error):
+        logging.debug("on_error %s", error)
+        self.last_error = error
+
+    def send_subscription(self, method: str, subscription: Subscription):
+        try:
             self.ws.send(
                 json.dumps({
-                    "method": "subscribe",
+                    "method": method,
                     "subscription": subscription
                 }))
-        return subscription_id
+        except websocket.WebSocketException as e:
+            # The subscription is replayed once the connection is back
+            logging.debug("Websocket %s failed: %s", method, e)
+
+    def subscribe(self,
+                  subscription: Subscription,
+                  callback: Callable[[Any], None],
+                  subscription_id: Optional[int] = None,
+                  overflow_policy: Optional[str] = None) -> int:
+        # overflow_policy overrides the manager's policy for this
+        # subscription; callbacks run inline have no queue to overflow
+        with self.subscriptions_lock:
+            if subscription_id is None:
+                self.subscription_id_counter += 1
+                subscription_id = self.subscription_id_counter
+            if overflow_policy is not None and self.dispatcher:
+                self.dispatcher.set_overflow_policy(subscription_id,
+                                                    overflow_policy)
+            if not self.ws_ready:
+                logging.debug("enqueueing subscription")
+                self.queued_subscriptions.append(
+                    (subscription,
+                     ActiveSubscription(callback, subscription_id)))
+            else:
+                logging.debug("subscribing")
+                identifier = subscription_to_identifier(subscription)
+                if identifier == "userEvents" or identifier == "orderUpdates":
+                    # TODO: ideally the userEvent and orderUpdates messages would include the user so that we can multiplex
+                    if len(self.active_subscriptions[identifier]) != 0:
+                        raise NotImplementedError(
+                            f"Cannot subscribe to {identifier} multiple times")
+                self.subscriptions[identifier] = subscription
+                self.active_subscriptions[identifier].append(
+                    ActiveSubscription(callback, subscription_id))
+                self.send_subscription("subscribe", subscription)
+            return subscription_id
 
     def unsubscribe(self, subscription: Subscription,
                     subscription_id: int) -> bool:
-        if not self.ws_ready:
-            raise NotImplementedError(
-                "Can't unsubscribe before websocket connected")
-        identifier = subscription_to_identifier(subscription)
-        active_subscriptions = self.active_subscriptions[identifier]
-        new_active_subscriptions = [
-            x for x in active_subscriptions
-            if x.subscription_id != subscription_id
-        ]
-        if len(new_active_subscriptions) == 0:
-            self.ws.send(
-                json.dumps({
-                    "method": "unsubscribe",
-                    "subscription": subscription
-                }))
-        self.active_subscriptions[identifier] = new_active_subscriptions
-        return len(active_subscriptions) != len(new_active_subscriptions)
+        with self.subscriptions_lock:
+            identifier = subscription_to_identifier(subscription)
+            active_subscriptions = self.active_subscriptions[identifier]
+            new_active_subscriptions = [
+                x for x in active_subscriptions
+                if x.subscription_id != subscription_id
+            ]
+            queued_subscriptions = [
+                x for x in self.queued_subscriptions
+                if x[1].subscription_id != subscription_id
+            ]
+            removed = (len(active_subscriptions) !=
+                       len(new_active_subscriptions) or
+                       len(queued_subscriptions) != len(
+                           self.queued_subscriptions))
+            self.queued_subscriptions = queued_subscriptions
+            # Before the first connection or while disconnected, dropping it
+            # from the queued and active subscriptions is enough to keep it
+            # from being sent or replayed
+            if (active_subscriptions and len(new_active_subscriptions) == 0
+                    and self.ws_ready):
+                self.send_subscription("unsubscribe", subscription)
+            self.active_subscriptions[identifier] = new_active_subscriptions
+        if self.dispatcher:
+            self.dispatcher.remove(subscription_id)
+        return removed
@@ -0,0 +1,234 @@
+import hashlib
+import threading
+import time
+
+from websocket_manager import WebsocketManager, subscription_to_identifier
+
+from hyperliquid.utils.types import Any, Callable, Dict, List, Optional, Subscription, Tuple
+
+
+def subscription_shard_key(subscription: Subscription) -> str:
+    # Subscriptions of the same address (or coin) land on the same shard
+    return (subscription.get("user") or subscription.get("coin")
+            or subscription["type"]).lower()
+
+
+def rendezvous_order(key: str, shard_ids: List[int]) -> List[int]:
+    # Highest random weight hashing: when a shard disappears, only its own
+    # subscriptions move, each to its next preferred shard
+    return sorted(shard_ids,
+                  key=lambda shard_id: hashlib.blake2b(
+                      f"{key}:{shard_id}".encode(), digest_size=8).digest(),
+                  reverse=True)
+
+
+class WebsocketShard:
+
+    def __init__(self, shard_id: int, manager: WebsocketManager):
+        self.shard_id = shard_id
+        self.manager = manager
+        self.subscription_ids: set = set()
+        self.messages = 0
+        self.last_messages = 0
+        self.last_rate_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def is_alive(self) -> bool:
+        return self.manager.is_alive()
+
+    def count_message(self):
+        with self.lock:
+            self.messages += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            now = time.monotonic()
+            elapsed = now - self.last_rate_time
+            rate = (self.messages - self.last_messages) / elapsed if elapsed > 0 else 0
+            self.last_messages = self.messages
+            self.last_rate_time = now
+            return {
+                "alive": self.is_alive(),
+                "subscriptions": len(self.subscription_ids),
+                "messages": self.messages,
+                "messages_per_second": rate,
+            }
+
+
+class WebsocketPool:
+
+    # Shards subscriptions across several WebsocketManager connections by
+    # address hash, behind the same subscribe/unsubscribe API as a single
+    # manager. Subscriptions of a dead shard are moved to the surviving ones
+    # and a replacement shard is started for new subscriptions. Each
+    # manager first tries to reconnect in place; a shard counts as dead once
+    # it has used up max_reconnect_attempts.
+
+    def __init__(self,
+                 base_url: str,
+                 shards: int = 4,
+                 max_subscriptions_per_shard: int = 1000,
+                 check_interval: float = 5,
+                 replace_dead_shards: bool = True,
+                 **manager_kwargs):
+        self.base_url = base_url
+        self.max_subscriptions_per_shard = max_subscriptions_per_shard
+        self.check_interval = check_interval
+        self.replace_dead_shards = replace_dead_shards
+        manager_kwargs.setdefault("max_reconnect_attempts", 5)
+        self.manager_kwargs = manager_kwargs
+        self.shards: Dict[int, WebsocketShard] = {}
+        self.next_shard_id = 0
+        self.subscription_id_counter = 0
+        # pool subscription id -> (subscription, callback, shard id,
+        # manager subscription id)
+        self.subscriptions: Dict[int, Tuple[Subscription, Callable[[Any], None],
+                                            int, int]] = {}
+        # pool subscription id -> overflow policy overriding the managers'
+        self.overflow_policies: Dict[int, str] = {}
+        self.lock = threading.RLock()
+        self.stop_event = threading.Event()
+        self.monitor = threading.Thread(target=self.monitor_shards,
+                                        daemon=True)
+        for _ in range(max(1, shards)):
+            self.add_shard()
+
+    def add_shard(self) -> WebsocketShard:
+        with self.lock:
+            shard_id = self.next_shard_id
+            self.next_shard_id += 1
+            shard = WebsocketShard(
+                shard_id, WebsocketManager(self.base_url,
+                                           **self.manager_kwargs))
+            self.shards[shard_id] = shard
+            if self.monitor.is_alive():
+                shard.manager.start()
+            return shard
+
+    def start(self):
+        with self.lock:
+            for shard in self.shards.values():
+                shard.manager.start()
+        self.monitor.start()
+
+    def stop(self):
+        self.stop_event.set()
+        with self.lock:
+            shards = list(self.shards.values())
+        for shard in shards:
+            shard.manager.stop()
+        if self.monitor.is_alive():
+            self.monitor.join()
+
+    def pick_shard(self, subscription: Subscription,
+                   exclude: Optional[int] = None) -> WebsocketShard:
+        shard_ids = [
+            shard_id for shard_id in self.shards if shard_id != exclude
+        ]
+        if not shard_ids:
+            raise RuntimeError("No websocket shard available")
+        preferred = rendezvous_order(subscription_shard_key(subscription),
+                                     shard_ids)
+        for shard_id in preferred:
+            shard = self.shards[shard_id]
+            if len(shard.subscription_ids
+                   ) < self.max_subscriptions_per_shard:
+                return shard
+        raise RuntimeError(
+            "All websocket shards reached max_subscriptions_per_shard")
+
+    def subscribe_on_shard(self,
+                           shard: WebsocketShard,
+                           subscription: Subscription,
+                           callback: Callable[[Any], None],
+                           overflow_policy: Optional[str] = None) -> int:
+
+        def counted_callback(ws_msg):
+            shard.count_message()
+            callback(ws_msg)
+
+        return shard.manager.subscribe(subscription,
+                                       counted_callback,
+                                       overflow_policy=overflow_policy)
+
+    def subscribe(self,
+                  subscription: Subscription,
+                  callback: Callable[[Any], None],
+                  overflow_policy: Optional[str] = None) -> int:
+        with self.lock:
+            shard = self.pick_shard(subscription)
+            self.subscription_id_counter += 1
+            subscription_id = self.subscription_id_counter
+            manager_subscription_id = self.subscribe_on_shard(
+                shard, subscription, callback, overflow_policy)
+            if overflow_policy is not None:
+                self.overflow_policies[subscription_id] = overflow_policy
+            shard.subscription_ids.add(subscription_id)
+            self.subscriptions[subscription_id] = (subscription, callback,
+                                                   shard.shard_id,
+                                                   manager_subscription_id)
+            return subscription_id
+
+    def unsubscribe(self, subscription: Subscription,
+                    subscription_id: int) -> bool:
+        with self.lock:
+            entry = self.subscriptions.pop(subscription_id, None)
+            self.overflow_policies.pop(subscription_id, None)
+            if entry is None:
+                return False
+            _, _, shard_id, manager_subscription_id = entry
+            shard = self.shards.get(shard_id)
+            if shard is None:
+                return True
+            shard.subscription_ids.discard(subscription_id)
+            return shard.manager.unsubscribe(subscription,
+                                             manager_subscription_id)
+
+    def rebalance_dead_shard(self, dead_shard: WebsocketShard):
+        with self.lock:
+            print("Websocket shard {} died, moving {} subscription(s)...".
+                  format(dead_shard.shard_id,
+                         len(dead_shard.subscription_ids)))
+            del self.shards[dead_shard.shard_id]
+            dead_shard.manager.stop()
+
+            if self.replace_dead_shards or not self.shards:
+                self.add_shard()
+
+            for subscription_id in sorted(dead_shard.subscription_ids):
+                subscription, callback, _, _ = self.subscriptions[
+                    subscription_id]
+                shard = self.pick_shard(subscription)
+                manager_subscription_id = self.subscribe_on_shard(
+                    shard, subscription, callback,
+                    self.overflow_policies.get(subscription_id))
+                shard.subscription_ids.add(subscription_id)
+                self.subscriptions[subscription_id] = (
+                    subscription, callback, shard.shard_id,
+                    manager_subscription_id)
+
+    def monitor_shards(self):
+        while not self.stop_event.wait(self.check_interval):
+            with self.lock:
+                dead_shards = [
+                    shard for shard in self.shards.values()
+                    if not shard.is_alive()
+                ]
+            for dead_shard in dead_shards:
+                if self.stop_event.is_set():
+                    break
+                self.rebalance_dead_shard(dead_shard)
+
+    def get_shard_stats(self) -> Dict[int, Dict[str, Any]]:
+        # Message rates are measured since the previous call
+        with self.lock:
+            shards = list(self.shards.values())
+        return {shard.shard_id: shard.stats() for shard in shards}
+
+    def get_identifier_shards(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                subscription_to_identifier(subscription): shard_id
+                for subscription, _, shard_id, _ in
+                self.subscriptions.values()
+            }
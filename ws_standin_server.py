@@ -0,0 +1,243 @@
+import base64
+import hashlib
+import json
+import socket
+import socketserver
+import struct
+import threading
+import time
+import argparse
+from websocket_manager import subscription_to_identifier
+
+# Minimal local stand-in for the Hyperliquid websocket endpoint (stdlib only,
+# text frames, no extensions). It accepts subscribe/unsubscribe/ping
+# requests the same way the real server does and lets the caller publish
+# messages to the matching subscribers, for benchmarks and manual testing.
+
+WS_MAGIC = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def encode_frame(payload, opcode=0x1):
+    header = bytes([0x80 | opcode])
+    length = len(payload)
+    if length < 126:
+        header += bytes([length])
+    elif length < 2**16:
+        header += bytes([126]) + struct.pack("!H", length)
+    else:
+        header += bytes([127]) + struct.pack("!Q", length)
+    return header + payload
+
+
+def recv_exactly(sock, n):
+    data = b""
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        data += chunk
+    return data
+
+
+def read_frame(sock):
+    first, second = recv_exactly(sock, 2)
+    opcode = first & 0x0F
+    masked = second & 0x80
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack("!H", recv_exactly(sock, 2))[0]
+    elif length == 127:
+        length = struct.unpack("!Q", recv_exactly(sock, 8))[0]
+    mask = recv_exactly(sock, 4) if masked else b"\x00\x00\x00\x00"
+    payload = bytearray(recv_exactly(sock, length))
+    for i in range(length):
+        payload[i] ^= mask[i % 4]
+    return opcode, bytes(payload)
+
+
+class StandinConnection:
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.identifiers = set()
+        self.send_lock = threading.Lock()
+        self.closed = False
+        self.messages_sent = 0
+
+    def send_json(self, data):
+        self.send_text(json.dumps(data))
+
+    def send_text(self, text):
+        frame = encode_frame(text.encode("utf-8"))
+        with self.send_lock:
+            if self.closed:
+                return
+            try:
+                self.sock.sendall(frame)
+                self.messages_sent += 1
+            except OSError:
+                self.closed = True
+
+    def close(self):
+        with self.send_lock:
+            if self.closed:
+                return
+            self.closed = True
+            try:
+                self.sock.sendall(encode_frame(b"", opcode=0x8))
+            except OSError:
+                pass
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class StandinRequestHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        request = b""
+        while b"\r\n\r\n" not in request:
+            chunk = self.request.recv(4096)
+            if not chunk:
+                return
+            request += chunk
+
+        headers = {}
+        for line in request.decode("latin-1").split("\r\n")[1:]:
+            if ":" in line:
+                key, value = line.split(":", 1)
+                headers[key.strip().lower()] = value.strip()
+
+        accept = base64.b64encode(
+            hashlib.sha1((headers.get("sec-websocket-key", "") +
+                          WS_MAGIC).encode()).digest()).decode()
+        self.request.sendall(
+            ("HTTP/1.1 101 Switching Protocols\r\n"
+             "Upgrade: websocket\r\n"
+             "Connection: Upgrade\r\n"
+             f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+
+        connection = StandinConnection(self.request)
+        self.server.add_connection(connection)
+        connection.send_text("Websocket connection established.")
+
+        try:
+            while not connection.closed:
+                opcode, payload = read_frame(self.request)
+                if opcode == 0x8:
+                    break
+                if opcode == 0x9:
+                    with connection.send_lock:
+                        self.request.sendall(encode_frame(payload, 0xA))
+                    continue
+                if opcode != 0x1:
+                    continue
+                self.server.handle_request_message(connection,
+                                                   json.loads(payload))
+        except (ConnectionError, OSError, ValueError):
+            pass
+        finally:
+            connection.closed = True
+            self.server.remove_connection(connection)
+
+
+class StandinWebsocketServer(socketserver.ThreadingTCPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0):
+        super().__init__((host, port), StandinRequestHandler)
+        self.connections = []
+        self.connections_lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        for connection in self.get_connections():
+            connection.close()
+        self.shutdown()
+        self.server_close()
+
+    def add_connection(self, connection):
+        with self.connections_lock:
+            self.connections.append(connection)
+
+    def remove_connection(self, connection):
+        with self.connections_lock:
+            if connection in self.connections:
+                self.connections.remove(connection)
+
+    def get_connections(self):
+        with self.connections_lock:
+            return list(self.connections)
+
+    def handle_request_message(self, connection, request):
+        method = request.get("method")
+        if method == "ping":
+            connection.send_json({"channel": "pong"})
+        elif method in ("subscribe", "unsubscribe"):
+            subscription = request.get("subscription", {})
+            identifier = subscription_to_identifier(subscription)
+            if method == "subscribe":
+                connection.identifiers.add(identifier)
+            else:
+                connection.identifiers.discard(identifier)
+            connection.send_json({
+                "channel": "subscriptionResponse",
+                "data": request
+            })
+
+    def publish(self, identifier, ws_msg):
+        # Sends ws_msg to every connection subscribed to identifier
+        text = json.dumps(ws_msg)
+        sent = 0
+        for connection in self.get_connections():
+            if identifier in connection.identifiers:
+                connection.send_text(text)
+                sent += 1
+        return sent
+
+    def publish_user_fill(self, user, fill):
+        return self.publish(f"userFills:{user.lower()}", {
+            "channel": "userFills",
+            "data": {
+                "user": user,
+                "fills": [fill]
+            }
+        })
+
+    def wait_for_subscriptions(self, count, timeout=10):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if sum(
+                    len(connection.identifiers)
+                    for connection in self.get_connections()) >= count:
+                return True
+            time.sleep(0.05)
+        return False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run a local stand-in Hyperliquid websocket server.")
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    server = StandinWebsocketServer(port=args.port).start()
+    print(f"Stand-in websocket server listening on {server.base_url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()